@@ -0,0 +1,5 @@
+"""Helpers for the Best Bee Friends mapping application.
+
+Route handlers live in :mod:`main`, the modules in this package hold the logic
+they share: geospatial indexing, caches and storage.
+"""
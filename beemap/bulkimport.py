@@ -0,0 +1,421 @@
+"""Bulk import of hives from CSV, GeoJSON or NDJSON files.
+
+Import is streaming, so files of any size are read with constant memory,
+apart from the keys used for deduplication:
+
+- Rows are read one at a time, validated into :class:`Hive`, and rows
+  repeating an earlier row or an already stored hive are skipped.
+- Hives are written in chunks of `chunk_size`, one ``save_many()`` call
+  (``put_multi()`` for datastore) each, by a bounded pool of threads. Reading
+  waits when all threads are busy, so chunks don't pile up in memory.
+- Rows of written chunks are recorded in a :class:`Checkpoint` file. An
+  interrupted import started again with the same file skips them.
+
+Rows are numbered from 1 in the order they are read: data lines for CSV and
+NDJSON, and features for GeoJSON.
+"""
+
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+import csv
+import json
+import logging
+import os
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import TextIO
+from typing import Tuple
+
+from .hives import Hive
+from .storage import HiveRepository
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "geojson", "ndjson")
+
+# Accepted column names, first one is the canonical one.
+_ALIASES = {
+    "latitude": ("latitude", "lat"),
+    "longitude": ("longitude", "lon", "lng"),
+    "firstname": ("firstname", "first_name"),
+    "familyname": ("familyname", "family_name", "lastname", "last_name"),
+    "email": ("email",),
+}
+
+
+def guess_format(path: str) -> str:
+    """Format from file extension.
+
+    :raises ValueError: If extension is not known.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    formats = {".csv": "csv", ".geojson": "geojson", ".json": "geojson", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+    if extension not in formats:
+        raise ValueError(f"Can't tell format of {path!r}, give it explicitly")
+    return formats[extension]
+
+
+def read_rows(stream: TextIO, fmt: str) -> Iterator[Tuple[int, object]]:
+    """Yield row numbers and rows from `stream` as they are read.
+
+    Rows are dicts for CSV, and parsed JSON values for others. A line that
+    isn't valid JSON is yielded as the :class:`ValueError` it raised, so it
+    can be reported as a bad row.
+    """
+    if fmt == "csv":
+        yield from enumerate(csv.DictReader(stream), 1)
+    elif fmt == "ndjson":
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, e
+    elif fmt == "geojson":
+        yield from enumerate(_features(stream), 1)
+    else:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+
+
+def _features(stream: TextIO, chunk_size: int = 65536) -> Iterator[object]:
+    """Yield features of a GeoJSON `FeatureCollection` one at a time, without reading all of it.
+
+    Looks for the first ``"features"`` key, so it should come before other
+    members with features in them, as it does in files written by this app.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        if eof:
+            return False
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    def skip(characters: str):
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or not fill():
+                return
+
+    # Find start of features array.
+    while True:
+        index = buffer.find('"features"', position)
+        if index >= 0:
+            position = index + len('"features"')
+            break
+        position = max(position, len(buffer) - len('"features"'))
+        if not fill():
+            raise ValueError("No features in GeoJSON")
+    skip(" \t\r\n:")
+    if buffer[position:position + 1] != "[":
+        raise ValueError("GeoJSON features is not a list")
+    position += 1
+
+    while True:
+        skip(" \t\r\n,")
+        if buffer[position:position + 1] == "]":
+            return
+        if position >= len(buffer):
+            raise ValueError("GeoJSON ended in the middle of features")
+        while True:
+            try:
+                feature, end = decoder.raw_decode(buffer, position)
+                break
+            except ValueError:
+                # Feature continues in the next chunk.
+                if not fill():
+                    raise ValueError("GeoJSON ended in the middle of a feature")
+        position = end
+        yield feature
+
+
+def hive_from_row(row) -> Hive:
+    """Validate row into new :class:`Hive`.
+
+    Row is a CSV or JSON object with `latitude`, `longitude`, `firstname`,
+    and optionally `familyname` and `email`, or a GeoJSON point feature with
+    them as properties.
+
+    :raises ValueError: If row is not a valid hive.
+    """
+    if isinstance(row, Exception):
+        raise ValueError(f"Invalid JSON: {row!s}")
+    if not isinstance(row, dict):
+        raise ValueError("Row is not an object")
+
+    if row.get("type") == "Feature":
+        geometry = row.get("geometry") or {}
+        if geometry.get("type") != "Point":
+            raise ValueError("Feature is not a point")
+        try:
+            lon, lat = geometry["coordinates"][:2]
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Point has no coordinates")
+        row = dict(row.get("properties") or {}, latitude=lat, longitude=lon)
+
+    values = {}
+    for name, aliases in _ALIASES.items():
+        values[name] = next((row[alias] for alias in aliases if row.get(alias) not in (None, "")), None)
+
+    try:
+        latitude = float(values["latitude"])
+        longitude = float(values["longitude"])
+    except (TypeError, ValueError):
+        raise ValueError("latitude and longitude must be numbers")
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        raise ValueError("latitude or longitude is out of range")
+
+    firstname = str(values["firstname"] or "").strip()
+    if not firstname:
+        raise ValueError("firstname is required")
+    email = str(values["email"]).strip() if values["email"] else None
+    if email is not None and "@" not in email:
+        raise ValueError("email is not valid")
+
+    return Hive(None, latitude, longitude, firstname, str(values["familyname"] or "").strip(), email)
+
+
+def dedupe_key(hive: Hive) -> tuple:
+    """Hives with the same key are the same hive. Coordinates are compared at about 10 cm."""
+    return (
+        round(hive.latitude, 6),
+        round(hive.longitude, 6),
+        (hive.firstname or "").casefold(),
+        (hive.familyname or "").casefold(),
+    )
+
+
+class Checkpoint:
+    """Rows written by an import, saved into a JSON file after every chunk.
+
+    :param path: Checkpoint file.
+    :param source: Identifies the imported file, so a checkpoint isn't used with another file.
+    """
+
+    def __init__(self, path: str, source: dict):
+        self.path = path
+        self.source = source
+        # All rows up to this one are written.
+        self.done_until = 0
+        # Written rows after `done_until`, as inclusive ranges.
+        self.done: List[Tuple[int, int]] = []
+
+    @classmethod
+    def load(cls, path: str, source: dict) -> "Checkpoint":
+        """Load checkpoint, or start a new one if there is none.
+
+        :raises ValueError: If the checkpoint is of another file.
+        """
+        checkpoint = cls(path, source)
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return checkpoint
+
+        if data.get("source") != source:
+            raise ValueError(f"Checkpoint {path} is of another import, source was {data.get('source')}")
+        checkpoint.done_until = data["done_until"]
+        checkpoint.done = [tuple(rows) for rows in data["done"]]
+        return checkpoint
+
+    def is_done(self, row: int) -> bool:
+        return row <= self.done_until or any(first <= row <= last for first, last in self.done)
+
+    def mark(self, rows: Tuple[int, int]):
+        """Record rows from first to last as written, and save."""
+        self.done.append(rows)
+        self.done.sort()
+        # Merge ranges that continue from `done_until`.
+        while self.done and self.done[0][0] <= self.done_until + 1:
+            self.done_until = max(self.done_until, self.done.pop(0)[1])
+        self.save()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"source": self.source, "done_until": self.done_until, "done": self.done}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class ImportStats:
+    """Counters of an import."""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.read = 0
+        self.imported = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.chunks = 0
+
+    @property
+    def elapsed(self) -> float:
+        return self.clock() - self.started
+
+    @property
+    def rate(self) -> float:
+        """Rows read per second."""
+        return self.read / max(self.elapsed, 1e-9)
+
+    def summary(self) -> str:
+        return (f"{self.read} rows in {self.elapsed:.1f}s, {self.rate:.0f} rows/s: {self.imported} imported, "
+                f"{self.skipped} already imported, {self.duplicates} duplicates, {self.invalid} invalid")
+
+
+class BulkImporter:
+    """Write rows into storage in parallel chunks.
+
+    :param repository: Where hives are saved.
+    :param chunk_size: Hives per ``save_many()`` call.
+    :param workers: Chunks written at once.
+    :param checkpoint: Progress record. Without one, interrupted import starts over.
+    :param existing: Dedupe keys of stored hives, see :func:`dedupe_key`.
+    :param on_invalid: Called with row number and error for invalid rows.
+    :param on_progress: Called with :class:`ImportStats` after every chunk.
+    """
+
+    def __init__(self, repository: HiveRepository, chunk_size: int = 500, workers: int = 4,
+                 checkpoint: Optional[Checkpoint] = None, existing: Iterable[tuple] = (),
+                 on_invalid: Optional[Callable[[int, Exception], None]] = None,
+                 on_progress: Optional[Callable[[ImportStats], None]] = None):
+        self.repository = repository
+        self.chunk_size = max(1, chunk_size)
+        self.workers = max(1, workers)
+        self.checkpoint = checkpoint
+        self.seen: Set[tuple] = set(existing)
+        self.on_invalid = on_invalid
+        self.on_progress = on_progress
+        self.stats = ImportStats()
+
+    def _hives(self, rows: Iterable[Tuple[int, object]]) -> Iterator[Tuple[int, Hive]]:
+        """Valid, new hives of rows not yet imported."""
+        for number, row in rows:
+            self.stats.read += 1
+            done = self.checkpoint is not None and self.checkpoint.is_done(number)
+            try:
+                hive = hive_from_row(row)
+            except ValueError as e:
+                if done:
+                    # Reported already by the run which imported the rows around it.
+                    self.stats.skipped += 1
+                    continue
+                self.stats.invalid += 1
+                if self.on_invalid:
+                    self.on_invalid(number, e)
+                continue
+
+            # Imported rows are remembered too, so later duplicates of them are caught.
+            key = dedupe_key(hive)
+            if done:
+                self.seen.add(key)
+                self.stats.skipped += 1
+                continue
+            if key in self.seen:
+                self.stats.duplicates += 1
+                continue
+            self.seen.add(key)
+            yield number, hive
+
+    def _chunks(self, hives: Iterator[Tuple[int, Hive]]) -> Iterator[Tuple[Tuple[int, int], List[Hive]]]:
+        """Chunks of hives with the range of rows they cover.
+
+        Range starts after the previous chunk, so skipped rows between
+        chunks are covered too, and checkpointed ranges join up.
+        """
+        chunk: List[Hive] = []
+        last = 0
+        for number, hive in hives:
+            chunk.append(hive)
+            if len(chunk) >= self.chunk_size:
+                yield (last + 1, number), chunk
+                chunk, last = [], number
+        if chunk:
+            yield (last + 1, number), chunk
+
+    def run(self, rows: Iterable[Tuple[int, object]]) -> ImportStats:
+        """Import rows, returning when all are written.
+
+        Chunks are written in worker threads, and checkpointed in the calling
+        thread as they complete.
+
+        :raises Exception: What storage raised for a failed chunk. Chunks
+            already running are finished and checkpointed first, others are
+            left for the next run.
+        """
+        pending: Dict[Future, Tuple[int, int]] = {}
+        error = None
+
+        def finish(done: Iterable[Future]):
+            nonlocal error
+            for future in done:
+                covered = pending.pop(future)
+                try:
+                    saved = future.result()
+                except Exception as e:
+                    logger.error("Importing rows %d-%d failed: %s", covered[0], covered[1], e)
+                    error = error or e
+                    continue
+                self.stats.imported += len(saved)
+                self.stats.chunks += 1
+                if self.checkpoint:
+                    self.checkpoint.mark(covered)
+                if self.on_progress:
+                    self.on_progress(self.stats)
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="bulk-import") as executor:
+            for covered, chunk in self._chunks(self._hives(rows)):
+                # Wait for a free worker, so that read chunks don't pile up.
+                while len(pending) >= self.workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    finish(done)
+                if error is not None:
+                    break
+                pending[executor.submit(self.repository.save_many, chunk)] = covered
+
+            finish(wait(pending).done)
+
+        if error is not None:
+            raise error
+        return self.stats
+
+
+def source_of(path: str) -> dict:
+    """Identity of file for :class:`Checkpoint`. Changed file is another source."""
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+
+def open_source(path: str, fmt: str) -> TextIO:
+    """Open file for :func:`read_rows`. BOM written by spreadsheets is skipped."""
+    return open(path, encoding="utf-8-sig", newline="" if fmt == "csv" else None)
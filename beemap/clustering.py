@@ -0,0 +1,170 @@
+"""Server-side grid clustering of hives.
+
+Hives are binned into a grid of `CELL_SIZE` pixel cells on every zoom level.
+Grid on zoom level `z` is exactly the grid of level ``z + 1`` with cells merged
+two by two, so the whole hierarchy is built once from the finest level by
+aggregating cells, and each level costs only as much as it has clusters.
+
+:see: https://wiki.openstreetmap.org/wiki/Zoom_levels
+"""
+
+import math
+import threading
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+from .geo import BBox
+from .geo import mercator
+from .hives import Hive
+
+# Map tiles are 256 pixels. Cluster cell size in pixels.
+TILE_SIZE = 256
+CELL_SIZE = 64
+
+# Cells per tile edge, as a power of two.
+CELL_SHIFT = int(math.log2(TILE_SIZE // CELL_SIZE))
+
+Cell = Tuple[int, int]
+
+
+class Cluster:
+    """Group of hives within one grid cell."""
+    __slots__ = ("count", "sum_lat", "sum_lon", "hive_id")
+
+    def __init__(self, count: int = 0, sum_lat: float = 0.0, sum_lon: float = 0.0, hive_id=None):
+        self.count = count
+        self.sum_lat = sum_lat
+        self.sum_lon = sum_lon
+        # Id of a single hive, if cluster has only one.
+        self.hive_id = hive_id
+
+    def merge(self, other: "Cluster"):
+        self.count += other.count
+        self.sum_lat += other.sum_lat
+        self.sum_lon += other.sum_lon
+        self.hive_id = None
+
+    def to_dict(self) -> dict:
+        data = {
+            "lat": self.sum_lat / self.count,
+            "lon": self.sum_lon / self.count,
+            "count": self.count,
+        }
+        if self.hive_id is not None:
+            data["id"] = self.hive_id
+        return data
+
+
+class ClusterIndex:
+    """Precomputed clusters for zoom levels ``0..max_zoom``.
+
+    Saves and deletes are patched into the clusters of every level, see
+    :class:`~beemap.snapshot.Patched`. Clusters don't know their hives, so a
+    delete leaving one hive into a cluster leaves it without an id until the
+    next rebuild.
+
+    :param hives: Hives to cluster.
+    :param max_zoom: Deepest zoom level to cluster. Deeper zooms use this level.
+    :param max_changes: Patched changes before asking for a rebuild.
+    """
+
+    def __init__(self, hives: Iterable[Hive], max_zoom: int = 16, max_changes: int = 1000):
+        self.max_zoom = max_zoom
+        self.max_changes = max_changes
+        self.changes = 0
+        self.levels: List[Dict[Cell, Cluster]] = [{} for _ in range(max_zoom + 1)]
+        self._lock = threading.Lock()
+
+        finest = self.levels[max_zoom]
+        for hive in hives:
+            cell = self._cell(hive)
+            cluster = finest.get(cell)
+            if cluster is None:
+                finest[cell] = Cluster(1, hive.latitude, hive.longitude, hive.id)
+            else:
+                cluster.merge(Cluster(1, hive.latitude, hive.longitude))
+
+        # Build coarser levels by merging four cells into one.
+        for zoom in range(max_zoom - 1, -1, -1):
+            level = self.levels[zoom]
+            for (cx, cy), child in self.levels[zoom + 1].items():
+                parent = level.get((cx >> 1, cy >> 1))
+                if parent is None:
+                    level[(cx >> 1, cy >> 1)] = Cluster(child.count, child.sum_lat, child.sum_lon, child.hive_id)
+                else:
+                    parent.merge(child)
+
+    def _cell(self, hive: Hive) -> Cell:
+        """Cell of hive on `max_zoom`."""
+        scale = 1 << (self.max_zoom + CELL_SHIFT)
+        x, y = mercator(hive.latitude, hive.longitude)
+        return min(int(x * scale), scale - 1), min(int(y * scale), scale - 1)
+
+    @property
+    def needs_rebuild(self) -> bool:
+        return self.changes > self.max_changes
+
+    def add(self, hives: Iterable[Hive]):
+        """Count saved hives into their cluster on every level."""
+        with self._lock:
+            for hive in hives:
+                cx, cy = self._cell(hive)
+                for level in reversed(self.levels):
+                    cluster = level.get((cx, cy))
+                    if cluster is None:
+                        level[(cx, cy)] = Cluster(1, hive.latitude, hive.longitude, hive.id)
+                    else:
+                        cluster.merge(Cluster(1, hive.latitude, hive.longitude))
+                    cx, cy = cx >> 1, cy >> 1
+                self.changes += 1
+
+    def remove(self, hives: Iterable[Hive]):
+        """Uncount deleted hives from their cluster on every level."""
+        with self._lock:
+            for hive in hives:
+                cx, cy = self._cell(hive)
+                for level in reversed(self.levels):
+                    cluster = level.get((cx, cy))
+                    if cluster is not None:
+                        if cluster.count <= 1:
+                            del level[(cx, cy)]
+                        else:
+                            cluster.count -= 1
+                            cluster.sum_lat -= hive.latitude
+                            cluster.sum_lon -= hive.longitude
+                            cluster.hive_id = None
+                    cx, cy = cx >> 1, cy >> 1
+                self.changes += 1
+
+    def query(self, bbox: BBox, zoom: int) -> List[Cluster]:
+        """Return clusters on zoom level whose cell intersects the bbox."""
+        zoom = max(0, min(zoom, self.max_zoom))
+        level = self.levels[zoom]
+        scale = 1 << (zoom + CELL_SHIFT)
+
+        with self._lock:
+            found = []
+            for box in bbox.split():
+                x0, y0 = mercator(box.max_lat, box.min_lon)
+                x1, y1 = mercator(box.min_lat, box.max_lon)
+                cx0, cx1 = int(x0 * scale), min(int(x1 * scale), scale - 1)
+                cy0, cy1 = int(y0 * scale), min(int(y1 * scale), scale - 1)
+
+                cells = (cx1 - cx0 + 1) * (cy1 - cy0 + 1)
+                if cells <= len(level):
+                    # Usual case, viewport has only a screenful of cells.
+                    for cx in range(cx0, cx1 + 1):
+                        for cy in range(cy0, cy1 + 1):
+                            cluster = level.get((cx, cy))
+                            if cluster is not None:
+                                found.append(cluster)
+                else:
+                    # Huge bbox, cheaper to walk clusters we have.
+                    found.extend(
+                        cluster for (cx, cy), cluster in level.items()
+                        if cx0 <= cx <= cx1 and cy0 <= cy <= cy1
+                    )
+
+            return found
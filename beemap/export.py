@@ -0,0 +1,112 @@
+"""Streaming export of all hives.
+
+Pages are fetched with storage cursors in a background thread, while the
+previous page is being written to the client. Only a few pages are kept in
+memory at any time, regardless of how many hives there are.
+"""
+
+import json
+import queue
+import threading
+from typing import Iterable
+from typing import Iterator
+from typing import List
+
+from .hives import Hive
+from .storage import HiveRepository
+
+# Marks end of pages in the queue.
+_DONE = object()
+
+
+def walk_pages(repository: HiveRepository, page_size: int) -> Iterator[List[Hive]]:
+    """Yield all hives page by page, following cursors."""
+    cursor = None
+    while True:
+        hives, cursor = repository.page(cursor, page_size)
+        if hives:
+            yield hives
+        if cursor is None:
+            return
+
+
+def prefetch(pages: Iterator[List[Hive]], depth: int = 2) -> Iterator[List[Hive]]:
+    """Read `pages` in a background thread, keeping at most `depth` pages ahead.
+
+    Exceptions from `pages` are raised to the consumer. If the consumer stops
+    early, e.g. client disconnects, the background thread stops too.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for page in pages:
+                while not stop.is_set():
+                    try:
+                        buffer.put(page, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            item = _DONE
+        except Exception as e:
+            item = e
+
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    thread = threading.Thread(target=produce, name="export-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def _public(hive: Hive) -> dict:
+    # Email is not exported.
+    return {
+        "id": hive.id,
+        "latitude": hive.latitude,
+        "longitude": hive.longitude,
+        "firstname": hive.firstname,
+        "familyname": hive.familyname,
+    }
+
+
+def ndjson(pages: Iterable[List[Hive]]) -> Iterator[str]:
+    """Encode hives as newline delimited JSON, one chunk per page."""
+    for page in pages:
+        yield "".join(json.dumps(_public(hive), separators=(",", ":")) + "\n" for hive in page)
+
+
+def geojson(pages: Iterable[List[Hive]]) -> Iterator[str]:
+    """Encode hives as GeoJSON `FeatureCollection`, one chunk per page."""
+    yield '{"type":"FeatureCollection","features":['
+    first = True
+    for page in pages:
+        features = []
+        for hive in page:
+            feature = {
+                "type": "Feature",
+                "id": hive.id,
+                "geometry": {"type": "Point", "coordinates": [hive.longitude, hive.latitude]},
+                "properties": _public(hive),
+            }
+            features.append(json.dumps(feature, separators=(",", ":")))
+        if features:
+            yield ("" if first else ",") + ",".join(features)
+            first = False
+    yield "]}\n"
@@ -0,0 +1,233 @@
+"""Geospatial helpers: bounding boxes and geohash index.
+
+Hives are stored with a ``Geohash`` property. Geohashes sort so that points
+sharing a prefix are close to each other, which lets us turn a map viewport
+into a handful of range queries on a single, automatically indexed property
+instead of scanning every hive.
+
+:see: https://en.wikipedia.org/wiki/Geohash
+"""
+
+import math
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Tuple
+
+# Geohash alphabet. Note that it skips "a", "i", "l" and "o".
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {c: i for i, c in enumerate(_BASE32)}
+
+# Precision stored into datastore. 9 characters is about 5m x 5m cell.
+GEOHASH_PRECISION = 9
+
+# Sorts after every character in geohash alphabet, used as range terminator.
+RANGE_END = "~"
+
+
+class BBox(NamedTuple):
+    """Bounding box in the order used by the `bbox` query parameter."""
+    min_lon: float
+    min_lat: float
+    max_lon: float
+    max_lat: float
+
+    def contains(self, lat: float, lon: float) -> bool:
+        """Test if point is inside of the box. Edges are inclusive."""
+        if not self.min_lat <= lat <= self.max_lat:
+            return False
+        if self.min_lon <= self.max_lon:
+            return self.min_lon <= lon <= self.max_lon
+        # Box crosses the antimeridian.
+        return lon >= self.min_lon or lon <= self.max_lon
+
+    def split(self) -> List["BBox"]:
+        """Split box crossing the antimeridian into two boxes that don't."""
+        if self.min_lon <= self.max_lon:
+            return [self]
+        return [
+            BBox(self.min_lon, self.min_lat, 180.0, self.max_lat),
+            BBox(-180.0, self.min_lat, self.max_lon, self.max_lat),
+        ]
+
+
+def parse_bbox(value: str) -> BBox:
+    """Parse ``minlon,minlat,maxlon,maxlat`` string into :class:`BBox`.
+
+    :raises ValueError: If value is malformed or outside of valid coordinates.
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in value.split(","))
+    except (AttributeError, ValueError):
+        raise ValueError("bbox must be four comma separated numbers: minlon,minlat,maxlon,maxlat")
+
+    if min_lat > max_lat:
+        raise ValueError("bbox minlat is larger than maxlat")
+
+    # Leaflet happily reports longitudes outside of -180..180 when map is panned around.
+    if max_lon - min_lon >= 360:
+        min_lon, max_lon = -180.0, 180.0
+    else:
+        min_lon = _wrap_lon(min_lon)
+        max_lon = _wrap_lon(max_lon)
+
+    return BBox(min_lon, max(min_lat, -90.0), max_lon, min(max_lat, 90.0))
+
+
+def _wrap_lon(lon: float) -> float:
+    if -180.0 <= lon <= 180.0:
+        return lon
+    return (lon + 180.0) % 360.0 - 180.0
+
+
+def encode_geohash(lat: float, lon: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Encode coordinates into geohash string of `precision` characters."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            rng, value = lon_range, lon
+        else:
+            rng, value = lat_range, lat
+        mid = (rng[0] + rng[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def geohash_bbox(geohash: str) -> BBox:
+    """Return area covered by the geohash cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for c in geohash:
+        value = _BASE32_INDEX[c]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+
+    return BBox(lon_range[0], lat_range[0], lon_range[1], lat_range[1])
+
+
+def _cell_size(precision: int) -> Tuple[float, float]:
+    """Size of geohash cell as (lon degrees, lat degrees)."""
+    bits = precision * 5
+    lon_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 360.0 / (1 << lon_bits), 180.0 / (1 << lat_bits)
+
+
+def _cells(bbox: BBox, precision: int) -> Iterator[str]:
+    lon_step, lat_step = _cell_size(precision)
+
+    # Walk cell centers. Snap start into cell grid so no cell is skipped.
+    lat = (bbox.min_lat + 90.0) // lat_step * lat_step - 90.0 + lat_step / 2
+    while lat - lat_step / 2 <= bbox.max_lat and lat < 90.0:
+        lon = (bbox.min_lon + 180.0) // lon_step * lon_step - 180.0 + lon_step / 2
+        while lon - lon_step / 2 <= bbox.max_lon and lon < 180.0:
+            yield encode_geohash(lat, lon, precision)
+            lon += lon_step
+        lat += lat_step
+
+
+def _cell_count(bbox: BBox, precision: int) -> int:
+    lon_step, lat_step = _cell_size(precision)
+    lon_cells = int((bbox.max_lon + 180.0) // lon_step - (bbox.min_lon + 180.0) // lon_step) + 1
+    lat_cells = int((bbox.max_lat + 90.0) // lat_step - (bbox.min_lat + 90.0) // lat_step) + 1
+    return lon_cells * lat_cells
+
+
+def geohash_ranges(bbox: BBox, max_cells: int = 32, max_precision: int = GEOHASH_PRECISION) -> List[Tuple[str, str]]:
+    """Cover bounding box with geohash ranges.
+
+    Picks the finest precision where the box is covered with at most `max_cells`
+    cells, and merges cells that are adjacent in sort order into single range.
+
+    :return: List of ``(start, end)`` pairs. Geohashes within a range satisfy
+             ``start <= geohash < end``.
+    """
+    cells = set()
+    for box in bbox.split():
+        precision = 1
+        while precision < max_precision and _cell_count(box, precision + 1) <= max_cells:
+            precision += 1
+        cells.update(_cells(box, precision))
+
+    ranges = []
+    for cell in sorted(cells):
+        if ranges and len(ranges[-1][1]) == len(cell) and _next_cell(ranges[-1][1]) == cell:
+            ranges[-1][1] = cell
+        else:
+            ranges.append([cell, cell])
+
+    return [(start, last + RANGE_END) for start, last in ranges]
+
+
+def _next_cell(geohash: str) -> str:
+    """Return following geohash cell of same precision in sort order."""
+    chars = list(geohash)
+    for i in range(len(chars) - 1, -1, -1):
+        index = _BASE32_INDEX[chars[i]] + 1
+        if index < len(_BASE32):
+            chars[i] = _BASE32[index]
+            return "".join(chars)
+        chars[i] = _BASE32[0]
+    # Overflow, there is no next cell.
+    return ""
+
+
+# Web mercator can't show poles, Leaflet clips latitude into this.
+MAX_MERCATOR_LAT = 85.0511287798
+
+
+def mercator(lat: float, lon: float) -> Tuple[float, float]:
+    """Project coordinates into web mercator world coordinates.
+
+    :return: ``(x, y)`` in range ``[0, 1]``. Origin is at north-west corner,
+             like in slippy map tiles.
+    """
+    lat = max(-MAX_MERCATOR_LAT, min(MAX_MERCATOR_LAT, lat))
+    x = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return x, y
+
+
+def inverse_mercator(x: float, y: float) -> Tuple[float, float]:
+    """Inverse of :func:`mercator`, returns ``(lat, lon)``."""
+    lon = x * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+    return lat, lon
+
+
+# Mean radius of the earth, in meters.
+EARTH_RADIUS = 6371008.8
+
+
+def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points, in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
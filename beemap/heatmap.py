@@ -0,0 +1,253 @@
+"""Hive density heatmaps from a precomputed pyramid of counts.
+
+Hives are counted into bins of `BIN_SIZE` pixels on zoom levels
+``0..max_zoom`` in web mercator, as clusters are. Each level is kept as two
+parallel arrays: sorted Morton codes of non-empty bins, and hive counts.
+
+Morton codes interleave bits of bin column and row, so the code of a bin on
+zoom level `z` is the code of its child on level ``z + 1`` shifted right by
+two bits. Shifting keeps codes sorted, so a coarser level is built from the
+finer one by merging runs of equal codes, and with NumPy the whole pyramid
+is built with vectorized operations, without a Python loop over hives.
+
+A heatmap query looks up the bins of the viewport only, so it costs the same
+however many hives there are. Saves and deletes update counts of one bin per
+level, instead of rebuilding the pyramid, see :class:`~beemap.snapshot.Patched`.
+
+:see: https://en.wikipedia.org/wiki/Z-order_curve
+"""
+
+from array import array
+from bisect import bisect_left
+import math
+import threading
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+from .geo import BBox
+from .geo import inverse_mercator
+from .geo import MAX_MERCATOR_LAT
+from .geo import mercator
+from .hives import Hive
+from .hiveset import HiveSet
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    # In requirements.txt. The plain Python fallback is only for running tests
+    # without it, and is far too slow for all hives.
+    numpy = None
+
+# Map tiles are 256 pixels. Heatmap bin size in pixels.
+TILE_SIZE = 256
+BIN_SIZE = 32
+
+# Bins per tile edge, as a power of two.
+BIN_SHIFT = int(math.log2(TILE_SIZE // BIN_SIZE))
+
+
+def _spread(value: int) -> int:
+    """Spread bits of 32 bit integer to even bit positions of 64 bits."""
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    value = (value | (value << 1)) & 0x5555555555555555
+    return value
+
+
+def morton(x: int, y: int) -> int:
+    """Morton code of bin column `x` and row `y`."""
+    return _spread(x) | (_spread(y) << 1)
+
+
+def _spread_array(values):
+    values = values.astype(numpy.uint64)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << numpy.uint64(shift))) & numpy.uint64(mask)
+    return values
+
+
+class Level:
+    """Counts of non-empty bins on one zoom level, sorted by Morton code."""
+    __slots__ = ("codes", "counts")
+
+    def __init__(self, codes: array, counts: array):
+        self.codes = codes
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.codes)
+
+    def count(self, code: int) -> int:
+        index = bisect_left(self.codes, code)
+        if index < len(self.codes) and self.codes[index] == code:
+            return self.counts[index]
+        return 0
+
+    def add(self, code: int, delta: int):
+        index = bisect_left(self.codes, code)
+        if index < len(self.codes) and self.codes[index] == code:
+            count = self.counts[index] + delta
+            if count > 0:
+                self.counts[index] = count
+            else:
+                del self.codes[index]
+                del self.counts[index]
+        elif delta > 0:
+            self.codes.insert(index, code)
+            self.counts.insert(index, delta)
+
+    def parent(self) -> "Level":
+        """Level above, with four bins merged into one."""
+        if numpy is not None and len(self.codes):
+            codes = numpy.frombuffer(self.codes, dtype=numpy.uint64) >> numpy.uint64(2)
+            counts = numpy.frombuffer(self.counts, dtype=numpy.uint32)
+            starts = numpy.flatnonzero(numpy.r_[True, codes[1:] != codes[:-1]])
+            return Level(array("Q", codes[starts].tobytes()), array("I", numpy.add.reduceat(counts, starts).astype(numpy.uint32).tobytes()))
+
+        codes, counts = array("Q"), array("I")
+        for code, count in zip(self.codes, self.counts):
+            code >>= 2
+            if codes and codes[-1] == code:
+                counts[-1] += count
+            else:
+                codes.append(code)
+                counts.append(count)
+        return Level(codes, counts)
+
+
+class HeatmapPyramid:
+    """Hive counts in bins for zoom levels ``0..max_zoom``.
+
+    :param hives: Hives to count.
+    :param max_zoom: Deepest zoom level. Deeper zooms use this level.
+    """
+
+    def __init__(self, hives: HiveSet, max_zoom: int = 10):
+        if max_zoom + BIN_SHIFT > 31:
+            raise ValueError("max_zoom is too deep for 64 bit bin codes")
+        self.max_zoom = max_zoom
+        self._lock = threading.Lock()
+
+        finest = self._bin_hives(hives)
+        self.levels: List[Level] = [finest]
+        for _ in range(max_zoom):
+            self.levels.insert(0, self.levels[0].parent())
+
+    def _bin_hives(self, hives: HiveSet) -> Level:
+        scale = 1 << (self.max_zoom + BIN_SHIFT)
+        if numpy is not None and len(hives):
+            lats = numpy.clip(numpy.frombuffer(hives.latitudes, dtype=numpy.float64), -MAX_MERCATOR_LAT, MAX_MERCATOR_LAT)
+            lons = numpy.frombuffer(hives.longitudes, dtype=numpy.float64)
+            sin_lat = numpy.sin(numpy.radians(lats))
+            xs = (lons + 180.0) / 360.0
+            ys = 0.5 - numpy.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+            columns = numpy.clip((xs * scale).astype(numpy.int64), 0, scale - 1)
+            rows = numpy.clip((ys * scale).astype(numpy.int64), 0, scale - 1)
+            codes, counts = numpy.unique(_spread_array(columns) | (_spread_array(rows) << numpy.uint64(1)), return_counts=True)
+            return Level(array("Q", codes.astype(numpy.uint64).tobytes()), array("I", counts.astype(numpy.uint32).tobytes()))
+
+        bins: Dict[int, int] = {}
+        for lat, lon in zip(hives.latitudes, hives.longitudes):
+            code = self._code(lat, lon)
+            bins[code] = bins.get(code, 0) + 1
+        codes = sorted(bins)
+        return Level(array("Q", codes), array("I", (bins[code] for code in codes)))
+
+    def _code(self, lat: float, lon: float) -> int:
+        scale = 1 << (self.max_zoom + BIN_SHIFT)
+        x, y = mercator(lat, lon)
+        return morton(min(max(int(x * scale), 0), scale - 1), min(max(int(y * scale), 0), scale - 1))
+
+    def add(self, hives: Iterable[Hive], delta: int = 1):
+        """Count saved hives. Deleted hives are uncounted with `delta` of -1."""
+        with self._lock:
+            for hive in hives:
+                code = self._code(hive.latitude, hive.longitude)
+                for level in reversed(self.levels):
+                    level.add(code, delta)
+                    code >>= 2
+
+    def remove(self, hives: Iterable[Hive]):
+        self.add(hives, -1)
+
+    @property
+    def total(self) -> int:
+        return sum(self.levels[0].counts)
+
+    def query(self, bbox: BBox, zoom: int, max_bins: int = 16384) -> List[dict]:
+        """Return count grids covering the bbox.
+
+        Bins are of the zoom level, or coarser if the bbox would have more
+        than `max_bins` of them. Bbox crossing the antimeridian gets two grids.
+
+        Grid has `zoom` of its bins, `x` and `y` of its north-west bin,
+        `width` and `height` in bins, `bounds` as ``[[south, west], [north, east]]``
+        and `counts` in rows from north to south.
+        """
+        zoom = max(0, min(zoom, self.max_zoom))
+        boxes = bbox.split()
+        while zoom > 0 and sum(_bin_count(*_bin_range(box, zoom)) for box in boxes) > max_bins:
+            zoom -= 1
+
+        grids = []
+        with self._lock:
+            level = self.levels[zoom]
+            for box in boxes:
+                x0, y0, x1, y1 = _bin_range(box, zoom)
+                width, height = x1 - x0 + 1, y1 - y0 + 1
+                if numpy is not None and len(level):
+                    counts = _lookup_array(level, x0, y0, width, height)
+                else:
+                    counts = [level.count(morton(x, y)) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+                scale = 1 << (zoom + BIN_SHIFT)
+                north, west = inverse_mercator(x0 / scale, y0 / scale)
+                south, east = inverse_mercator((x1 + 1) / scale, (y1 + 1) / scale)
+                grids.append({
+                    "zoom": zoom,
+                    "x": x0,
+                    "y": y0,
+                    "width": width,
+                    "height": height,
+                    "bounds": [[south, west], [north, east]],
+                    "counts": counts,
+                })
+        return grids
+
+    def stats(self) -> dict:
+        return {
+            "max_zoom": self.max_zoom,
+            "bins": sum(len(level) for level in self.levels),
+            "hives": self.total,
+        }
+
+
+def _bin_range(box: BBox, zoom: int) -> Tuple[int, int, int, int]:
+    """Columns and rows of bins covering box, which doesn't cross the antimeridian."""
+    scale = 1 << (zoom + BIN_SHIFT)
+    x0, y0 = mercator(box.max_lat, box.min_lon)
+    x1, y1 = mercator(box.min_lat, box.max_lon)
+    return (min(int(x0 * scale), scale - 1), min(int(y0 * scale), scale - 1),
+            min(int(x1 * scale), scale - 1), min(int(y1 * scale), scale - 1))
+
+
+def _bin_count(x0: int, y0: int, x1: int, y1: int) -> int:
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+
+def _lookup_array(level: Level, x0: int, y0: int, width: int, height: int) -> List[int]:
+    xs = numpy.arange(x0, x0 + width, dtype=numpy.uint64)
+    ys = numpy.arange(y0, y0 + height, dtype=numpy.uint64)
+    wanted = (_spread_array(ys)[:, None] << numpy.uint64(1)) | _spread_array(xs)[None, :]
+    wanted = wanted.ravel()
+
+    codes = numpy.frombuffer(level.codes, dtype=numpy.uint64)
+    counts = numpy.frombuffer(level.counts, dtype=numpy.uint32)
+    index = numpy.minimum(numpy.searchsorted(codes, wanted), len(codes) - 1)
+    found = numpy.where(codes[index] == wanted, counts[index], 0)
+    return found.tolist()
@@ -0,0 +1,18 @@
+"""Hive record shared by caches and storage."""
+
+from typing import NamedTuple
+from typing import Optional
+
+
+class Hive(NamedTuple):
+    """Single beehive location.
+
+    Lighter than datastore `Entity`, and immutable so it can be shared between
+    threads without copying.
+    """
+    id: int
+    latitude: float
+    longitude: float
+    firstname: str
+    familyname: str
+    email: Optional[str] = None
@@ -0,0 +1,307 @@
+"""Compact, column oriented collection of hives.
+
+A :class:`Hive` tuple with its strings takes hundreds of bytes, and a
+snapshot of all hives is kept by every process. :class:`HiveSet` keeps the
+same data in columns instead:
+
+- Latitudes and longitudes in contiguous float64 arrays.
+- Ids in an int64 array. Entities with string key names fall back to a tuple.
+- Names as indices into a table of unique strings, as many hives share them.
+
+Emails are not kept, as the map never shows them.
+
+Bounding box filtering works on whole columns at once with NumPy. Without it,
+as in minimal test environments, a plain loop over the arrays is used.
+:meth:`HiveSet.to_bytes` serializes the columns as they are, and
+:meth:`HiveSet.from_buffer` uses serialized columns in place, without
+copying, e.g. from a memory-mapped file.
+"""
+
+from array import array
+import json
+import struct
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Sequence
+
+from .geo import BBox
+from .hives import Hive
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    # In requirements.txt. The plain Python fallback is only for running tests
+    # without it, and is far too slow for all hives.
+    numpy = None
+
+MAGIC = b"HIVESET1"
+# Magic, hive count, id column type ("q" or "s"), id column bytes, string table bytes.
+_header = struct.Struct("=8sQ1s7xQQ")
+
+
+class HiveSet(Sequence):
+    """Immutable columns of hives. Changes return a new set.
+
+    Byte order of serialized columns is the native one, so serialized sets are
+    meant for sharing between processes on the same machine.
+    """
+
+    __slots__ = ("ids", "latitudes", "longitudes", "firstnames", "familynames", "strings")
+
+    def __init__(self, ids: Sequence, latitudes: Sequence[float], longitudes: Sequence[float],
+                 firstnames: Sequence[int], familynames: Sequence[int], strings: Sequence[str]):
+        self.ids = ids
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.firstnames = firstnames
+        self.familynames = familynames
+        self.strings = strings
+
+    @classmethod
+    def from_hives(cls, hives: Iterable[Hive]) -> "HiveSet":
+        hives = list(hives)
+        table: Dict[str, int] = {}
+
+        def intern(value) -> int:
+            return table.setdefault(value or "", len(table))
+
+        firstnames = array("I", (intern(hive.firstname) for hive in hives))
+        familynames = array("I", (intern(hive.familyname) for hive in hives))
+        return cls(
+            _id_column(hive.id for hive in hives),
+            array("d", (hive.latitude for hive in hives)),
+            array("d", (hive.longitude for hive in hives)),
+            firstnames,
+            familynames,
+            tuple(table),
+        )
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.select(range(*index.indices(len(self))))
+        strings = self.strings
+        return Hive(self.ids[index], self.latitudes[index], self.longitudes[index],
+                    strings[self.firstnames[index]], strings[self.familynames[index]])
+
+    def __iter__(self) -> Iterator[Hive]:
+        strings = self.strings
+        for hive_id, lat, lon, first, family in zip(self.ids, self.latitudes, self.longitudes, self.firstnames, self.familynames):
+            yield Hive(hive_id, lat, lon, strings[first], strings[family])
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory taken by the columns and string table."""
+        columns = (self.ids, self.latitudes, self.longitudes, self.firstnames, self.familynames)
+        return sum(_column_bytes(column) for column in columns) + sum(len(s) for s in self.strings)
+
+    def within(self, bbox: BBox) -> List[int]:
+        """Indices of hives inside of `bbox`. Edges are inclusive."""
+        if numpy is not None:
+            lats = numpy.frombuffer(self.latitudes, dtype=numpy.float64)
+            lons = numpy.frombuffer(self.longitudes, dtype=numpy.float64)
+            mask = (lats >= bbox.min_lat) & (lats <= bbox.max_lat)
+            if bbox.min_lon <= bbox.max_lon:
+                mask &= (lons >= bbox.min_lon) & (lons <= bbox.max_lon)
+            else:
+                mask &= (lons >= bbox.min_lon) | (lons <= bbox.max_lon)
+            return numpy.flatnonzero(mask).tolist()
+
+        contains = bbox.contains
+        return [i for i, (lat, lon) in enumerate(zip(self.latitudes, self.longitudes)) if contains(lat, lon)]
+
+    def select(self, indices: Iterable[int]) -> "HiveSet":
+        """New set of hives at `indices`, sharing the string table."""
+        indices = list(indices)
+        ids = self.ids
+        return HiveSet(
+            _id_column(ids[i] for i in indices),
+            array("d", (self.latitudes[i] for i in indices)),
+            array("d", (self.longitudes[i] for i in indices)),
+            array("I", (self.firstnames[i] for i in indices)),
+            array("I", (self.familynames[i] for i in indices)),
+            self.strings,
+        )
+
+    def remove(self, ids: Iterable) -> "HiveSet":
+        """New set without hives having any of `ids`.
+
+        Columns are copied in slices, so removing a few hives from a large
+        set doesn't loop over every hive in Python.
+        """
+        removed = self.find(ids)
+        if not removed:
+            return self
+
+        keep = []
+        start = 0
+        for index in removed:
+            keep.append((start, index))
+            start = index + 1
+        keep.append((start, len(self)))
+
+        def cut(column):
+            column = _as_array(column)
+            parts = [column[a:b] for a, b in keep]
+            joined = parts[0]
+            for part in parts[1:]:
+                joined += part
+            return joined
+
+        return HiveSet(cut(self.ids), cut(self.latitudes), cut(self.longitudes),
+                       cut(self.firstnames), cut(self.familynames), self.strings)
+
+    def find(self, ids: Iterable) -> List[int]:
+        """Sorted indices of hives having any of `ids`. Unknown ids are skipped.
+
+        Many ids are looked up in one pass over the id column, with NumPy when
+        it is installed, instead of scanning the column once per id.
+        """
+        ids = set(ids)
+        if not ids or not len(self):
+            return []
+        column = self.ids
+        if numpy is not None and not isinstance(column, tuple):
+            # Ids outside of int64 can't be in the column.
+            wanted = [hive_id for hive_id in ids if type(hive_id) is int and -2 ** 63 <= hive_id < 2 ** 63]
+            if not wanted:
+                return []
+            found = numpy.isin(numpy.frombuffer(column, dtype=numpy.int64), numpy.array(wanted, dtype=numpy.int64))
+            return numpy.flatnonzero(found).tolist()
+        if len(ids) < 8:
+            return sorted({self._index(hive_id) for hive_id in ids} - {None})
+        return [index for index, hive_id in enumerate(column) if hive_id in ids]
+
+    def _index(self, hive_id):
+        """Position of hive with `hive_id`, or None. Linear scan, but in C for int ids."""
+        ids = self.ids
+        if isinstance(ids, memoryview):
+            ids = ids.tolist()
+        try:
+            return ids.index(hive_id)
+        except (ValueError, TypeError, OverflowError):
+            return None
+
+    def add(self, hives: Iterable[Hive]) -> "HiveSet":
+        """New set with `hives` added, replacing existing hives with the same id."""
+        hives = list(hives)
+        kept = self.remove(hive.id for hive in hives)
+
+        table = {value: index for index, value in enumerate(kept.strings)}
+
+        def intern(value) -> int:
+            return table.setdefault(value or "", len(table))
+
+        new = HiveSet(
+            _id_column(hive.id for hive in hives),
+            array("d", (hive.latitude for hive in hives)),
+            array("d", (hive.longitude for hive in hives)),
+            array("I", (intern(hive.firstname) for hive in hives)),
+            array("I", (intern(hive.familyname) for hive in hives)),
+            tuple(table),
+        )
+
+        if isinstance(kept.ids, tuple) or isinstance(new.ids, tuple):
+            ids = _id_column(list(kept.ids) + list(new.ids))
+        else:
+            ids = _as_array(kept.ids) + new.ids
+
+        return HiveSet(
+            ids,
+            _as_array(kept.latitudes) + new.latitudes,
+            _as_array(kept.longitudes) + new.longitudes,
+            _as_array(kept.firstnames) + new.firstnames,
+            _as_array(kept.familynames) + new.familynames,
+            new.strings,
+        )
+
+    def to_bytes(self) -> bytes:
+        """Serialize columns. Read back with :meth:`from_buffer`."""
+        if _is_int_column(self.ids):
+            id_type, ids = b"q", bytes(array("q", self.ids))
+        else:
+            id_type, ids = b"s", json.dumps(list(self.ids)).encode("utf-8")
+        strings = json.dumps(list(self.strings)).encode("utf-8")
+
+        return b"".join([
+            _header.pack(MAGIC, len(self), id_type, len(ids), len(strings)),
+            bytes(self.latitudes),
+            bytes(self.longitudes),
+            bytes(self.firstnames),
+            bytes(self.familynames),
+            ids,
+            strings,
+        ])
+
+    @classmethod
+    def from_buffer(cls, buffer) -> "HiveSet":
+        """Use columns serialized by :meth:`to_bytes` in place.
+
+        Numeric columns are views into `buffer`, so it must stay unchanged
+        while the set is used.
+
+        :raises ValueError: If buffer doesn't hold a serialized set.
+        """
+        view = memoryview(buffer)
+        try:
+            magic, count, id_type, ids_size, strings_size = _header.unpack_from(view, 0)
+        except struct.error:
+            raise ValueError("Truncated hive set")
+        if magic != MAGIC:
+            raise ValueError("Not a hive set")
+
+        position = _header.size
+
+        def column(type_code: str, size: int):
+            nonlocal position
+            part = view[position:position + size]
+            if len(part) != size:
+                raise ValueError("Truncated hive set")
+            position += size
+            return part.cast(type_code) if type_code else bytes(part)
+
+        latitudes = column("d", count * 8)
+        longitudes = column("d", count * 8)
+        firstnames = column("I", count * 4)
+        familynames = column("I", count * 4)
+        if id_type == b"q":
+            ids = column("q", ids_size)
+        else:
+            ids = tuple(json.loads(column("", ids_size)))
+        strings = tuple(json.loads(column("", strings_size)))
+
+        return cls(ids, latitudes, longitudes, firstnames, familynames, strings)
+
+
+def _is_int_column(values) -> bool:
+    return isinstance(values, (array, memoryview)) or all(type(value) is int for value in values)
+
+
+def _id_column(ids: Iterable):
+    """Int64 array of ids, or tuple if some ids are key names."""
+    ids = list(ids)
+    if all(type(value) is int for value in ids):
+        return array("q", ids)
+    return tuple(ids)
+
+
+def _as_array(column):
+    """Column as array, copying memoryview columns. Tuple of key names is returned as it is."""
+    if isinstance(column, memoryview):
+        copy = array(column.format)
+        copy.frombytes(column.cast("B"))
+        return copy
+    return column
+
+
+def _column_bytes(column) -> int:
+    if isinstance(column, array):
+        return column.itemsize * len(column)
+    if isinstance(column, memoryview):
+        return column.nbytes
+    # Tuple of key names.
+    return 8 * len(column) + sum(len(str(value)) for value in column)
@@ -0,0 +1,318 @@
+"""Push hive changes to open maps with Server-Sent Events.
+
+WSGI workers hold a thread for each open response, so an event stream per
+open map would take a thread each. :class:`LiveServer` serves the streams
+from its own asyncio event loop instead, in one background thread, where an
+idle connection costs a socket and a queue.
+
+:class:`Hub` fans events out to connected clients. It is an in-process
+pub/sub: the app publishes saves and deletes it makes itself. With several
+worker processes or instances, each server also follows the storage change
+feed, see :meth:`LiveServer.follow_changes`, so clients hear of changes made
+anywhere. The same change can then reach a client twice, so clients must
+apply events idempotently.
+
+Events are named `saved` and `deleted`, with a hive as data for `saved`, and
+a list of ids for `deleted`. A client too slow to keep up with events gets a
+`reset` event and is disconnected, and should catch up from
+`/hives/changes` before reconnecting.
+
+:see: https://html.spec.whatwg.org/multipage/server-sent-events.html
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Set
+
+from .hives import Hive
+from .storage import Changes
+
+logger = logging.getLogger(__name__)
+
+# Ask browsers to wait this long before reconnecting, in milliseconds.
+RECONNECT_DELAY = 5000
+
+
+def format_event(event: str, data) -> bytes:
+    """Encode one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode("utf-8")
+
+
+def hive_event(hive: Hive) -> dict:
+    """Hive as data of `saved` event. Names instead of description, so it fits all locales."""
+    return {"id": hive.id, "lat": hive.latitude, "lon": hive.longitude,
+            "firstname": hive.firstname, "familyname": hive.familyname}
+
+
+RESET = format_event("reset", None)
+
+
+class HubFull(Exception):
+    """Hub has as many clients as it accepts."""
+
+
+class Hub:
+    """Fan events out to subscribed clients.
+
+    Subscribing happens on the event loop of the hub, publishing from any
+    thread. Until the hub is bound to a loop, published events are dropped.
+
+    :param queue_size: Events kept for a client not yet written to it.
+    :param max_clients: Clients accepted at once.
+    """
+
+    def __init__(self, queue_size: int = 100, max_clients: int = 10000):
+        self.queue_size = max(2, queue_size)
+        self.max_clients = max_clients
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._clients: Set[asyncio.Queue] = set()
+
+        self.published = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def bind(self, loop: Optional[asyncio.AbstractEventLoop]):
+        self.loop = loop
+
+    def publish(self, event: str, data):
+        """Send event to all clients. Safe to call from any thread."""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        message = format_event(event, data)
+        try:
+            loop.call_soon_threadsafe(self._fan_out, message)
+        except RuntimeError:
+            # Loop closed while we were at it.
+            pass
+
+    def saved(self, hives: Iterable[Hive]):
+        for hive in hives:
+            self.publish("saved", hive_event(hive))
+
+    def deleted(self, ids: Iterable):
+        ids = list(ids)
+        if ids:
+            self.publish("deleted", ids)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of encoded events for a new client. None in queue means the client must be disconnected.
+
+        :raises HubFull: If there are `max_clients` clients already.
+        """
+        if len(self._clients) >= self.max_clients:
+            self.rejected += 1
+            raise HubFull()
+        queue = asyncio.Queue(self.queue_size)
+        self._clients.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._clients.discard(queue)
+
+    def _fan_out(self, message: bytes):
+        self.published += 1
+        for queue in list(self._clients):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self._drop(queue)
+
+    def _drop(self, queue: asyncio.Queue):
+        """Disconnect client that can't keep up, telling it to catch up from the change feed."""
+        self._clients.discard(queue)
+        self.dropped += 1
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(RESET)
+        queue.put_nowait(None)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "published": self.published,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+
+class LiveServer:
+    """Serve :class:`Hub` events to browsers from an asyncio loop in a background thread.
+
+    Socket is opened with `SO_REUSEPORT`, so every worker process can run a
+    server on the same port, and the kernel spreads connections between them.
+
+    :param hub: Hub to serve.
+    :param host: Address to listen.
+    :param port: Port to listen, 0 to pick a free one.
+    :param path: Path of the event stream. Other paths get 404.
+    :param heartbeat: Seconds between comments sent to idle clients, keeping
+        proxies from closing the connection, and finding clients that are gone.
+    """
+
+    def __init__(self, hub: Hub, host: str = "0.0.0.0", port: int = 0, path: str = "/hives/live", heartbeat: float = 15.0):
+        self.hub = hub
+        self.host = host
+        self.port = port
+        self.path = path
+        self.heartbeat = heartbeat
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+        self._tasks = set()
+        self._followers = []
+
+    def follow_changes(self, changes: Callable[[int], Changes], since: int, interval: float = 2.0, overlap: int = 0):
+        """Also publish changes read from storage, made by other processes.
+
+        Must be called before :meth:`start`.
+
+        :param changes: Returns changes after a stamp, e.g. from :meth:`HiveRepository.changes`.
+        :param since: Stamp to start from.
+        :param interval: Seconds between polls.
+        :param overlap: Microseconds to poll before the last seen stamp, allowing for clock skew.
+        """
+        self._followers.append((changes, since, interval, overlap))
+
+    def start(self) -> int:
+        """Start serving in a daemon thread.
+
+        :return: Port the server listens.
+        """
+        started = threading.Event()
+        errors = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                self._server = loop.run_until_complete(asyncio.start_server(self._handle, self.host, self.port, reuse_port=True))
+            except OSError as e:
+                errors.append(e)
+                started.set()
+                loop.close()
+                return
+
+            self._loop = loop
+            self.port = self._server.sockets[0].getsockname()[1]
+            self.hub.bind(loop)
+            self._tasks.update(loop.create_task(self._follow(*follower)) for follower in self._followers)
+            started.set()
+            try:
+                loop.run_forever()
+            finally:
+                self.hub.bind(None)
+                loop.close()
+
+        self._thread = threading.Thread(target=run, name="live-server", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        logger.info("Serving live hive updates on port %d.", self.port)
+        return self.port
+
+    def stop(self):
+        loop = self._loop
+        if loop is None:
+            return
+
+        async def shutdown():
+            self._server.close()
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            loop.stop()
+
+        asyncio.run_coroutine_threadsafe(shutdown(), loop)
+        self._thread.join(5)
+        self._loop = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            try:
+                request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            method, _, rest = request.decode("latin-1").partition(" ")
+            path = rest.split(" ", 1)[0].split("?", 1)[0]
+
+            if method != "GET" or path != self.path:
+                writer.write(_response_head("404 Not Found", "text/plain", close=True) + b"Not found\n")
+                return
+            try:
+                queue = self.hub.subscribe()
+            except HubFull:
+                writer.write(_response_head("503 Service Unavailable", "text/plain", close=True) + b"Too many clients\n")
+                return
+
+            try:
+                writer.write(_response_head("200 OK", "text/event-stream") + f"retry: {RECONNECT_DELAY}\n\n".encode("ascii"))
+                await writer.drain()
+                while True:
+                    try:
+                        message = await asyncio.wait_for(queue.get(), self.heartbeat)
+                    except asyncio.TimeoutError:
+                        message = b": ping\n\n"
+                    if message is None:
+                        break
+                    writer.write(message)
+                    await writer.drain()
+            finally:
+                self.hub.unsubscribe(queue)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+            self._tasks.discard(task)
+
+    async def _follow(self, changes: Callable[[int], Changes], since: int, interval: float, overlap: int):
+        loop = asyncio.get_event_loop()
+        # Changes already published, as polls overlap.
+        recent_saved: Dict[object, Hive] = {}
+        recent_deleted: Set = set()
+        truncated = False
+        while True:
+            try:
+                # Pages of a backlog follow each other exactly, or a large one would never end.
+                result = await loop.run_in_executor(None, changes, since if truncated else since - overlap)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Failed to follow hive changes: %s", e)
+                await asyncio.sleep(interval)
+                continue
+
+            saved = {hive.id: hive for hive in result.saved}
+            deleted = set(result.deleted)
+            self.hub.saved(hive for hive_id, hive in saved.items() if recent_saved.get(hive_id) != hive)
+            self.hub.deleted(deleted - recent_deleted)
+            recent_saved, recent_deleted = saved, deleted
+
+            if result.stamp is not None:
+                since = max(since, result.stamp)
+            truncated = result.truncated
+            if not truncated:
+                await asyncio.sleep(interval)
+
+
+def _response_head(status: str, content_type: str, close: bool = False) -> bytes:
+    headers = [
+        f"HTTP/1.1 {status}",
+        f"Content-Type: {content_type}",
+        "Cache-Control: no-cache",
+        # Served from another port than the page.
+        "Access-Control-Allow-Origin: *",
+        "Connection: close" if close else "Connection: keep-alive",
+    ]
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1")
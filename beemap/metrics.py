@@ -0,0 +1,312 @@
+"""Minimal Prometheus metrics.
+
+Counters, gauges and histograms rendered in Prometheus text exposition
+format, without depending on Azure or `prometheus_client`.
+
+When the app runs in several worker processes, each would only report its own
+requests. Give :class:`Registry` a shared directory, and every process dumps
+its metrics into its own file there. Whichever worker gets scraped merges all
+the files: counters and histograms are summed, gauges get a ``pid`` label.
+
+:see: https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# Default histogram buckets for latencies, in seconds.
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0, 2.5, 5.0, 10.0)
+
+# Buckets for sizes, like response bytes or entity counts.
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """Base class for metrics with labels."""
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def samples(self) -> Dict[LabelValues, object]:
+        with self._lock:
+            return {key: self._copy(value) for key, value in self._values.items()}
+
+    @staticmethod
+    def _copy(value):
+        return value
+
+
+class Counter(Metric):
+    """Value that only goes up."""
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets."""
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Bucket counts (non-cumulative, last one is +Inf), sum.
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            else:
+                state[0][-1] += 1
+            state[1] += value
+
+    def time(self, **labels) -> "_Timer":
+        """Context manager observing the duration of the block."""
+        return _Timer(self, labels)
+
+    @staticmethod
+    def _copy(value):
+        return [list(value[0]), value[1]]
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    """Collection of metrics.
+
+    :param directory: Shared directory for multi-process mode, or None.
+    :param dump_interval: Seconds between dumping metrics into `directory`.
+    """
+
+    def __init__(self, directory: Optional[str] = None, dump_interval: float = 5.0):
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: List[Callable[[], Iterable[Tuple[str, str, dict, float]]]] = []
+        self.directory = directory
+        self.dump_interval = dump_interval
+        self._dumper: Optional[threading.Thread] = None
+        self._dumper_pid = None
+
+    def _register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, str, dict, float]]]):
+        """Add callable returning ``(name, help, labels, value)`` gauges, evaluated on each scrape."""
+        self.collectors.append(collector)
+
+    def _collect(self) -> Dict[str, Gauge]:
+        gauges = {}
+        for collector in self.collectors:
+            for name, help, labels, value in collector():
+                if value is None:
+                    continue
+                gauge = gauges.get(name)
+                if gauge is None:
+                    gauge = gauges[name] = Gauge(name, help, sorted(labels))
+                gauge.set(float(value), **labels)
+        return gauges
+
+    def state(self) -> dict:
+        """Metrics of this process as JSON serializable dict."""
+        metrics = dict(self.metrics)
+        metrics.update(self._collect())
+        return {
+            name: {
+                "type": metric.type,
+                "help": metric.help,
+                "labels": list(metric.labels),
+                "buckets": list(getattr(metric, "buckets", [])),
+                "samples": [[list(key), value] for key, value in metric.samples().items()],
+            }
+            for name, metric in metrics.items()
+        }
+
+    # Multi-process mode
+
+    def start(self):
+        """Start dumping metrics into shared directory, if configured.
+
+        Call after forking, as threads don't survive forks.
+        """
+        if not self.directory or (self._dumper is not None and self._dumper_pid == os.getpid()):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._dumper_pid = os.getpid()
+        self._dumper = threading.Thread(target=self._dump_loop, name="metrics-dumper", daemon=True)
+        self._dumper.start()
+
+    def _dump_loop(self):
+        while True:
+            time.sleep(self.dump_interval)
+            try:
+                self.dump()
+            except OSError:
+                pass
+
+    def dump(self):
+        """Write metrics of this process into shared directory."""
+        path = os.path.join(self.directory, f"metrics-{os.getpid()}.json")
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"pid": os.getpid(), "metrics": self.state()}, f)
+        # Atomic, readers never see half written file.
+        os.replace(tmp, path)
+
+    def _states(self) -> List[Tuple[int, dict]]:
+        if not self.directory:
+            return [(os.getpid(), self.state())]
+
+        self.dump()
+        states = []
+        for filename in os.listdir(self.directory):
+            if not filename.startswith("metrics-") or not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            states.append((data["pid"], data["metrics"]))
+        return states
+
+    def render(self) -> str:
+        """Render metrics of all processes in Prometheus text format."""
+        merged: Dict[str, dict] = {}
+        multiprocess = bool(self.directory)
+
+        for pid, state in self._states():
+            for name, metric in state.items():
+                target = merged.setdefault(name, {**metric, "samples": {}})
+                if metric["type"] == "gauge" and multiprocess:
+                    # Gauges of dead processes are meaningless.
+                    if not _alive(pid):
+                        continue
+                    target["labels"] = metric["labels"] + ["pid"]
+                    for key, value in metric["samples"]:
+                        target["samples"][tuple(key) + (str(pid),)] = value
+                    continue
+
+                for key, value in metric["samples"]:
+                    key = tuple(key)
+                    current = target["samples"].get(key)
+                    if current is None:
+                        target["samples"][key] = value
+                    elif metric["type"] == "histogram":
+                        target["samples"][key] = [[a + b for a, b in zip(current[0], value[0])], current[1] + value[1]]
+                    else:
+                        target["samples"][key] = current + value
+
+        lines = []
+        for name in sorted(merged):
+            metric = merged[name]
+            if not metric["samples"]:
+                continue
+            lines.append(f"# HELP {name} {_escape_help(metric['help'])}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for key, value in sorted(metric["samples"].items()):
+                labels = list(zip(metric["labels"], key))
+                if metric["type"] == "histogram":
+                    counts, total = value
+                    cumulative = 0
+                    for bound, count in zip(metric["buckets"] + ["+Inf"], counts):
+                        cumulative += count
+                        le = bound if bound == "+Inf" else _number(bound)
+                        lines.append(f"{name}_bucket{_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                    lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _number(value: float) -> str:
+    if isinstance(value, float) and math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
@@ -0,0 +1,263 @@
+"""Nearest and within radius searches with a KD-tree.
+
+Hives are placed on the unit sphere as ``(x, y, z)`` points. Straight line
+distance between two points on the sphere grows with their great-circle
+distance, so a KD-tree with plain euclidean distance finds the same nearest
+hives as haversine distance would, without trigonometry in the inner loop,
+and without special cases at the antimeridian or poles. Haversine distance
+is computed for the hives found only.
+
+Tree is implicit: points are reordered so that each node is a slice of the
+arrays, split at its middle along the axis with the widest spread. Only the
+split axes and values are stored. Leaves have up to `leaf_size` points.
+
+Saved and deleted hives are kept aside in :class:`HiveIndex`, and searched
+along with the tree, until there are enough of them to rebuild the tree.
+"""
+
+from array import array
+import heapq
+import math
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Set
+from typing import Tuple
+
+from .geo import EARTH_RADIUS
+from .geo import haversine
+from .hives import Hive
+from .hiveset import HiveSet
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    # In requirements.txt. The plain Python fallback is only for running tests
+    # without it, and is far too slow for all hives.
+    numpy = None
+
+
+def unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    phi, lam = math.radians(lat), math.radians(lon)
+    cos_phi = math.cos(phi)
+    return cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi)
+
+
+def chord(meters: float) -> float:
+    """Straight line distance on unit sphere matching great-circle distance in meters."""
+    return 2 * math.sin(min(meters / EARTH_RADIUS, math.pi) / 2)
+
+
+class KDTree:
+    """Static KD-tree of hives of a :class:`HiveSet`.
+
+    :param hives: Hives to index.
+    :param leaf_size: Maximum number of points in a leaf.
+    """
+
+    def __init__(self, hives: HiveSet, leaf_size: int = 32):
+        self.hives = hives
+        self.leaf_size = max(1, leaf_size)
+        # Split axis and value of each node, by heap numbering: root is 1,
+        # children of `n` are `2n` and `2n + 1`.
+        self.axes = bytearray()
+        self.splits = array("d")
+        if numpy is not None and len(hives):
+            self._build_vectorized()
+        else:
+            self._build()
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def _build(self):
+        points = [unit_vector(lat, lon) for lat, lon in zip(self.hives.latitudes, self.hives.longitudes)]
+        order = list(range(len(points)))
+
+        stack = [(1, 0, len(order))]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi - lo <= self.leaf_size:
+                continue
+            segment = order[lo:hi]
+            axis = max(range(3), key=lambda a: _spread(points[i][a] for i in segment))
+            segment.sort(key=lambda i: points[i][axis])
+            order[lo:hi] = segment
+            mid = (lo + hi) // 2
+            self._set_split(node, axis, points[order[mid]][axis])
+            stack.append((2 * node, lo, mid))
+            stack.append((2 * node + 1, mid, hi))
+
+        self.order = array("q", order)
+        self.coords = tuple(array("d", (points[i][a] for i in order)) for a in range(3))
+
+    def _build_vectorized(self):
+        lats = numpy.radians(numpy.frombuffer(self.hives.latitudes, dtype=numpy.float64))
+        lons = numpy.radians(numpy.frombuffer(self.hives.longitudes, dtype=numpy.float64))
+        points = numpy.stack([numpy.cos(lats) * numpy.cos(lons), numpy.cos(lats) * numpy.sin(lons), numpy.sin(lats)])
+        order = numpy.arange(len(lats), dtype=numpy.int64)
+
+        stack = [(1, 0, len(order))]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi - lo <= self.leaf_size:
+                continue
+            segment = order[lo:hi]
+            values = points[:, segment]
+            axis = int(numpy.argmax(values.max(axis=1) - values.min(axis=1)))
+            mid = (lo + hi) // 2
+            order[lo:hi] = segment[numpy.argpartition(values[axis], mid - lo)]
+            self._set_split(node, axis, float(points[axis, order[mid]]))
+            stack.append((2 * node, lo, mid))
+            stack.append((2 * node + 1, mid, hi))
+
+        self.order = array("q", order.tobytes())
+        self.coords = tuple(array("d", points[a][order].tobytes()) for a in range(3))
+
+    def _set_split(self, node: int, axis: int, value: float):
+        if node >= len(self.axes):
+            self.axes.extend(bytes(node + 1 - len(self.axes)))
+            self.splits.extend([0.0] * (node + 1 - len(self.splits)))
+        self.axes[node] = axis
+        self.splits[node] = value
+
+    def nearest(self, lat: float, lon: float, k: int, excluded: Set = frozenset()) -> List[Tuple[float, int]]:
+        """Return up to `k` nearest hives as squared chord distances and indices into the hive set, nearest first.
+
+        :param excluded: Ids of hives to skip.
+        """
+        if k <= 0 or not len(self):
+            return []
+        query = unit_vector(lat, lon)
+        xs, ys, zs = self.coords
+        order, ids, axes, splits, leaf_size = self.order, self.hives.ids, self.axes, self.splits, self.leaf_size
+        qx, qy, qz = query
+        # Max heap of negated distances, worst of the best k on top.
+        best: List[Tuple[float, int]] = []
+
+        def visit(node: int, lo: int, hi: int):
+            if hi - lo <= leaf_size:
+                for i in range(lo, hi):
+                    dx, dy, dz = xs[i] - qx, ys[i] - qy, zs[i] - qz
+                    distance = dx * dx + dy * dy + dz * dz
+                    if len(best) < k:
+                        if not excluded or ids[order[i]] not in excluded:
+                            heapq.heappush(best, (-distance, i))
+                    elif distance < -best[0][0]:
+                        if not excluded or ids[order[i]] not in excluded:
+                            heapq.heapreplace(best, (-distance, i))
+                return
+
+            mid = (lo + hi) // 2
+            axis = axes[node]
+            diff = query[axis] - splits[node]
+            if diff < 0:
+                visit(2 * node, lo, mid)
+                if len(best) < k or diff * diff < -best[0][0]:
+                    visit(2 * node + 1, mid, hi)
+            else:
+                visit(2 * node + 1, mid, hi)
+                if len(best) < k or diff * diff < -best[0][0]:
+                    visit(2 * node, lo, mid)
+
+        visit(1, 0, len(order))
+        return sorted((-distance, order[i]) for distance, i in best)
+
+    def within(self, lat: float, lon: float, radius: float, excluded: Set = frozenset()) -> List[Tuple[float, int]]:
+        """Return hives within chord distance `radius` as squared chord distances and indices, nearest first."""
+        if not len(self):
+            return []
+        query = unit_vector(lat, lon)
+        xs, ys, zs = self.coords
+        order, ids, axes, splits, leaf_size = self.order, self.hives.ids, self.axes, self.splits, self.leaf_size
+        qx, qy, qz = query
+        limit = radius * radius
+        found = []
+
+        stack = [(1, 0, len(order))]
+        while stack:
+            node, lo, hi = stack.pop()
+            if hi - lo <= leaf_size:
+                for i in range(lo, hi):
+                    dx, dy, dz = xs[i] - qx, ys[i] - qy, zs[i] - qz
+                    distance = dx * dx + dy * dy + dz * dz
+                    if distance <= limit and (not excluded or ids[order[i]] not in excluded):
+                        found.append((distance, order[i]))
+                continue
+
+            mid = (lo + hi) // 2
+            axis = axes[node]
+            diff = query[axis] - splits[node]
+            if diff < 0 or diff * diff <= limit:
+                stack.append((2 * node, lo, mid))
+            if diff >= 0 or diff * diff <= limit:
+                stack.append((2 * node + 1, mid, hi))
+
+        found.sort()
+        return found
+
+
+class HiveIndex:
+    """:class:`KDTree` of a snapshot, with hives saved and deleted after it.
+
+    Meant to be kept up to date with :class:`~beemap.snapshot.Patched`.
+
+    :param hives: Hives of the snapshot.
+    :param max_changes: Changes kept aside before asking for a rebuild.
+    :param leaf_size: Leaf size of the tree.
+    """
+
+    def __init__(self, hives: HiveSet, max_changes: int = 1000, leaf_size: int = 32):
+        self.tree = KDTree(hives, leaf_size)
+        self.max_changes = max_changes
+        # Saved hives not in the tree, by id, and ids of tree hives deleted or replaced by them.
+        self.added: Dict[object, Hive] = {}
+        self.removed: Set = set()
+
+    @property
+    def needs_rebuild(self) -> bool:
+        return len(self.added) + len(self.removed) > self.max_changes
+
+    def add(self, hives: Iterable[Hive]):
+        for hive in hives:
+            self.added[hive.id] = hive
+            self.removed.add(hive.id)
+
+    def remove(self, hives: Iterable[Hive]):
+        for hive in hives:
+            self.added.pop(hive.id, None)
+            self.removed.add(hive.id)
+
+    def nearest(self, lat: float, lon: float, k: int) -> List[Tuple[float, Hive]]:
+        """Return up to `k` nearest hives with their distance in meters, nearest first."""
+        # Copies, as saves may change these while we search.
+        added, removed = list(self.added.values()), set(self.removed)
+        found = [(distance, self.tree.hives[i]) for distance, i in self.tree.nearest(lat, lon, k, removed)]
+        found = heapq.nsmallest(k, found + [(_squared_chord(lat, lon, hive), hive) for hive in added], key=lambda pair: pair[0])
+        return [(haversine(lat, lon, hive.latitude, hive.longitude), hive) for _, hive in found]
+
+    def within(self, lat: float, lon: float, meters: float, limit: int) -> List[Tuple[float, Hive]]:
+        """Return up to `limit` nearest hives within `meters`, with their distance in meters, nearest first."""
+        added, removed = list(self.added.values()), set(self.removed)
+        radius = chord(meters)
+        found = [(distance, self.tree.hives[i]) for distance, i in self.tree.within(lat, lon, radius, removed)[:limit]]
+        found += [(distance, hive) for distance, hive in ((_squared_chord(lat, lon, hive), hive) for hive in added) if distance <= radius * radius]
+        found = heapq.nsmallest(limit, found, key=lambda pair: pair[0])
+        return [(haversine(lat, lon, hive.latitude, hive.longitude), hive) for _, hive in found]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self.tree),
+            "added": len(self.added),
+            "removed": len(self.removed),
+        }
+
+
+def _spread(values: Iterable[float]) -> float:
+    values = list(values)
+    return max(values) - min(values)
+
+
+def _squared_chord(lat: float, lon: float, hive: Hive) -> float:
+    a, b = unit_vector(lat, lon), unit_vector(hive.latitude, hive.longitude)
+    return sum((p - q) ** 2 for p, q in zip(a, b))
@@ -0,0 +1,147 @@
+"""Cache of rendered responses, stored precompressed.
+
+Responses are cached by a key that includes everything they depend on, like
+locale and hive data version. Each cached body is compressed once with gzip,
+and with brotli if the `brotli` package is installed, so serving it costs only
+picking the right encoding. Bodies are compressed on the request thread of a
+cache miss, so levels are moderate ones: the highest levels take many times
+longer for a few percent smaller bodies. Concurrent misses of the same key
+wait for one render instead of each rendering and compressing the page.
+
+Responses carry strong ETags, and unchanged responses are answered with
+``304 Not Modified``.
+"""
+
+from collections import OrderedDict
+import gzip
+import hashlib
+import threading
+from typing import Callable
+from typing import Dict
+
+from flask import Request
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    # In requirements.txt, but optional for running tests. Without it only gzip is offered.
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class CachedPage:
+    """Rendered body with its compressed variants.
+
+    :ivar bodies: Body by content encoding, ``"identity"`` being uncompressed.
+    :ivar etags: ETag by content encoding. Each encoding is a different
+                 representation, so they have different strong ETags.
+    """
+    __slots__ = ("bodies", "etags", "mimetype")
+
+    def __init__(self, body: bytes, mimetype: str):
+        self.mimetype = mimetype
+        self.bodies: Dict[str, bytes] = {"identity": body}
+        self.bodies["gzip"] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        self.etags = {
+            encoding: digest if encoding == "identity" else f"{digest}-{encoding}"
+            for encoding in self.bodies
+        }
+
+    @property
+    def size(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+    def response(self, request: Request) -> Response:
+        """Build response for the request, picking the best encoding client accepts."""
+        encoding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in self.bodies and request.accept_encodings[candidate]:
+                encoding = candidate
+                break
+
+        # Client having any of the variants is fine, they are the same content.
+        if any(request.if_none_match.contains_weak(etag) for etag in self.etags.values()):
+            response = Response(status=304)
+        else:
+            response = Response(self.bodies[encoding], mimetype=self.mimetype)
+            if encoding != "identity":
+                response.content_encoding = encoding
+
+        response.set_etag(self.etags[encoding])
+        response.vary.add("Accept-Encoding")
+        return response
+
+
+class PageCache:
+    """LRU cache of :class:`CachedPage`.
+
+    :param max_entries: Number of pages to keep. Keys include data version, so
+                        pages of old versions fall out on their own.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._pages: "OrderedDict[tuple, CachedPage]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Keys being rendered, with event set when done.
+        self._rendering: Dict[tuple, threading.Event] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def get(self, key: tuple, render: Callable[[], bytes], mimetype: str) -> CachedPage:
+        """Return cached page, rendering it with `render` on miss.
+
+        Only one thread renders a key at a time, others wait for it. If
+        rendering fails, waiting threads try rendering themselves.
+        """
+        while True:
+            with self._lock:
+                page = self._pages.get(key)
+                if page is not None:
+                    self._pages.move_to_end(key)
+                    self.hits += 1
+                    return page
+                rendering = self._rendering.get(key)
+                if rendering is None:
+                    rendering = self._rendering[key] = threading.Event()
+                    self.misses += 1
+                    break
+                self.waits += 1
+            rendering.wait()
+
+        # Render outside of lock, so other pages are served meanwhile.
+        try:
+            page = CachedPage(render(), mimetype)
+            with self._lock:
+                self._pages[key] = page
+                self._pages.move_to_end(key)
+                while len(self._pages) > self.max_entries:
+                    self._pages.popitem(last=False)
+            return page
+        finally:
+            with self._lock:
+                del self._rendering[key]
+            rendering.set()
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "waits": self.waits,
+            "pages": len(self._pages),
+            "bytes": sum(page.size for page in list(self._pages.values())),
+            "brotli": brotli is not None,
+        }
@@ -0,0 +1,314 @@
+"""Keep storage trouble from taking the whole app down.
+
+:class:`ResilientRepository` wraps a :class:`~beemap.storage.HiveRepository`:
+
+- Each operation has a deadline. Retries stop when the next attempt would not
+  start before it.
+- Reads and deletes are retried on transient errors, with exponential backoff
+  and full jitter, so retrying instances don't hammer storage in sync.
+  Saves are not retried, as saving a new hive twice would store it twice.
+- A :class:`CircuitBreaker` counts consecutive failures. After too many, it
+  opens and calls fail immediately with :class:`StorageUnavailable`, instead
+  of holding request threads while storage is down. After a while one trial
+  call is let through, and if it succeeds the breaker closes again.
+
+Readers of :class:`~beemap.snapshot.HiveSnapshot` keep getting the stale
+snapshot while the breaker is open, as failed refreshes keep the old copy.
+
+:see: https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+:see: https://martinfowler.com/bliki/CircuitBreaker.html
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from . import geo
+from .hives import Hive
+from .storage import Changes
+from .storage import HiveRepository
+
+logger = logging.getLogger(__name__)
+
+# Error class names from `google.api_core.exceptions` worth retrying. Matched
+# by name, so google libraries don't need to be imported for the check.
+TRANSIENT_ERRORS = {
+    "Aborted",
+    "DeadlineExceeded",
+    "InternalServerError",
+    "ServiceUnavailable",
+    "TooManyRequests",
+    "GatewayTimeout",
+    "RetryError",
+}
+
+
+class StorageUnavailable(Exception):
+    """Storage is failing, and the call was refused or gave up.
+
+    :ivar retry_after: Seconds until storage is tried again, if known.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_transient(error: BaseException) -> bool:
+    """Whether `error` is likely to go away by retrying."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+class CircuitBreaker:
+    """Fail fast after `failure_threshold` consecutive failures.
+
+    :param failure_threshold: Consecutive failures that open the breaker.
+    :param reset_timeout: Seconds to stay open before letting a trial call through.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half-open"
+    OPEN = "open"
+
+    # Numeric states for metrics.
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial = False
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the next trial call is let through."""
+        return max(0.0, self._opened_at + self.reset_timeout - self.clock())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead.
+
+        Caller must report the outcome with :meth:`success`, :meth:`failure` or :meth:`release`.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            if self._state == self.HALF_OPEN and not self._trial:
+                # Only one trial at a time, the rest keep failing fast.
+                self._trial = True
+                return True
+            self.rejected += 1
+            return False
+
+    def success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Storage circuit breaker closed.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial = False
+
+    def release(self):
+        """Outcome says nothing about storage health. Let the next trial through, without closing."""
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                if self._state == self.CLOSED:
+                    logger.warning("Storage circuit breaker opened after %d failures.", self._failures)
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+                self.opened += 1
+
+    def stats(self) -> dict:
+        state = self.state
+        return {
+            "state": state,
+            "state_value": self.STATE_VALUES[state],
+            "failures": self._failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    :param attempts: Total attempts, including the first one.
+    :param base_delay: Upper bound of the first delay, in seconds. Doubles on each retry.
+    :param max_delay: Upper bound of any delay.
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.1, max_delay: float = 2.0, random: Callable[[], float] = random.random):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.random = random
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before `retry`:th retry, counting from 0."""
+        return self.random() * min(self.max_delay, self.base_delay * 2 ** retry)
+
+
+class ResilientRepository(HiveRepository):
+    """Wrap repository with deadlines, retries and a circuit breaker.
+
+    :param repository: Repository doing the work.
+    :param breaker: Shared breaker, whose state is reported in metrics.
+    :param retry: Retry policy for idempotent operations.
+    :param deadlines: Seconds per operation name. Operations missing from it have no deadline.
+    :param on_retry: Called with operation name and error before each retry.
+    :param sleep: For tests.
+    """
+
+    def __init__(self, repository: HiveRepository, breaker: CircuitBreaker, retry: RetryPolicy,
+                 deadlines: Optional[Dict[str, float]] = None,
+                 on_retry: Optional[Callable[[str, BaseException], None]] = None,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.repository = repository
+        self.breaker = breaker
+        self.retry = retry
+        self.deadlines = deadlines or {}
+        self.on_retry = on_retry
+        self.sleep = sleep
+
+    def _attempts(self, operation: str, idempotent: bool) -> Iterator[int]:
+        """Yield attempt numbers while another attempt fits into the deadline."""
+        deadline = self.deadlines.get(operation)
+        started = time.monotonic()
+        attempts = self.retry.attempts if idempotent else 1
+        for attempt in range(attempts):
+            if attempt:
+                delay = self.retry.delay(attempt - 1)
+                if deadline is not None and time.monotonic() - started + delay >= deadline:
+                    return
+                self.sleep(delay)
+            if not self.breaker.allow():
+                raise StorageUnavailable(f"Storage is unavailable, {operation} not attempted", self.breaker.retry_after())
+            yield attempt
+
+    def _failed(self, operation: str, error: BaseException, attempt: int, idempotent: bool) -> bool:
+        """Record failure. Return True if it should be retried."""
+        if not is_transient(error):
+            # Bad data or a bug, not storage health.
+            self.breaker.release()
+            return False
+        self.breaker.failure()
+        if idempotent and attempt + 1 < self.retry.attempts:
+            logger.warning("Storage %s failed, retrying: %s", operation, error)
+            if self.on_retry:
+                self.on_retry(operation, error)
+            return True
+        return False
+
+    def _call(self, operation: str, idempotent: bool, *args):
+        error = None
+        for attempt in self._attempts(operation, idempotent):
+            try:
+                result = getattr(self.repository, operation)(*args)
+            except Exception as e:
+                error = e
+                if self._failed(operation, e, attempt, idempotent):
+                    continue
+                if is_transient(e):
+                    raise StorageUnavailable(f"Storage {operation} failed: {e!s}") from e
+                raise
+            self.breaker.success()
+            return result
+        raise StorageUnavailable(f"Storage {operation} ran out of time: {error!s}") from error
+
+    def iterate(self) -> Iterator[Hive]:
+        # Retried only until the first hive is read, as hives already given
+        # to the caller can't be taken back.
+        end = object()
+        error = None
+        for attempt in self._attempts("iterate", True):
+            try:
+                iterator = iter(self.repository.iterate())
+                first = next(iterator, end)
+            except Exception as e:
+                error = e
+                if self._failed("iterate", e, attempt, True):
+                    continue
+                if is_transient(e):
+                    raise StorageUnavailable(f"Storage iterate failed: {e!s}") from e
+                raise
+            break
+        else:
+            raise StorageUnavailable(f"Storage iterate ran out of time: {error!s}") from error
+
+        if first is end:
+            self.breaker.success()
+            return
+        reported = False
+        try:
+            yield first
+            yield from iterator
+        except Exception as e:
+            reported = True
+            if is_transient(e):
+                self.breaker.failure()
+            else:
+                self.breaker.release()
+            raise
+        finally:
+            # Also when the caller closes the generator early, e.g. on client
+            # disconnect, so a half-open breaker doesn't wait for the trial forever.
+            if not reported:
+                self.breaker.success()
+
+    def page(self, cursor: Optional[str], limit: int) -> Tuple[List[Hive], Optional[str]]:
+        return self._call("page", True, cursor, limit)
+
+    def query_bbox(self, bbox: geo.BBox, limit: Optional[int] = None) -> List[Hive]:
+        return self._call("query_bbox", True, bbox, limit)
+
+    def query_bbox_ids(self, bbox: geo.BBox, limit: Optional[int] = None) -> List:
+        return self._call("query_bbox_ids", True, bbox, limit)
+
+    def changes(self, since: int, limit: int) -> Changes:
+        return self._call("changes", True, since, limit)
+
+    def get_many(self, ids: Iterable) -> List[Hive]:
+        return self._call("get_many", True, list(ids))
+
+    def save_many(self, hives: List[Hive]) -> List[Hive]:
+        return self._call("save_many", False, hives)
+
+    def delete(self, ids: Iterable) -> int:
+        return self._call("delete", True, list(ids))
+
+    def reindex(self) -> int:
+        return self._call("reindex", False)
+
+    def warmup(self):
+        self.repository.warmup()
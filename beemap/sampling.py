@@ -0,0 +1,234 @@
+"""Adaptive trace sampling with per-route budgets.
+
+Tracing every request costs CPU and egress. Instead, each route gets a
+budget of traces per second, enforced with a token bucket. Health checks,
+static files and other noisy paths get a budget close to zero.
+
+With tail sampling enabled, every request is traced, but the decision is made
+when the trace is exported: errors and requests slower than a threshold are
+always kept, everything else has to fit into the route budget.
+
+Opencensus exports each span with its subtree as the span ends, so a trace
+arrives in several batches, children first. Batches are held until the one
+with the request span, and the decision made for it applies to all of them.
+"""
+
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import time
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+# Attribute keys set by opencensus flask integration.
+HTTP_ROUTE = "http.route"
+HTTP_PATH = "http.path"
+HTTP_STATUS_CODE = "http.status_code"
+# `SpanKind.SERVER` of opencensus, set on request spans.
+SPAN_KIND_SERVER = 1
+
+
+class TokenBuckets:
+    """Token bucket per key.
+
+    :param default_rate: Tokens per second for keys without own rate.
+    :param rates: Tokens per second by key.
+    :param burst: Bucket size as seconds worth of tokens. At least one token.
+    """
+
+    def __init__(self, default_rate: float = 1.0, rates: Optional[Dict[str, float]] = None, burst: float = 1.0):
+        self.default_rate = default_rate
+        self.rates = dict(rates or {})
+        self.burst = burst
+        self._buckets: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str, now: Optional[float] = None) -> bool:
+        """Take a token for the key, if there is one."""
+        rate = self.rates.get(key, self.default_rate)
+        if rate <= 0:
+            return False
+        capacity = max(1.0, rate * self.burst)
+        now = time.monotonic() if now is None else now
+
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [capacity, now]
+            tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return True
+            bucket[0] = tokens
+            return False
+
+
+class RouteBudgetSampler:
+    """Opencensus sampler deciding by route of the current Flask request.
+
+    :param buckets: Budgets by route.
+    :param excluded: Path prefixes, such as static files and health checks,
+                     that use `excluded_rate` budget shared between them.
+    :param excluded_rate: Traces per second for excluded paths.
+    :param tail: If True, sample every other request, and leave the decision to
+                 :class:`TailSamplingExporter`.
+    """
+
+    def __init__(self, buckets: TokenBuckets, excluded: Iterable[str] = (), excluded_rate: float = 0.0, tail: bool = False):
+        self.buckets = buckets
+        self.excluded = tuple(excluded)
+        self.excluded_buckets = TokenBuckets(excluded_rate)
+        self.tail = tail
+
+    def should_sample(self, span_context=None) -> bool:
+        route, path = _current_route()
+        if path.startswith(self.excluded):
+            return self.excluded_buckets.allow("excluded")
+        if self.tail:
+            return True
+        return self.buckets.allow(route)
+
+
+class TailSamplingExporter:
+    """Trace exporter keeping errors, slow requests, and traces within budget.
+
+    :param exporter: Exporter receiving kept spans.
+    :param buckets: Budgets by route, for traces that are not errors nor slow.
+    :param slow_threshold: Seconds. Requests taking longer are always kept.
+    :param max_traces: Traces waiting for their request span, and decisions
+                        remembered for late batches. Oldest waiting trace is
+                        decided by the spans it has, when there are more.
+    """
+
+    def __init__(self, exporter, buckets: TokenBuckets, slow_threshold: float = 1.0, max_traces: int = 1000):
+        self.exporter = exporter
+        self.buckets = buckets
+        self.slow_threshold = slow_threshold
+        self.max_traces = max_traces
+
+        # Spans by trace id, waiting for the request span.
+        self._held: "OrderedDict[str, list]" = OrderedDict()
+        # Reasons by trace id, None if dropped.
+        self._decided: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.kept = {"error": 0, "slow": 0, "budget": 0}
+        self.dropped = 0
+
+    def export(self, span_datas):
+        traces: Dict[str, list] = {}
+        for span_data in span_datas:
+            traces.setdefault(span_data.context.trace_id, []).append(span_data)
+
+        kept = []
+        with self._lock:
+            for trace_id, spans in traces.items():
+                if trace_id in self._decided:
+                    if self._decided[trace_id] is not None:
+                        kept.extend(spans)
+                    continue
+
+                if not _is_request_span(_root(spans)):
+                    # Subtree of a span still running, decided with the rest of the trace.
+                    self._held.setdefault(trace_id, []).extend(spans)
+                    while len(self._held) > self.max_traces:
+                        held_id, held = self._held.popitem(last=False)
+                        if self._record(held_id, self.decide(held)):
+                            kept.extend(held)
+                    continue
+
+                # Request span comes with its whole subtree, including held spans again.
+                spans = _unique(self._held.pop(trace_id, []) + spans)
+                if self._record(trace_id, self.decide(spans)):
+                    kept.extend(spans)
+
+        if kept:
+            self.exporter.export(kept)
+
+    def _record(self, trace_id: str, reason: Optional[str]) -> Optional[str]:
+        # Caller holds the lock.
+        if reason is None:
+            self.dropped += 1
+        else:
+            self.kept[reason] += 1
+        self._decided[trace_id] = reason
+        while len(self._decided) > self.max_traces:
+            self._decided.popitem(last=False)
+        return reason
+
+    def emit(self, span_datas):
+        self.export(span_datas)
+
+    def decide(self, spans) -> Optional[str]:
+        """Return reason to keep the trace, or None to drop it."""
+        root = _root(spans)
+        attributes = root.attributes or {}
+
+        try:
+            status_code = int(attributes.get(HTTP_STATUS_CODE, 0))
+        except (TypeError, ValueError):
+            status_code = 0
+        if status_code >= 500 or (root.status is not None and root.status.code):
+            return "error"
+
+        if _duration(root) >= self.slow_threshold:
+            return "slow"
+
+        route = attributes.get(HTTP_ROUTE) or attributes.get(HTTP_PATH) or root.name
+        if self.buckets.allow(str(route)):
+            return "budget"
+        return None
+
+    def stats(self) -> dict:
+        return {"dropped": self.dropped, **{f"kept_{reason}": count for reason, count in self.kept.items()}}
+
+
+def _root(spans: list):
+    """Span whose parent is not in `spans`. Children are exported before their parents, so the last one of those."""
+    ids = {getattr(span, "span_id", None) for span in spans}
+    tops = [span for span in spans if span.parent_span_id is None or span.parent_span_id not in ids]
+    return tops[-1] if tops else spans[-1]
+
+
+def _is_request_span(span) -> bool:
+    """Whether span is the root of a trace in this process: a request, or without parent at all."""
+    return not span.parent_span_id or getattr(span, "span_kind", None) == SPAN_KIND_SERVER
+
+
+def _unique(spans: list) -> list:
+    seen = set()
+    unique = []
+    for span in spans:
+        key = getattr(span, "span_id", None) or id(span)
+        if key not in seen:
+            seen.add(key)
+            unique.append(span)
+    return unique
+
+
+def _current_route():
+    """Return route pattern and path of current flask request."""
+    from flask import has_request_context
+    from flask import request
+
+    if not has_request_context():
+        return "", ""
+    route = request.url_rule.rule if request.url_rule else request.path
+    return route, request.path
+
+
+def _duration(span_data) -> float:
+    try:
+        start = _parse_time(span_data.start_time)
+        end = _parse_time(span_data.end_time)
+    except (TypeError, ValueError):
+        return 0.0
+    return (end - start).total_seconds()
+
+
+def _parse_time(value: str) -> datetime:
+    # Opencensus formats times as "2021-02-10T14:42:00.123456Z"
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
@@ -0,0 +1,158 @@
+"""Hive snapshot shared by worker processes through a memory-mapped file.
+
+With several worker processes, each would keep its own :class:`HiveSnapshot`
+and refresh it from storage, multiplying storage reads by the number of
+workers. :class:`SharedHiveSnapshot` instead writes the snapshot into a file
+that all workers map read-only:
+
+- Refreshes take an exclusive `flock()` on a lock file. The worker holding it
+  is the refresh leader: it loads hives from storage and replaces the file.
+  Workers waiting for the lock find a fresh file when they get it, and map
+  that instead of reading storage.
+- Saves and deletes patch the snapshot of the worker that made them, and
+  touch a change marker file. A file built before the last change is not
+  fresh, so the next refresh of any worker reloads from storage.
+- File holds :class:`HiveSet` columns, which workers use in place from the
+  mapping, so page cache holds the only copy of coordinates.
+
+File starts with magic (8 bytes) and built_at (f64, unix time of when
+loading from storage started), followed by :meth:`HiveSet.to_bytes`.
+"""
+
+from contextlib import contextmanager
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Callable
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from .hives import Hive
+from .hiveset import HiveSet
+from .snapshot import HiveSnapshot
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BEEMAP02"
+_header = struct.Struct("=8sd")
+
+
+class SnapshotFile:
+    """Snapshot file, its refresh lock and change marker.
+
+    :param path: Snapshot file. Lock and change marker are created next to it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.changed_path = path + ".changed"
+
+    @contextmanager
+    def lock(self):
+        """Hold exclusive refresh lock, waiting for other processes."""
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def write(self, hives: HiveSet, built_at: float):
+        """Replace snapshot file atomically. Processes mapping the old file keep their mapping."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".hives-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_header.pack(MAGIC, built_at))
+                f.write(hives.to_bytes())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def read(self) -> Optional[Tuple[HiveSet, float]]:
+        """Map current snapshot file.
+
+        :return: Hives and unix time of when they were loaded, or None if there is no usable file.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                # Mapping stays valid after the file is closed or replaced.
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        try:
+            magic, built_at = _header.unpack_from(buffer, 0)
+            if magic != MAGIC:
+                return None
+            return HiveSet.from_buffer(memoryview(buffer)[_header.size:]), built_at
+        except (ValueError, struct.error):
+            return None
+
+    def mark_changed(self):
+        """Record that hives changed after now, so older snapshot files aren't fresh."""
+        with open(self.changed_path, "a"):
+            pass
+        os.utime(self.changed_path)
+
+    def changed_at(self) -> float:
+        try:
+            return os.stat(self.changed_path).st_mtime
+        except FileNotFoundError:
+            return 0.0
+
+    def is_fresh(self, built_at: float, ttl: float) -> bool:
+        """Whether hives loaded at `built_at` are within `ttl` seconds, and after the last change."""
+        return time.time() - built_at < ttl and built_at > self.changed_at()
+
+
+class SharedHiveSnapshot(HiveSnapshot):
+    """:class:`HiveSnapshot` refreshed by one worker and shared by all through :class:`SnapshotFile`.
+
+    :param loader: Callable returning all hives from storage.
+    :param path: Snapshot file, on a filesystem local to all workers.
+    :param ttl: Seconds the snapshot is considered fresh.
+    :param max_changes: Saves and deletes kept aside before merging them into the columns.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Hive]], path: str, ttl: float = 60.0, max_changes: int = 1000):
+        super().__init__(loader, ttl, max_changes)
+        self.file = SnapshotFile(path)
+        self.shared_loads = 0
+
+    def _fetch(self) -> Tuple[HiveSet, float]:
+        with self.file.lock():
+            current = self.file.read()
+            if current is not None and self.file.is_fresh(current[1], self.ttl):
+                # Another worker loaded it while we waited for the lock.
+                self.shared_loads += 1
+            else:
+                built_at = time.time()
+                self.file.write(HiveSet.from_hives({hive.id: hive for hive in self.loader()}.values()), built_at)
+                current = self.file.read()
+
+        # Snapshot ages are in monotonic time, file has unix time.
+        hives, built_at = current
+        return hives, time.monotonic() - (time.time() - built_at)
+
+    def add(self, hives: Iterable[Hive]):
+        hives = list(hives)
+        self.file.mark_changed()
+        super().add(hives)
+
+    def remove(self, ids: Iterable):
+        ids = list(ids)
+        self.file.mark_changed()
+        super().remove(ids)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["shared_loads"] = self.shared_loads
+        return stats
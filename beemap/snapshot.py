@@ -0,0 +1,412 @@
+"""Process-wide snapshot of hive locations.
+
+Hives change rarely compared to how often the map is viewed, so instead of
+querying datastore on every page view, we keep a copy of all hives in memory.
+
+- Snapshot is fresh for `ttl` seconds. After that it is served stale while a
+  background thread rebuilds it (stale-while-revalidate).
+- If datastore fails or times out, readers keep getting the stale copy.
+- Saves and deletes patch the snapshot immediately, so the user who saved a
+  hive sees it without waiting for a refresh. They are kept aside from the
+  hive columns, which are rewritten only on reload or after `max_changes`.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import FrozenSet
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .geo import BBox
+from .hives import Hive
+from .hiveset import HiveSet
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    """Immutable view of hives at certain point of time.
+
+    Saves and deletes don't rewrite the columns of every hive. They are kept
+    aside in `added` and `removed`, like :class:`~beemap.nearest.HiveIndex`
+    does, until :class:`HiveSnapshot` merges them into a new `base`.
+
+    :ivar base: :class:`HiveSet` loaded from storage, without emails. Never modified after creation.
+    :ivar added: Hives saved after `base` was loaded, by id.
+    :ivar removed: Ids deleted or saved after `base` was loaded, hidden from `base`.
+    :ivar version: Increases every time hive data changes. Usable as a cache key.
+    :ivar built_at: `time.monotonic()` of last full load from storage.
+    """
+    __slots__ = ("base", "added", "removed", "version", "built_at", "_hives", "_size")
+
+    def __init__(self, hives: HiveSet, version: int, built_at: float,
+                 added: Optional[Dict[object, Hive]] = None, removed: FrozenSet = frozenset()):
+        self.base = hives
+        self.added = added or {}
+        self.removed = removed
+        self.version = version
+        self.built_at = built_at
+        self._hives: Optional[HiveSet] = None
+        self._size: Optional[int] = None
+
+    @property
+    def changes(self) -> int:
+        """Ids saved or deleted after `base` was loaded. Saved ids are in `removed` too."""
+        return len(self.removed)
+
+    @property
+    def hives(self) -> HiveSet:
+        """All hives as one :class:`HiveSet`. Merged on first use, for building values from the whole snapshot."""
+        if not self.changes:
+            return self.base
+        if self._hives is None:
+            self._hives = self.base.remove(self.removed).add(self.added.values())
+        return self._hives
+
+    def patch(self, version: int, added: Iterable[Hive] = (), removed: Iterable = ()) -> "Snapshot":
+        """New snapshot with `added` hives saved and `removed` ids deleted. Costs as much as there are changes."""
+        hives = dict(self.added)
+        masked = set(self.removed)
+        for hive_id in removed:
+            hives.pop(hive_id, None)
+            masked.add(hive_id)
+        for hive in added:
+            hives[hive.id] = hive
+            masked.add(hive.id)
+        return Snapshot(self.base, version, self.built_at, hives, frozenset(masked))
+
+    def merged(self) -> "Snapshot":
+        """Same snapshot with changes merged into `base`."""
+        return Snapshot(self.hives, self.version, self.built_at)
+
+    def within(self, bbox: BBox, limit: Optional[int] = None) -> List[Hive]:
+        """Up to `limit` hives inside of `bbox`. Edges are inclusive."""
+        base, removed = self.base, self.removed
+        found = []
+        for index in base.within(bbox):
+            if limit is not None and len(found) >= limit:
+                return found
+            hive = base[index]
+            if hive.id not in removed:
+                found.append(hive)
+        found.extend(hive for hive in self.added.values() if bbox.contains(hive.latitude, hive.longitude))
+        return found[:limit]
+
+    def find(self, ids: Iterable) -> List[Hive]:
+        """Hives having any of `ids`. Unknown ids are skipped."""
+        ids = set(ids)
+        base, removed = self.base, self.removed
+        found = [base[i] for i in base.find(ids - removed)]
+        found.extend(self.added[hive_id] for hive_id in ids if hive_id in self.added)
+        return found
+
+    def __len__(self):
+        if self._size is None:
+            masked = len(self.base.find(self.removed)) if self.removed else 0
+            self._size = len(self.base) - masked + len(self.added)
+        return self._size
+
+    def __iter__(self):
+        removed = self.removed
+        for hive in self.base:
+            if hive.id not in removed:
+                yield hive
+        yield from self.added.values()
+
+
+class HiveSnapshot:
+    """Keeps :class:`Snapshot` of hives up to date.
+
+    :param loader: Callable returning all hives from storage.
+    :param ttl: Seconds the snapshot is considered fresh.
+    :param max_changes: Saves and deletes kept aside before merging them into the columns.
+    """
+
+    def __init__(self, loader: Callable[[], Iterable[Hive]], ttl: float = 60.0, max_changes: int = 1000):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_changes = max_changes
+
+        self._snapshot: Optional[Snapshot] = None
+        self._stale = False
+        self._version = 0
+        self._lock = threading.Lock()
+        # Serializes synchronous loads, so a cold start triggers only one query.
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        # Changes made while refresh was running, replayed on top of it.
+        self._pending: List[Tuple[str, object]] = []
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.merges = 0
+
+    def get(self) -> Snapshot:
+        """Return current snapshot.
+
+        Only the very first call, or a call after failed first load, waits for
+        storage. Everybody else gets the data in memory.
+
+        :raises Exception: Whatever `loader` raises, when there is no stale copy to fall back to.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return self._load()
+
+        if not self._stale and time.monotonic() - snapshot.built_at < self.ttl:
+            self.hits += 1
+        else:
+            self.stale_hits += 1
+            self.refresh_async()
+
+        return snapshot
+
+    def peek(self) -> Optional[Snapshot]:
+        """Return current snapshot without loading or refreshing it.
+
+        :return: None if snapshot hasn't been loaded yet.
+        """
+        return self._snapshot
+
+    def _load(self) -> Snapshot:
+        with self._load_lock:
+            # Somebody else might have loaded it while we were waiting.
+            if self._snapshot is not None:
+                self.hits += 1
+                return self._snapshot
+
+            self.misses += 1
+            with self._lock:
+                self._refreshing = True
+            try:
+                return self._rebuild()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+    def refresh_async(self) -> bool:
+        """Rebuild snapshot in background thread, unless already rebuilding.
+
+        :return: True if refresh was started.
+        """
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+
+        thread = threading.Thread(target=self._refresh, name="hive-snapshot-refresh", daemon=True)
+        thread.start()
+        return True
+
+    def _refresh(self):
+        try:
+            self._rebuild()
+        except Exception:
+            # Keep serving stale copy. Next read will try again.
+            logger.exception("Refreshing hive snapshot failed, serving stale data.")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _fetch(self) -> Tuple[HiveSet, float]:
+        """Load all hives.
+
+        :return: Hives, and `time.monotonic()` of when loading started.
+        """
+        started = time.monotonic()
+        hives = {hive.id: hive for hive in self.loader()}
+        return HiveSet.from_hives(hives.values()), started
+
+    def _rebuild(self) -> Snapshot:
+        with self._lock:
+            self._pending = []
+
+        started = time.monotonic()
+        try:
+            hives, built_at = self._fetch()
+        except Exception:
+            self.errors += 1
+            raise
+
+        with self._lock:
+            self._version += 1
+            snapshot = Snapshot(hives, self._version, built_at)
+            # Replay saves and deletes that happened while we were loading.
+            for op, changes in itertools.groupby(self._pending, key=lambda change: change[0]):
+                values = [value for _, value in changes]
+                if op == "add":
+                    snapshot = snapshot.patch(self._version, added=values)
+                else:
+                    snapshot = snapshot.patch(self._version, removed=values)
+            self._pending = []
+
+            self._replace(snapshot)
+            self._stale = False
+            self.refreshes += 1
+
+        logger.debug("Rebuilt hive snapshot with %d hives in %.3fs.", len(hives), time.monotonic() - started)
+        return self._snapshot
+
+    def add(self, hives: Iterable[Hive]):
+        """Patch saved hives into snapshot."""
+        hives = list(hives)
+        with self._lock:
+            if self._refreshing:
+                self._pending.extend(("add", hive) for hive in hives)
+            if self._snapshot is None:
+                return
+
+            self._version += 1
+            self._replace(self._snapshot.patch(self._version, added=hives))
+
+    def remove(self, ids: Iterable):
+        """Patch deleted hives out of the snapshot."""
+        ids = set(ids)
+        with self._lock:
+            if self._refreshing:
+                self._pending.extend(("remove", id) for id in ids)
+            if self._snapshot is None:
+                return
+
+            self._version += 1
+            self._replace(self._snapshot.patch(self._version, removed=ids))
+
+    def _replace(self, snapshot: Snapshot):
+        # Caller holds the lock. Merging copies every column, so it is done
+        # only once there are `max_changes` changes.
+        if snapshot.changes > self.max_changes:
+            snapshot = snapshot.merged()
+            self.merges += 1
+        self._snapshot = snapshot
+
+    def invalidate(self):
+        """Mark snapshot stale. Next read triggers a background refresh."""
+        self._stale = True
+
+    def reset(self):
+        """Drop loaded snapshot. Next read loads from storage and waits for it, as on a cold start."""
+        with self._lock:
+            self._snapshot = None
+            self._stale = False
+
+    @property
+    def age(self) -> Optional[float]:
+        """Seconds since snapshot was loaded from storage, or None if never loaded."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return time.monotonic() - snapshot.built_at
+
+    def stats(self) -> dict:
+        """Counters for seeing how well the snapshot works."""
+        snapshot = self._snapshot
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "merges": self.merges,
+            "changes": snapshot.changes if snapshot else 0,
+            "age": self.age,
+            "ttl": self.ttl,
+            "size": len(snapshot) if snapshot else 0,
+            "bytes": snapshot.base.nbytes if snapshot else 0,
+            "version": snapshot.version if snapshot else 0,
+            "stale": self._stale,
+            "refreshing": self._refreshing,
+        }
+
+
+class Patched:
+    """Value computed from a :class:`Snapshot`, patched by saves and deletes.
+
+    Value isn't rebuilt for every snapshot version, only when snapshot is
+    loaded from storage again, or when value asks for it with a true
+    `needs_rebuild` attribute. The first build waits, later ones
+    happen in background while the old value is served.
+
+    :param build: Callable taking :class:`Snapshot` and returning the value.
+        Value must have `add(hives)` and `remove(hives)` methods.
+    """
+
+    def __init__(self, build: Callable[[Snapshot], object]):
+        self.build = build
+        self._value = None
+        self._built_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._building = False
+        # Changes made while building, replayed on top of the new value.
+        self._pending: List[Tuple[str, List[Hive]]] = []
+
+        self.builds = 0
+
+    def get(self, snapshot: Snapshot):
+        """Return value of `snapshot`, or of an earlier load while a new one is being built."""
+        with self._lock:
+            value = self._value
+            if value is not None and self._built_at == snapshot.built_at and not getattr(value, "needs_rebuild", False):
+                return value
+            start = not self._building
+            if start:
+                self._building = True
+                self._pending = []
+
+        if value is None:
+            if not start:
+                # First build is running in another thread. Building twice is
+                # simpler than waiting for it, and happens only on cold start.
+                return self.build(snapshot)
+            return self._build(snapshot)
+        if start:
+            threading.Thread(target=self._build, args=(snapshot,), name="snapshot-patched-build", daemon=True).start()
+        return value
+
+    def _build(self, snapshot: Snapshot):
+        try:
+            value = self.build(snapshot)
+        except Exception:
+            with self._lock:
+                self._building = False
+            logger.exception("Building value from hive snapshot failed.")
+            raise
+
+        with self._lock:
+            for op, hives in self._pending:
+                getattr(value, op)(hives)
+            self._pending = []
+            self._value = value
+            self._built_at = snapshot.built_at
+            self._building = False
+            self.builds += 1
+        return value
+
+    def add(self, hives: Iterable[Hive]):
+        self._patch("add", list(hives))
+
+    def remove(self, hives: Iterable[Hive]):
+        """Patch deleted hives out. Hives are needed, not only ids, as values may be keyed by location."""
+        self._patch("remove", list(hives))
+
+    def _patch(self, op: str, hives: List[Hive]):
+        with self._lock:
+            if self._building:
+                self._pending.append((op, hives))
+            if self._value is not None:
+                getattr(self._value, op)(hives)
+
+    def stats(self) -> dict:
+        value = self._value
+        stats = value.stats() if value is not None and hasattr(value, "stats") else {}
+        stats["builds"] = self.builds
+        stats["building"] = self._building
+        return stats
@@ -0,0 +1,656 @@
+"""Hive storage backends.
+
+Route handlers talk to a :class:`HiveRepository` instead of datastore
+directly, so the app can also run on a laptop without cloud credentials:
+
+- :class:`DatastoreHiveRepository`: Google Cloud Datastore, used in production.
+- :class:`MemoryHiveRepository`: Plain dict. For tests and load testing.
+- :class:`SqliteHiveRepository`: SQLite with R*Tree index. For profiling
+  with realistic amounts of data.
+
+Backend is selected with ``HIVE_STORAGE`` config value, see :func:`create_repository`.
+
+Saves stamp hives with :func:`next_stamp`, and deletes leave a stamped
+tombstone, so :meth:`HiveRepository.changes` can tell what changed since a
+given stamp.
+"""
+
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from . import geo
+from .hives import Hive
+
+logger = logging.getLogger(__name__)
+
+_stamp_lock = threading.Lock()
+_last_stamp = 0
+
+
+def next_stamp() -> int:
+    """Change stamp: microseconds since epoch, increasing within the process.
+
+    Stamps of different processes are only as ordered as their clocks, so
+    readers of changes should allow for some skew.
+    """
+    global _last_stamp
+    with _stamp_lock:
+        _last_stamp = max(_last_stamp + 1, time.time_ns() // 1000)
+        return _last_stamp
+
+
+class Changes(NamedTuple):
+    """Hives saved and deleted after a stamp.
+
+    :ivar stamp: Largest stamp of the returned changes, or None if there were none.
+    :ivar truncated: True if there were more than the asked limit of changes.
+    """
+    saved: List[Hive]
+    deleted: List
+    stamp: Optional[int]
+    truncated: bool
+
+
+class HiveRepository:
+    """Interface for storing hives."""
+
+    def iterate(self) -> Iterator[Hive]:
+        """Iterate over all hives. Hives are yielded as they are read."""
+        raise NotImplementedError()
+
+    def page(self, cursor: Optional[str], limit: int) -> Tuple[List[Hive], Optional[str]]:
+        """Return one page of hives.
+
+        :param cursor: Opaque cursor returned by the previous page, or None for the first page.
+        :param limit: Maximum number of hives in page.
+        :return: Hives and cursor for the next page. Cursor is None after the last page.
+        """
+        raise NotImplementedError()
+
+    def query_bbox(self, bbox: geo.BBox, limit: Optional[int] = None) -> List[Hive]:
+        """Return hives inside of bounding box, at most `limit` of them."""
+        raise NotImplementedError()
+
+    def query_bbox_ids(self, bbox: geo.BBox, limit: Optional[int] = None) -> List:
+        """Return ids of hives inside of bounding box, at most `limit` of them, without reading the hives."""
+        return [hive.id for hive in self.query_bbox(bbox, limit)]
+
+    def get_many(self, ids: Iterable) -> List[Hive]:
+        """Return stored hives with given ids, with emails. Missing ids are skipped."""
+        raise NotImplementedError()
+
+    def save(self, hive: Hive) -> Hive:
+        """Store hive. New hives have `id` of None.
+
+        :return: Stored hive, with id assigned.
+        """
+        return self.save_many([hive])[0]
+
+    def save_many(self, hives: List[Hive]) -> List[Hive]:
+        """Store list of hives in one go."""
+        raise NotImplementedError()
+
+    def delete(self, ids: Iterable) -> int:
+        """Delete hives by id.
+
+        :return: Number of ids given. Backends don't check if they existed.
+        """
+        raise NotImplementedError()
+
+    def changes(self, since: int, limit: int) -> Changes:
+        """Return hives saved or deleted after stamp `since`, at most `limit` of each."""
+        raise NotImplementedError()
+
+    def reindex(self) -> int:
+        """Rebuild spatial index data of existing hives.
+
+        :return: Number of hives updated.
+        """
+        return 0
+
+    def warmup(self):
+        """Create connections and clients ahead of the first request."""
+
+
+class MemoryHiveRepository(HiveRepository):
+    """Keep hives in a dict. Data is lost when the process exits."""
+
+    def __init__(self, hives: Iterable[Hive] = ()):
+        self._hives = {}
+        self._stamps = {}
+        self._tombstones = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.save_many(list(hives))
+
+    def iterate(self) -> Iterator[Hive]:
+        with self._lock:
+            hives = list(self._hives.values())
+        return iter(hives)
+
+    def page(self, cursor: Optional[str], limit: int) -> Tuple[List[Hive], Optional[str]]:
+        after = int(cursor) if cursor else 0
+        with self._lock:
+            ids = sorted(id for id in self._hives if id > after)[:limit + 1]
+            hives = [self._hives[id] for id in ids[:limit]]
+        next_cursor = str(hives[-1].id) if len(ids) > limit else None
+        return hives, next_cursor
+
+    def query_bbox(self, bbox: geo.BBox, limit: Optional[int] = None) -> List[Hive]:
+        found = [hive for hive in self.iterate() if bbox.contains(hive.latitude, hive.longitude)]
+        return found[:limit]
+
+    def get_many(self, ids: Iterable) -> List[Hive]:
+        with self._lock:
+            return [self._hives[id] for id in ids if id in self._hives]
+
+    def save_many(self, hives: List[Hive]) -> List[Hive]:
+        saved = []
+        with self._lock:
+            for hive in hives:
+                if hive.id is None:
+                    hive = hive._replace(id=next(self._ids))
+                self._hives[hive.id] = hive
+                self._stamps[hive.id] = next_stamp()
+                self._tombstones.pop(hive.id, None)
+                saved.append(hive)
+        return saved
+
+    def delete(self, ids: Iterable) -> int:
+        ids = list(ids)
+        with self._lock:
+            for id in ids:
+                self._hives.pop(id, None)
+                self._stamps.pop(id, None)
+                self._tombstones[id] = next_stamp()
+        return len(ids)
+
+    def changes(self, since: int, limit: int) -> Changes:
+        with self._lock:
+            saved = sorted((stamp, id) for id, stamp in self._stamps.items() if stamp > since)
+            deleted = sorted((stamp, id) for id, stamp in self._tombstones.items() if stamp > since)
+            hives = [self._hives[id] for _, id in saved[:limit]]
+        return _changes(hives, saved, deleted, limit)
+
+
+class SqliteHiveRepository(HiveRepository):
+    """Store hives in SQLite, indexed with R*Tree.
+
+    :param path: Database file, or ``":memory:"``.
+    :see: https://www.sqlite.org/rtree.html
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        # One connection shared between threads, guarded by lock.
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS hive (
+                    id INTEGER PRIMARY KEY,
+                    latitude REAL NOT NULL,
+                    longitude REAL NOT NULL,
+                    firstname TEXT,
+                    familyname TEXT,
+                    email TEXT,
+                    updated INTEGER
+                )""")
+            # Databases created before change stamps don't have the column.
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(hive)")]
+            if "updated" not in columns:
+                self._db.execute("ALTER TABLE hive ADD COLUMN updated INTEGER")
+            self._db.execute("CREATE INDEX IF NOT EXISTS hive_updated ON hive (updated)")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS hive_deleted (
+                    id INTEGER PRIMARY KEY,
+                    deleted INTEGER NOT NULL
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS hive_deleted_deleted ON hive_deleted (deleted)")
+            self._db.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS hive_rtree
+                USING rtree(id, min_lon, max_lon, min_lat, max_lat)""")
+
+    def iterate(self) -> Iterator[Hive]:
+        # Read in pages, so the lock isn't held while caller handles rows.
+        cursor = None
+        while True:
+            hives, cursor = self.page(cursor, 1000)
+            yield from hives
+            if cursor is None:
+                return
+
+    def page(self, cursor: Optional[str], limit: int) -> Tuple[List[Hive], Optional[str]]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, latitude, longitude, firstname, familyname, email FROM hive"
+                " WHERE id > ? ORDER BY id LIMIT ?", (int(cursor) if cursor else -1, limit + 1)).fetchall()
+        hives = [Hive(*row) for row in rows[:limit]]
+        next_cursor = str(hives[-1].id) if len(rows) > limit else None
+        return hives, next_cursor
+
+    def query_bbox(self, bbox: geo.BBox, limit: Optional[int] = None) -> List[Hive]:
+        rows = self._query_rtree(
+            bbox, limit, "SELECT hive.id, latitude, longitude, firstname, familyname, email")
+        return [Hive(*row) for row in rows]
+
+    def query_bbox_ids(self, bbox: geo.BBox, limit: Optional[int] = None) -> List:
+        """Read ids and coordinates only, without names and emails."""
+        return [row[0] for row in self._query_rtree(bbox, limit, "SELECT hive.id, latitude, longitude")]
+
+    def _query_rtree(self, bbox: geo.BBox, limit: Optional[int], select: str) -> List[tuple]:
+        """Rows in bbox, starting with id, latitude and longitude columns.
+
+        R*Tree keeps bounds as float32, rounded outwards, so a hive on the edge
+        of bbox may not be contained in it by the tree. Tree is queried for
+        overlap instead, and rows are filtered with exact coordinates.
+        """
+        found = []
+        for box in bbox.split():
+            with self._lock:
+                rows = self._db.execute(
+                    select + " FROM hive_rtree JOIN hive ON hive.id = hive_rtree.id"
+                    " WHERE max_lon >= ? AND min_lon <= ? AND max_lat >= ? AND min_lat <= ?",
+                    (box.min_lon, box.max_lon, box.min_lat, box.max_lat),
+                )
+                for row in rows:
+                    if box.contains(row[1], row[2]):
+                        found.append(row)
+                        if limit is not None and len(found) >= limit:
+                            return found
+        return found
+
+    def get_many(self, ids: Iterable) -> List[Hive]:
+        ids = list(ids)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, latitude, longitude, firstname, familyname, email FROM hive"
+                f" WHERE id IN ({', '.join('?' * len(ids))})", ids).fetchall()
+        return [Hive(*row) for row in rows]
+
+    def save_many(self, hives: List[Hive]) -> List[Hive]:
+        saved = []
+        with self._lock, self._db:
+            for hive in hives:
+                cursor = self._db.execute(
+                    "INSERT OR REPLACE INTO hive (id, latitude, longitude, firstname, familyname, email, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)", (*hive, next_stamp()))
+                if hive.id is None:
+                    hive = hive._replace(id=cursor.lastrowid)
+                self._db.execute("DELETE FROM hive_deleted WHERE id = ?", (hive.id,))
+                self._db.execute(
+                    "INSERT OR REPLACE INTO hive_rtree VALUES (?, ?, ?, ?, ?)",
+                    (hive.id, hive.longitude, hive.longitude, hive.latitude, hive.latitude))
+                saved.append(hive)
+        return saved
+
+    def delete(self, ids: Iterable) -> int:
+        rows = [(id,) for id in ids]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM hive WHERE id = ?", rows)
+            self._db.executemany("DELETE FROM hive_rtree WHERE id = ?", rows)
+            self._db.executemany("INSERT OR REPLACE INTO hive_deleted (id, deleted) VALUES (?, ?)", [(id, next_stamp()) for id, in rows])
+        return len(rows)
+
+    def changes(self, since: int, limit: int) -> Changes:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, latitude, longitude, firstname, familyname, email, updated FROM hive"
+                " WHERE updated > ? ORDER BY updated LIMIT ?", (since, limit + 1)).fetchall()
+            deleted = self._db.execute(
+                "SELECT deleted, id FROM hive_deleted WHERE deleted > ? ORDER BY deleted LIMIT ?", (since, limit + 1)).fetchall()
+        saved = [(row[-1], row[0]) for row in rows]
+        return _changes([Hive(*row[:-1]) for row in rows[:limit]], saved, deleted, limit)
+
+
+class DatastoreHiveRepository(HiveRepository):
+    """Store hives as `Hive` kind entities in Google Cloud Datastore.
+
+    Datastore client is created on first use, not on import.
+
+    :param timeout: Deadline for datastore calls, in seconds.
+    :param client: Datastore client to use instead of creating one.
+    :param deadlines: Deadlines by operation name, overriding `timeout`.
+    """
+
+    kind = "Hive"
+    # Deleted hives leave an entity of this kind, with the same id, for change feed.
+    tombstone_kind = "HiveDeleted"
+
+    # Datastore accepts at most 500 entities per batch call.
+    batch_size = 500
+    # Entities per page of bounding box queries.
+    query_page_size = 1000
+
+    def __init__(self, timeout: Optional[float] = None, client=None, deadlines: Optional[dict] = None):
+        self.timeout = timeout
+        self.deadlines = deadlines or {}
+        self._client = client
+        self._lock = threading.Lock()
+
+    def _timeout(self, operation: str) -> Optional[float]:
+        return self.deadlines.get(operation, self.timeout)
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google.cloud import datastore
+                    self._client = datastore.Client()
+        return self._client
+
+    def warmup(self):
+        self.client
+
+    def iterate(self) -> Iterator[Hive]:
+        query = self.client.query(kind=self.kind)
+        for entity in query.fetch(timeout=self._timeout("iterate")):
+            yield self._to_hive(entity)
+
+    def page(self, cursor: Optional[str], limit: int) -> Tuple[List[Hive], Optional[str]]:
+        """Fetch one page using datastore query cursors.
+
+        :raises ValueError: If datastore rejects the cursor, like other backends do.
+        """
+        query = self.client.query(kind=self.kind)
+        try:
+            iterator = query.fetch(start_cursor=cursor.encode("ascii") if cursor else None, limit=limit, timeout=self._timeout("page"))
+            page = next(iterator.pages, [])
+        except Exception as e:
+            # InvalidArgument is a BadRequest. Matched by name, so google
+            # libraries don't need to be imported for the check.
+            if cursor and any(cls.__name__ == "BadRequest" for cls in type(e).__mro__):
+                raise ValueError(f"Invalid cursor: {e!s}") from e
+            raise
+        hives = [self._to_hive(entity) for entity in page]
+
+        next_cursor = iterator.next_page_token
+        if not hives or next_cursor is None:
+            return hives, None
+        return hives, next_cursor.decode("ascii")
+
+    def query_bbox(self, bbox: geo.BBox, limit: Optional[int] = None) -> List[Hive]:
+        """Query hives using `Geohash` property.
+
+        Viewport is covered with a few geohash ranges, and each range is a
+        range query on single property. Cost depends on the amount of hives in
+        view, not on the amount of all hives.
+        """
+        seen = set()
+        found = []
+        entities = self._geohash_ranges(bbox, "query_bbox")
+        for entity in entities:
+            hive = self._to_hive(entity)
+            # Geohash cells cover more than the viewport, so filter out the excess.
+            if hive.id in seen or not bbox.contains(hive.latitude, hive.longitude):
+                continue
+            seen.add(hive.id)
+            found.append(hive)
+            if limit is not None and len(found) >= limit:
+                entities.close()
+                break
+
+        return found
+
+    def _geohash_ranges(self, bbox: geo.BBox, operation: str, keys_only: bool = False) -> Iterator:
+        """Yield entities in geohash ranges covering bbox, one page at a time.
+
+        Ranges are read with cursors until they are exhausted, or caller stops.
+        A `limit` on the query would count entities outside of bbox too, and
+        could leave matches inside of it unread.
+        """
+        for start, end in geo.geohash_ranges(bbox):
+            cursor = None
+            while True:
+                query = self.client.query(kind=self.kind)
+                query.add_filter("Geohash", ">=", start)
+                query.add_filter("Geohash", "<", end)
+                if keys_only:
+                    query.keys_only()
+
+                iterator = query.fetch(start_cursor=cursor, limit=self.query_page_size, timeout=self._timeout(operation))
+                page = list(next(iterator.pages, []))
+                yield from page
+
+                cursor = iterator.next_page_token
+                if not page or cursor is None:
+                    break
+
+    def query_bbox_ids(self, bbox: geo.BBox, limit: Optional[int] = None) -> List:
+        """Query keys of hives in geohash ranges, and filter them by exact coordinates.
+
+        Keys-only queries cost less than reading entities. Geohash ranges
+        cover more than bbox, so hives of the keys are read in batches and
+        checked, to agree with the other backends at the edges.
+        """
+        seen = set()
+        found = []
+        entities = self._geohash_ranges(bbox, "query_bbox_ids", keys_only=True)
+        for batch in _batches((entity.key.id_or_name for entity in entities), self.batch_size):
+            batch = [id for id in batch if id not in seen]
+            seen.update(batch)
+            found.extend(hive.id for hive in self.get_many(batch) if bbox.contains(hive.latitude, hive.longitude))
+            if limit is not None and len(found) >= limit:
+                entities.close()
+                return found[:limit]
+
+        return found
+
+    def get_many(self, ids: Iterable) -> List[Hive]:
+        keys = [self.client.key(self.kind, id) for id in ids]
+        found = []
+        for i in range(0, len(keys), self.batch_size):
+            found.extend(self.client.get_multi(keys[i:i + self.batch_size], timeout=self._timeout("get_many")))
+        return [self._to_hive(entity) for entity in found]
+
+    def save_many(self, hives: List[Hive]) -> List[Hive]:
+        entities = [self._to_entity(hive) for hive in hives]
+        for i in range(0, len(entities), self.batch_size):
+            batch = entities[i:i + self.batch_size]
+            self.client.put_multi(batch, timeout=self._timeout("save_many"))
+            # Hive saved again after being deleted is not deleted anymore, as in the other backends.
+            tombstones = [self.client.key(self.tombstone_kind, hive.id) for hive in hives[i:i + self.batch_size] if hive.id is not None]
+            if tombstones:
+                self.client.delete_multi(tombstones, timeout=self._timeout("save_many"))
+        return [self._to_hive(entity) for entity in entities]
+
+    def delete(self, ids: Iterable) -> int:
+        from google.cloud import datastore
+
+        ids = list(ids)
+        keys = [self.client.key(self.kind, id) for id in ids]
+        tombstones = []
+        for id in ids:
+            tombstone = datastore.Entity(key=self.client.key(self.tombstone_kind, id))
+            tombstone["Deleted"] = next_stamp()
+            tombstones.append(tombstone)
+
+        for i in range(0, len(keys), self.batch_size):
+            # Tombstones first: if deleting fails, a client might drop a hive that still exists
+            # until the next full load, which is better than keeping a deleted one forever.
+            self.client.put_multi(tombstones[i:i + self.batch_size], timeout=self._timeout("delete"))
+            self.client.delete_multi(keys[i:i + self.batch_size], timeout=self._timeout("delete"))
+        return len(keys)
+
+    def changes(self, since: int, limit: int) -> Changes:
+        """Query hives by `Updated` property, and tombstones by `Deleted`. Both are indexed automatically."""
+        timeout = self._timeout("changes")
+
+        query = self.client.query(kind=self.kind)
+        query.add_filter("Updated", ">", since)
+        query.order = ["Updated"]
+        entities = list(query.fetch(limit=limit + 1, timeout=timeout))
+
+        query = self.client.query(kind=self.tombstone_kind)
+        query.add_filter("Deleted", ">", since)
+        query.order = ["Deleted"]
+        deleted = [(entity["Deleted"], entity.key.id_or_name) for entity in query.fetch(limit=limit + 1, timeout=timeout)]
+
+        saved = [(entity["Updated"], entity.key.id_or_name) for entity in entities]
+        return _changes([self._to_hive(entity) for entity in entities[:limit]], saved, deleted, limit)
+
+    def reindex(self) -> int:
+        """Add `Geohash` property into entities missing it. Safe to run multiple times."""
+        batch = []
+        updated = 0
+        for entity in self.client.query(kind=self.kind).fetch():
+            hive = self._to_hive(entity)
+            geohash = geo.encode_geohash(hive.latitude, hive.longitude)
+            if entity.get("Geohash") == geohash:
+                continue
+
+            entity["Geohash"] = geohash
+            batch.append(entity)
+            if len(batch) >= self.batch_size:
+                self.client.put_multi(batch)
+                updated += len(batch)
+                batch = []
+
+        if batch:
+            self.client.put_multi(batch)
+            updated += len(batch)
+
+        return updated
+
+    def _to_entity(self, hive: Hive):
+        from google.cloud import datastore
+
+        if hive.id is None:
+            key = self.client.key(self.kind)
+        else:
+            key = self.client.key(self.kind, hive.id)
+
+        entity = datastore.Entity(key=key)
+        entity["LatLng"] = {
+            "latitude": hive.latitude,
+            "longitude": hive.longitude,
+        }
+        entity["Geohash"] = geo.encode_geohash(hive.latitude, hive.longitude)
+        entity["Firstname"] = hive.firstname
+        entity["Familyname"] = hive.familyname
+        entity["email"] = hive.email
+        entity["Updated"] = next_stamp()
+        return entity
+
+    @staticmethod
+    def _to_hive(entity) -> Hive:
+        return Hive(
+            id=entity.key.id_or_name,
+            latitude=float(entity["LatLng"]['latitude']),
+            longitude=float(entity["LatLng"]['longitude']),
+            firstname=entity.get('Firstname', ""),
+            familyname=entity.get('Familyname', ""),
+            email=entity.get('email'),
+        )
+
+
+class InstrumentedRepository(HiveRepository):
+    """Wrap repository to measure its calls.
+
+    :param repository: Repository doing the work.
+    :param observe: Called after each operation with operation name, duration
+                    in seconds and number of hives read or written.
+    """
+
+    def __init__(self, repository: HiveRepository, observe: Callable[[str, float, int], None]):
+        self.repository = repository
+        self.observe = observe
+
+    def iterate(self) -> Iterator[Hive]:
+        # Measures time until the iterator is exhausted or closed.
+        started = time.perf_counter()
+        count = 0
+        try:
+            for hive in self.repository.iterate():
+                count += 1
+                yield hive
+        finally:
+            self.observe("iterate", time.perf_counter() - started, count)
+
+    def _call(self, operation: str, count: Callable[[object], int], *args, **kwargs):
+        started = time.perf_counter()
+        result = getattr(self.repository, operation)(*args, **kwargs)
+        self.observe(operation, time.perf_counter() - started, count(result))
+        return result
+
+    def page(self, cursor: Optional[str], limit: int) -> Tuple[List[Hive], Optional[str]]:
+        return self._call("page", lambda result: len(result[0]), cursor, limit)
+
+    def query_bbox(self, bbox: geo.BBox, limit: Optional[int] = None) -> List[Hive]:
+        return self._call("query_bbox", len, bbox, limit)
+
+    def query_bbox_ids(self, bbox: geo.BBox, limit: Optional[int] = None) -> List:
+        return self._call("query_bbox_ids", len, bbox, limit)
+
+    def get_many(self, ids: Iterable) -> List[Hive]:
+        return self._call("get_many", len, ids)
+
+    def save_many(self, hives: List[Hive]) -> List[Hive]:
+        return self._call("save_many", len, hives)
+
+    def delete(self, ids: Iterable) -> int:
+        return self._call("delete", int, ids)
+
+    def changes(self, since: int, limit: int) -> Changes:
+        return self._call("changes", lambda result: len(result.saved) + len(result.deleted), since, limit)
+
+    def reindex(self) -> int:
+        return self._call("reindex", int)
+
+    def warmup(self):
+        self.repository.warmup()
+
+
+def _changes(hives: List[Hive], saved: List[Tuple[int, object]], deleted: List[Tuple[int, object]], limit: int) -> Changes:
+    """Build :class:`Changes` from up to ``limit + 1`` `(stamp, id)` pairs of saved and deleted hives."""
+    truncated = len(saved) > limit or len(deleted) > limit
+    saved, deleted = saved[:limit], deleted[:limit]
+    stamps = [stamp for stamp, _ in saved + deleted]
+    if truncated:
+        # Both lists are complete only up to the smaller of their last stamps.
+        last = min(pairs[-1][0] for pairs in (saved, deleted) if len(pairs) == limit)
+        hives = [hive for hive, (stamp, _) in zip(hives, saved) if stamp <= last]
+        deleted = [(stamp, id) for stamp, id in deleted if stamp <= last]
+        stamps = [last]
+    return Changes(hives, [id for _, id in deleted], max(stamps) if stamps else None, truncated)
+
+
+def _batches(items: Iterable, size: int) -> Iterator[list]:
+    """Lists of up to `size` items."""
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def create_repository(config) -> HiveRepository:
+    """Create repository selected by ``HIVE_STORAGE`` config value.
+
+    - ``"datastore"``: :class:`DatastoreHiveRepository`
+    - ``"memory"``: :class:`MemoryHiveRepository`
+    - ``"sqlite"``: :class:`SqliteHiveRepository` in ``HIVE_STORAGE_PATH``
+    """
+    backend = config.get("HIVE_STORAGE", "datastore")
+    logger.debug("Using %s hive storage.", backend)
+
+    if backend == "datastore":
+        return DatastoreHiveRepository(timeout=config.get("DATASTORE_TIMEOUT"), deadlines=config.get("STORAGE_DEADLINES"))
+    if backend == "memory":
+        return MemoryHiveRepository()
+    if backend == "sqlite":
+        return SqliteHiveRepository(config.get("HIVE_STORAGE_PATH", ":memory:"))
+
+    raise ValueError(f"Unknown HIVE_STORAGE {backend!r}")
@@ -0,0 +1,190 @@
+"""Non-blocking telemetry export.
+
+Log records and trace spans are handed to a :class:`BackgroundExporter`,
+which keeps them in a bounded queue and uploads them in batches from its own
+thread. Request threads never wait for Application Insights: when the queue
+is full, items are dropped according to the drop policy and counted.
+"""
+
+from collections import deque
+import logging
+import threading
+import time
+from typing import Callable
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+
+
+class BackgroundExporter:
+    """Bounded queue drained by a background thread in batches.
+
+    :param export: Callable uploading a list of items. Called from the exporter thread.
+    :param max_queue: Maximum number of items waiting for export.
+    :param batch_size: Maximum number of items per `export` call.
+    :param interval: Seconds to wait for a batch to fill up before exporting it anyway.
+    :param policy: What to do when queue is full. :data:`DROP_OLDEST` discards
+                   the oldest waiting item, :data:`DROP_NEWEST` the item being added.
+    :param name: Name of the exporter thread.
+    """
+
+    def __init__(self, export: Callable[[List], None], max_queue: int = 10000, batch_size: int = 100,
+                 interval: float = 5.0, policy: str = DROP_OLDEST, name: str = "telemetry-exporter"):
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop policy {policy!r}")
+
+        self.export = export
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.interval = interval
+        self.policy = policy
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.enqueued = 0
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def put(self, item) -> bool:
+        """Queue item for export. Never blocks on export.
+
+        :return: False if item was dropped.
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return False
+                self._queue.popleft()
+
+            self._queue.append(item)
+            self.enqueued += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.interval
+                while len(self._queue) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                done = self._closed and not self._queue
+
+            if batch:
+                try:
+                    self.export(batch)
+                    self.exported += len(batch)
+                except Exception:
+                    # Can't log it through the handler we are exporting for. Print into stderr.
+                    self.failed += len(batch)
+                    logging.lastResort.handle(logging.makeLogRecord({
+                        "msg": f"Exporting {len(batch)} telemetry items failed.",
+                        "levelno": logging.WARNING, "levelname": "WARNING",
+                    }))
+
+            if done:
+                return
+
+    def close(self, timeout: float = 5.0):
+        """Export what is queued, and stop the thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue),
+            "enqueued": self.enqueued,
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "policy": self.policy,
+        }
+
+
+class QueueLogHandler(logging.Handler):
+    """Logging handler passing records to `handler` through :class:`BackgroundExporter`.
+
+    :param handler: Handler doing the actual, possibly slow, export.
+    """
+
+    def __init__(self, handler: logging.Handler, **options):
+        super().__init__(level=handler.level)
+        self.handler = handler
+        self.queue = BackgroundExporter(self._export, name="telemetry-log-exporter", **options)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.queue.put(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Render message now, so the record doesn't hold references to request state.
+
+        Same as :meth:`logging.handlers.QueueHandler.prepare`, but keeps
+        `exc_info` so exporters can send exceptions with stack traces.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def _export(self, batch: List[logging.LogRecord]):
+        _mark_exporter_thread()
+        # Azure handlers upload a batch with `_export()`. Others get records one by one.
+        export = getattr(self.handler, "_export", None)
+        if export is not None:
+            export(batch)
+        else:
+            for record in batch:
+                self.handler.handle(record)
+
+    def close(self):
+        self.queue.close()
+        self.handler.close()
+        super().close()
+
+
+class QueueSpanExporter:
+    """Opencensus trace exporter passing spans to `exporter` through :class:`BackgroundExporter`.
+
+    :param exporter: Exporter doing the actual upload, such as ``AzureExporter``.
+    """
+
+    def __init__(self, exporter, **options):
+        self.exporter = exporter
+        self.queue = BackgroundExporter(self._export, name="telemetry-span-exporter", **options)
+
+    def export(self, span_datas):
+        for span_data in span_datas:
+            self.queue.put(span_data)
+
+    def emit(self, span_datas):
+        self.export(span_datas)
+
+    def _export(self, batch):
+        _mark_exporter_thread()
+        # `emit()` uploads synchronously, `export()` would queue again into exporter's own queue.
+        self.exporter.emit(batch)
+
+
+def _mark_exporter_thread():
+    """Tell opencensus not to trace requests made by this thread, or we would trace our own uploads."""
+    from opencensus.trace import execution_context
+    execution_context.set_is_exporter(True)
@@ -0,0 +1,349 @@
+"""Slippy map tiles of hive data.
+
+Tiles follow the same ``z/x/y`` scheme as OpenStreetMap base layer, so hive
+data can be loaded tile by tile. Deep zoom levels have individual hives,
+shallow levels have clusters from :class:`~beemap.clustering.ClusterIndex`.
+
+Built tiles are kept in :class:`TileCache`, a LRU cache limited by size in
+bytes. Saving a hive drops only the tiles containing it.
+
+:see: https://wiki.openstreetmap.org/wiki/Slippy_map_tilenames
+:see: https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import struct
+import threading
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .clustering import CELL_SHIFT
+from .clustering import ClusterIndex
+from .geo import BBox
+from .geo import inverse_mercator
+from .geo import mercator
+from .hives import Hive
+
+# Deepest zoom level OpenStreetMap serves.
+MAX_ZOOM = 19
+
+# Zoom level of the bucket grid hives are indexed in.
+BUCKET_ZOOM = 12
+
+# MVT coordinate space within a tile.
+MVT_EXTENT = 4096
+
+FORMATS = {
+    "geojson": "application/geo+json",
+    "mvt": "application/vnd.mapbox-vector-tile",
+}
+
+
+def tile_bbox(z: int, x: int, y: int) -> BBox:
+    """Return area covered by tile."""
+    n = 1 << z
+    north, west = inverse_mercator(x / n, y / n)
+    south, east = inverse_mercator((x + 1) / n, (y + 1) / n)
+    return BBox(west, south, east, north)
+
+
+def tile_for(lat: float, lon: float, z: int) -> Tuple[int, int]:
+    """Return ``(x, y)`` of tile containing the point on zoom level `z`."""
+    n = 1 << z
+    x, y = mercator(lat, lon)
+    return min(int(x * n), n - 1), min(int(y * n), n - 1)
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    return 0 <= z <= MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+
+class TileIndex:
+    """Hives bucketed by tiles of `BUCKET_ZOOM`, for finding hives in a tile.
+
+    Saves and deletes are patched into the buckets and `clusters`, see
+    :class:`~beemap.snapshot.Patched`.
+
+    :param hives: Hives to index.
+    :param clusters: Cluster hierarchy of the same hives, used for tiles shallower than `point_zoom`.
+    :param point_zoom: First zoom level with individual hives instead of clusters.
+    """
+
+    def __init__(self, hives: Iterable[Hive], clusters: ClusterIndex, point_zoom: int = BUCKET_ZOOM):
+        self.clusters = clusters
+        self.point_zoom = max(point_zoom, BUCKET_ZOOM)
+        if clusters.max_zoom + CELL_SHIFT < self.point_zoom - 1:
+            raise ValueError(f"Clusters up to zoom {clusters.max_zoom} are too coarse for tiles up to zoom {self.point_zoom}")
+
+        self.buckets: Dict[Tuple[int, int], List[Hive]] = {}
+        for hive in hives:
+            self.buckets.setdefault(tile_for(hive.latitude, hive.longitude, BUCKET_ZOOM), []).append(hive)
+        self._lock = threading.Lock()
+
+    @property
+    def needs_rebuild(self) -> bool:
+        return self.clusters.needs_rebuild
+
+    def add(self, hives: Iterable[Hive]):
+        hives = list(hives)
+        with self._lock:
+            for hive in hives:
+                key = tile_for(hive.latitude, hive.longitude, BUCKET_ZOOM)
+                # Buckets are replaced, not modified, as tiles are read without the lock.
+                self.buckets[key] = self.buckets.get(key, []) + [hive]
+        self.clusters.add(hives)
+
+    def remove(self, hives: Iterable[Hive]):
+        removed = []
+        with self._lock:
+            for hive in hives:
+                key = tile_for(hive.latitude, hive.longitude, BUCKET_ZOOM)
+                bucket = self.buckets.get(key, [])
+                kept = [other for other in bucket if other.id != hive.id]
+                if len(kept) == len(bucket):
+                    continue
+                removed.append(hive)
+                if kept:
+                    self.buckets[key] = kept
+                else:
+                    del self.buckets[key]
+        # Only hives that were indexed, so clusters aren't uncounted twice.
+        self.clusters.remove(removed)
+
+    def stats(self) -> dict:
+        return {
+            "buckets": len(self.buckets),
+            "changes": self.clusters.changes,
+        }
+
+    def hives(self, z: int, x: int, y: int) -> List[Hive]:
+        """Individual hives inside of tile. Tile must be at least on `BUCKET_ZOOM`."""
+        shift = z - BUCKET_ZOOM
+        bucket = self.buckets.get((x >> shift, y >> shift), [])
+        if shift == 0:
+            return list(bucket)
+        return [hive for hive in bucket if tile_for(hive.latitude, hive.longitude, z) == (x, y)]
+
+    def features(self, z: int, x: int, y: int) -> List[dict]:
+        """Return tile content as list of dicts with ``lat``, ``lon`` and ``count``.
+
+        Single hives have also ``hive`` key.
+        """
+        if z >= self.point_zoom:
+            return [
+                {"lat": hive.latitude, "lon": hive.longitude, "count": 1, "id": hive.id, "hive": hive}
+                for hive in self.hives(z, x, y)
+            ]
+
+        # Use cells of 16px, so each tile is split into 16x16 clusters.
+        level_zoom = min(z + 2, self.clusters.max_zoom)
+        level = self.clusters.levels[level_zoom]
+        shift = level_zoom + CELL_SHIFT - z
+        features = []
+        for cx in range(x << shift, (x + 1) << shift):
+            for cy in range(y << shift, (y + 1) << shift):
+                cluster = level.get((cx, cy))
+                if cluster is not None:
+                    features.append(cluster.to_dict())
+        return features
+
+
+def encode_geojson(features: List[dict], describe: Callable[[Hive], str]) -> bytes:
+    """Encode tile features as GeoJSON `FeatureCollection`."""
+    collection = {"type": "FeatureCollection", "features": []}
+    for feature in features:
+        properties = {"count": feature["count"]}
+        if "id" in feature:
+            properties["id"] = feature["id"]
+        if "hive" in feature:
+            properties["description"] = describe(feature["hive"])
+        collection["features"].append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [feature["lon"], feature["lat"]]},
+            "properties": properties,
+        })
+    return json.dumps(collection, separators=(",", ":")).encode("utf-8")
+
+
+def encode_mvt(features: List[dict], z: int, x: int, y: int, describe: Callable[[Hive], str], layer: str = "hives") -> bytes:
+    """Encode tile features as Mapbox Vector Tile with a single point layer."""
+    n = 1 << z
+    keys: Dict[str, int] = {}
+    values: Dict[Tuple[str, object], int] = {}
+
+    def tag(key, value):
+        key_index = keys.setdefault(key, len(keys))
+        value_index = values.setdefault((type(value).__name__, value), len(values))
+        return [key_index, value_index]
+
+    encoded_features = []
+    for feature in features:
+        wx, wy = mercator(feature["lat"], feature["lon"])
+        px = int(round((wx * n - x) * MVT_EXTENT))
+        py = int(round((wy * n - y) * MVT_EXTENT))
+
+        tags = tag("count", feature["count"])
+        if "hive" in feature:
+            tags += tag("description", describe(feature["hive"]))
+
+        message = b""
+        if isinstance(feature.get("id"), int):
+            message += _field_varint(1, feature["id"])
+        message += _field_bytes(2, _packed(tags))
+        # GeomType POINT
+        message += _field_varint(3, 1)
+        # MoveTo command with single point.
+        message += _field_bytes(4, _packed([(1 << 3) | 1, _zigzag(px), _zigzag(py)]))
+        encoded_features.append(message)
+
+    body = _field_varint(15, 2) + _field_bytes(1, layer.encode("utf-8"))
+    for message in encoded_features:
+        body += _field_bytes(2, message)
+    for key in keys:
+        body += _field_bytes(3, key.encode("utf-8"))
+    for kind, value in values:
+        if kind == "str":
+            body += _field_bytes(4, _field_bytes(1, value.encode("utf-8")))
+        elif kind == "float":
+            body += _field_bytes(4, (3 << 3 | 1).to_bytes(1, "little") + struct.pack("<d", value))
+        else:
+            body += _field_bytes(4, _field_varint(5, value))
+    body += _field_varint(5, MVT_EXTENT)
+
+    return _field_bytes(3, body)
+
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _packed(values: List[int]) -> bytes:
+    return b"".join(_varint(v) for v in values)
+
+
+def _field_varint(number: int, value: int) -> bytes:
+    return _varint(number << 3) + _varint(value)
+
+
+def _field_bytes(number: int, value: bytes) -> bytes:
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+class Tile:
+    """Encoded tile body with its strong ETag."""
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+
+
+class TileCache:
+    """LRU cache of built tiles, bounded by total body size.
+
+    Keys are tuples starting with ``(z, x, y)``, followed by anything else the
+    tile depends on, such as format and locale.
+
+    :param max_bytes: Eviction budget. Least recently used tiles are dropped
+                      when total size exceeds this.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._tiles: "OrderedDict[tuple, Tile]" = OrderedDict()
+        # Keys by their ``(z, x, y)``, so invalidation doesn't need to scan the cache.
+        self._by_tile: Dict[Tuple[int, int, int], set] = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, so tiles built from older data are not stored.
+        self.generation = 0
+        self._source = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple) -> Optional[Tile]:
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+
+    def put(self, key: tuple, tile: Tile, generation: int):
+        """Store tile, unless cache was invalidated after `generation`."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._remove(key)
+            self._tiles[key] = tile
+            self._by_tile.setdefault(key[:3], set()).add(key)
+            self.size += len(tile.body)
+
+            while self.size > self.max_bytes and self._tiles:
+                self._remove(next(iter(self._tiles)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple) -> bool:
+        tile = self._tiles.pop(key, None)
+        if tile is None:
+            return False
+        self.size -= len(tile.body)
+        keys = self._by_tile[key[:3]]
+        keys.discard(key)
+        if not keys:
+            del self._by_tile[key[:3]]
+        return True
+
+    def invalidate_point(self, lat: float, lon: float):
+        """Drop tiles on every zoom level containing the point."""
+        with self._lock:
+            self.generation += 1
+            for z in range(MAX_ZOOM + 1):
+                x, y = tile_for(lat, lon, z)
+                for key in list(self._by_tile.get((z, x, y), ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def sync(self, source):
+        """Drop everything when tiles source changes, e.g. snapshot is reloaded."""
+        with self._lock:
+            if source != self._source:
+                self._source = source
+                self.generation += 1
+                self._tiles.clear()
+                self._by_tile.clear()
+                self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "tiles": len(self._tiles),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,61 @@
+"""Tracing that doesn't cost an import until it's enabled.
+
+Opencensus and the Azure exporters take a large part of the app import time.
+Routes use :func:`tracer` and :func:`status` from here, which return no-op
+objects until :func:`enable` is called by telemetry setup, so instances
+without Application Insights never import opencensus.
+"""
+
+from contextlib import contextmanager
+
+_enabled = False
+
+
+class NoopSpan:
+    """Accepts the span calls routes make, and ignores them."""
+
+    status = None
+
+    def add_annotation(self, description, **attrs):
+        pass
+
+    def add_attribute(self, key, value):
+        pass
+
+
+class NoopTracer:
+    @contextmanager
+    def span(self, name: str = "span"):
+        yield NoopSpan()
+
+
+_noop_tracer = NoopTracer()
+
+
+def enable():
+    """Use opencensus tracer from now on."""
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def tracer():
+    """Return opencensus tracer of the current request, or no-op tracer if tracing isn't enabled."""
+    if not _enabled:
+        return _noop_tracer
+    from opencensus.trace import execution_context
+    return execution_context.get_opencensus_tracer()
+
+
+def status(code: int, message: str):
+    """Return opencensus span status, or None if tracing isn't enabled.
+
+    :param code: gRPC status code, 0 is OK.
+    """
+    if not _enabled:
+        return None
+    from opencensus.trace.status import Status
+    return Status(code, message)
@@ -0,0 +1,217 @@
+"""Compact marker payloads for the map.
+
+Both formats carry the same data as `/hives.ndjson` markers in a fraction of
+the bytes:
+
+- Coordinates are fixed point with 5 decimals (about 1m), and each hive is
+  stored as the difference to the previous one.
+- Hives are sorted by id, so ids are stored as differences too.
+- Names are in a table of unique strings, hives refer to them by index.
+- Descriptions aren't sent, browser builds them from the names.
+
+Binary format (`/hives.bin`) is made of unsigned LEB128 varints, and signed
+values are zigzag encoded first, as in protocol buffers::
+
+    magic "BHV1"
+    string count, then each string as byte length and UTF-8 bytes
+    hive count
+    id type: 0 for integer ids, 1 for string ids given as string table indices
+    per hive: id (delta, or string index), latitude delta, longitude delta,
+              firstname index, familyname index
+
+JSON format (`/hives.polyline.json`) encodes coordinates with the Google
+polyline algorithm, and other columns as plain lists.
+
+:see: https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+"""
+
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+from .hives import Hive
+from .hiveset import HiveSet
+
+MAGIC = b"BHV1"
+
+# Coordinates are sent as integers of 1e-5 degrees.
+PRECISION = 100000
+
+
+def _fixed(value: float) -> int:
+    return int(round(value * PRECISION))
+
+
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def _varint(value: int, out: bytearray):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[position]
+        except IndexError:
+            raise ValueError("Truncated hive payload")
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def _columns(hives: HiveSet):
+    """Hives sorted by id when ids are integers, with names as string table indices."""
+    int_ids = all(type(hive_id) is int for hive_id in hives.ids)
+    order = sorted(range(len(hives)), key=hives.ids.__getitem__) if int_ids else range(len(hives))
+
+    strings = list(hives.strings)
+    ids = [hives.ids[i] for i in order]
+    if not int_ids:
+        table = {value: index for index, value in enumerate(strings)}
+        ids = [table.setdefault(str(hive_id), len(table)) for hive_id in ids]
+        strings = list(table)
+
+    return (
+        int_ids,
+        ids,
+        [_fixed(hives.latitudes[i]) for i in order],
+        [_fixed(hives.longitudes[i]) for i in order],
+        [hives.firstnames[i] for i in order],
+        [hives.familynames[i] for i in order],
+        strings,
+    )
+
+
+def encode_binary(hives: HiveSet) -> bytes:
+    """Encode hives into the binary marker format."""
+    int_ids, ids, lats, lons, firstnames, familynames, strings = _columns(hives)
+
+    out = bytearray(MAGIC)
+    _varint(len(strings), out)
+    for value in strings:
+        data = value.encode("utf-8")
+        _varint(len(data), out)
+        out += data
+
+    _varint(len(ids), out)
+    _varint(0 if int_ids else 1, out)
+    previous_id = previous_lat = previous_lon = 0
+    for hive_id, lat, lon, first, family in zip(ids, lats, lons, firstnames, familynames):
+        if int_ids:
+            _varint(_zigzag(hive_id - previous_id), out)
+            previous_id = hive_id
+        else:
+            _varint(hive_id, out)
+        _varint(_zigzag(lat - previous_lat), out)
+        _varint(_zigzag(lon - previous_lon), out)
+        _varint(first, out)
+        _varint(family, out)
+        previous_lat, previous_lon = lat, lon
+    return bytes(out)
+
+
+def decode_binary(data: bytes) -> List[Hive]:
+    """Decode binary marker format. Coordinates come back rounded to :data:`PRECISION`.
+
+    :raises ValueError: If data isn't a valid payload.
+    """
+    if data[:4] != MAGIC:
+        raise ValueError("Not a hive payload")
+    position = 4
+
+    count, position = _read_varint(data, position)
+    strings = []
+    for _ in range(count):
+        size, position = _read_varint(data, position)
+        strings.append(data[position:position + size].decode("utf-8"))
+        position += size
+
+    count, position = _read_varint(data, position)
+    id_type, position = _read_varint(data, position)
+    hives = []
+    hive_id = lat = lon = 0
+    for _ in range(count):
+        value, position = _read_varint(data, position)
+        if id_type == 0:
+            hive_id += _unzigzag(value)
+            current_id = hive_id
+        else:
+            current_id = strings[value]
+        value, position = _read_varint(data, position)
+        lat += _unzigzag(value)
+        value, position = _read_varint(data, position)
+        lon += _unzigzag(value)
+        first, position = _read_varint(data, position)
+        family, position = _read_varint(data, position)
+        hives.append(Hive(current_id, lat / PRECISION, lon / PRECISION, strings[first], strings[family]))
+    return hives
+
+
+def encode_polyline(values: Iterable[int]) -> str:
+    """Encode fixed point integers, already delta encoded or not, with the polyline algorithm."""
+    chunks = []
+    for value in values:
+        value = ~(value << 1) if value < 0 else value << 1
+        while value >= 0x20:
+            chunks.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def decode_polyline(text: str) -> List[int]:
+    values = []
+    value = shift = 0
+    for char in text:
+        byte = ord(char) - 63
+        value |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return values
+
+
+def encode_polyline_json(hives: HiveSet) -> dict:
+    """Encode hives into the polyline JSON marker format.
+
+    `points` is a polyline of latitude, longitude pairs as in Google's format,
+    `ids` are differences to the previous id for integer ids, and string table
+    indices otherwise. `names` holds firstname and familyname index pairs.
+    """
+    int_ids, ids, lats, lons, firstnames, familynames, strings = _columns(hives)
+
+    deltas = []
+    previous_lat = previous_lon = 0
+    for lat, lon in zip(lats, lons):
+        deltas += [lat - previous_lat, lon - previous_lon]
+        previous_lat, previous_lon = lat, lon
+
+    if int_ids:
+        ids = [hive_id - previous for hive_id, previous in zip(ids, [0] + ids)]
+
+    names = []
+    for first, family in zip(firstnames, familynames):
+        names += [first, family]
+
+    return {
+        "count": len(ids),
+        "idType": "delta" if int_ids else "string",
+        "ids": ids,
+        "points": encode_polyline(deltas),
+        "strings": strings,
+        "names": names,
+    }
@@ -0,0 +1,130 @@
+"""Write-behind buffer for coalescing single writes into batches.
+
+Instead of one datastore round-trip per saved hive, writes are collected into
+a buffer and flushed with a single batch call when the buffer has `max_size`
+items, or when the oldest item has waited `max_delay` seconds.
+
+Durability depends on how the caller waits for the returned future:
+
+- *Acknowledged after flush*: caller waits for the future. When it resolves,
+  the item is stored. Concurrent requests share one batch call.
+- *Acknowledged on enqueue*: caller returns right away. Items still in the
+  buffer are lost if the process dies before flushing them. On normal
+  shutdown :meth:`WriteBehindBuffer.close` flushes what is left.
+"""
+
+from concurrent.futures import Future
+import logging
+import threading
+import time
+from typing import Callable
+from typing import List
+from typing import Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    """Raised when buffer has `max_pending` items waiting for flush."""
+
+
+class WriteBehindBuffer:
+    """Collect items and pass them to `flush` in batches from a background thread.
+
+    :param flush: Callable storing a list of items. Called from the buffer thread.
+    :param max_size: Flush when this many items are waiting. Also the maximum batch size.
+    :param max_delay: Flush when the oldest item has waited this many seconds.
+    :param max_pending: Refuse new items when this many are waiting.
+    """
+
+    def __init__(self, flush: Callable[[List], None], max_size: int = 500, max_delay: float = 0.5, max_pending: int = 10000):
+        self.flush = flush
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+
+        self._items: List[Tuple[object, Future, float]] = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+        self.flushes = 0
+        self.flushed = 0
+        self.failed = 0
+
+    def submit(self, item) -> Future:
+        """Add item into buffer.
+
+        :return: Future that resolves when the item has been flushed, or
+                 raises the exception `flush` raised.
+        :raises BufferFull: If too many items are waiting.
+        """
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind buffer is closed")
+            if len(self._items) >= self.max_pending:
+                raise BufferFull(f"{len(self._items)} items waiting for flush")
+            self._items.append((item, future, time.monotonic()))
+            if len(self._items) >= self.max_size:
+                self._cond.notify()
+            elif len(self._items) == 1:
+                # Wake up the thread to start the delay timer.
+                self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._items:
+                        wait = self._items[0][2] + self.max_delay - time.monotonic()
+                        if len(self._items) >= self.max_size or wait <= 0 or self._closed:
+                            break
+                        self._cond.wait(wait)
+                    elif self._closed:
+                        return
+                    else:
+                        self._cond.wait()
+
+                batch = self._items[:self.max_size]
+                del self._items[:self.max_size]
+
+            self._flush(batch)
+
+    def _flush(self, batch: List[Tuple[object, Future, float]]):
+        try:
+            self.flush([item for item, _, _ in batch])
+        except Exception as e:
+            logger.exception("Flushing %d buffered writes failed.", len(batch))
+            self.failed += len(batch)
+            for _, future, _ in batch:
+                future.set_exception(e)
+        else:
+            self.flushes += 1
+            self.flushed += len(batch)
+            for _, future, _ in batch:
+                future.set_result(True)
+
+    def close(self, timeout: float = 10.0):
+        """Flush remaining items and stop the buffer thread.
+
+        Items submitted after this raise `RuntimeError`.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.error("Write-behind buffer did not flush in %.1fs, %d writes may be lost.", timeout, len(self._items))
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._items),
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "max_size": self.max_size,
+            "max_delay": self.max_delay,
+        }
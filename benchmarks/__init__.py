@@ -0,0 +1 @@
+"""Benchmarks for catching performance regressions. See :mod:`benchmarks.run`."""
@@ -0,0 +1,328 @@
+"""Load test the app with a mix of map reads and hive saves.
+
+Requests are sent with plain asyncio streams over keep-alive HTTP/1.1
+connections, so many concurrent requests don't need a thread each.
+
+Two ways to generate load:
+
+- Closed loop (``--workers N``): N workers each send a request, wait for the
+  response, and send the next one. Measures how fast the server can go.
+- Fixed arrival rate (``--rate R``): R requests per second are started on
+  schedule, regardless of how slow the responses are. Shows how latency
+  behaves when the server falls behind.
+
+Usage::
+
+    # Start local server with in-memory storage, seeded with 10000 hives
+    python -m benchmarks.loadtest --local --seed 10000 --workers 20 --duration 30
+
+    # Against staging, reads only
+    python -m benchmarks.loadtest --url $WEBSITE_STAGING --rate 5 --write-ratio 0
+
+A read loads the map page and its markers (``GET /`` and
+``GET /hives.ndjson``), a write is ``POST /save``. Latency percentiles,
+throughput and error rates are reported per request path.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READ_PATHS = ["/", "/hives.ndjson"]
+SAVE_PATH = "/save"
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of `values`."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+class Stats:
+    """Latencies and errors, per request path."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def record(self, path: str, seconds: float, ok: bool):
+        self.latencies.setdefault(path, []).append(seconds)
+        self.errors.setdefault(path, 0)
+        if not ok:
+            self.errors[path] += 1
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        paths = {}
+        for path, latencies in self.latencies.items():
+            paths[path] = {
+                "requests": len(latencies),
+                "errors": self.errors[path],
+                "error_rate": self.errors[path] / len(latencies),
+                "throughput": len(latencies) / elapsed,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "duration": elapsed,
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput": total / elapsed if elapsed else 0.0,
+            "paths": paths,
+        }
+
+
+class Connection:
+    """One keep-alive HTTP/1.1 connection."""
+
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: Optional[bytes] = None) -> int:
+        """Send request, read whole response and return status code."""
+        return await asyncio.wait_for(self._request(method, path, body), self.timeout)
+
+    async def _request(self, method: str, path: str, body: Optional[bytes]) -> int:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+
+        head = [f"{method} {self.prefix}{path} HTTP/1.1", f"Host: {self.host}", "Accept-Encoding: gzip", "Connection: keep-alive"]
+        if body is not None:
+            head += ["Content-Type: application/json", f"Content-Length: {len(body)}"]
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by server")
+        status = int(status_line.split()[1])
+
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            await self.reader.readexactly(int(headers["content-length"]))
+        elif status not in (204, 304):
+            await self.reader.read()
+            self.close()
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class LoadTest:
+    """Mix of reads and writes against `url`.
+
+    :param write_ratio: Fraction of operations that are saves.
+    """
+
+    def __init__(self, url: str, write_ratio: float = 0.1, timeout: float = 30.0, seed: int = 5901):
+        self.url = url
+        self.write_ratio = write_ratio
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.stats = Stats()
+
+    def _hive(self) -> bytes:
+        return json.dumps({
+            "latitude": self.random.uniform(59.8, 70.0),
+            "longitude": self.random.uniform(20.5, 31.5),
+            "firstname": "Kuormitus",
+            "familyname": "Testi",
+            "email": "kuormitus@example.com",
+        }).encode("utf-8")
+
+    async def _timed(self, connection: Connection, method: str, path: str, body: Optional[bytes] = None):
+        started = time.perf_counter()
+        try:
+            status = await connection.request(method, path, body)
+            ok = 200 <= status < 400
+        except (OSError, asyncio.TimeoutError, ValueError, asyncio.IncompleteReadError):
+            connection.close()
+            ok = False
+        self.stats.record(path, time.perf_counter() - started, ok)
+
+    async def operation(self, connection: Connection):
+        """One read (map page and markers) or write (save)."""
+        if self.random.random() < self.write_ratio:
+            await self._timed(connection, "POST", SAVE_PATH, self._hive())
+        else:
+            for path in READ_PATHS:
+                await self._timed(connection, "GET", path)
+
+    async def closed_loop(self, workers: int, duration: float) -> dict:
+        deadline = time.perf_counter() + duration
+
+        async def worker():
+            connection = Connection(self.url, self.timeout)
+            try:
+                while time.perf_counter() < deadline:
+                    await self.operation(connection)
+            finally:
+                connection.close()
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        self.stats.finished = time.perf_counter()
+        return self.stats.report()
+
+    async def fixed_rate(self, rate: float, duration: float) -> dict:
+        """Start `rate` operations per second, reusing idle connections."""
+        idle: List[Connection] = []
+        tasks = []
+
+        async def run():
+            connection = idle.pop() if idle else Connection(self.url, self.timeout)
+            await self.operation(connection)
+            idle.append(connection)
+
+        started = time.perf_counter()
+        for i in range(int(rate * duration)):
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(run()))
+
+        await asyncio.gather(*tasks)
+        self.stats.finished = time.perf_counter()
+        for connection in idle:
+            connection.close()
+        return self.stats.report()
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(port: int, seed: int):
+    """Run the app with in-memory storage seeded with `seed` hives."""
+    sys.path.insert(0, ROOT)
+    import main
+    from benchmarks.run import seed as seed_hives
+
+    main.app.config["HIVE_STORAGE"] = "memory"
+    seed_hives(main.hive_repository(), seed)
+    # Request log lines would cost more than some of the requests.
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    main.app.run(host="127.0.0.1", port=port, threaded=True, use_reloader=False)
+
+
+def start_local(seed: int, timeout: float = 60.0) -> "tuple[subprocess.Popen, str]":
+    """Start local server in subprocess, and wait until it answers."""
+    port = _free_port()
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.loadtest", "--serve", str(port), "--seed", str(seed)], cwd=ROOT, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Local server exited")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Local server did not start")
+
+
+def format_report(report: dict) -> str:
+    lines = [f"{report['requests']} requests in {report['duration']:.1f}s, {report['throughput']:.1f} req/s, {report['errors']} errors"]
+    lines.append(f"{'path':<16}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for path, stats in sorted(report["paths"].items()):
+        lines.append(
+            f"{path:<16}{stats['requests']:>10}{stats['errors']:>8}{stats['throughput']:>10.1f}"
+            f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--url", help="Server to test.")
+    target.add_argument("--local", action="store_true", help="Start local server with in-memory storage.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--workers", type=int, default=10, help="Closed loop workers.")
+    mode.add_argument("--rate", type=float, help="Fixed arrival rate, operations per second.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run.")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="Fraction of operations that are saves.")
+    parser.add_argument("--seed", type=int, default=1000, help="Hives to seed local server with.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Request timeout in seconds.")
+    parser.add_argument("--output", help="Write report as JSON.")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.seed)
+        return 0
+
+    process = None
+    url = args.url or os.getenv("WEBSITE_STAGING")
+    if args.local or not url:
+        process, url = start_local(args.seed)
+
+    try:
+        test = LoadTest(url, write_ratio=args.write_ratio, timeout=args.timeout)
+        if args.rate:
+            report = asyncio.run(test.fixed_rate(args.rate, args.duration))
+        else:
+            report = asyncio.run(test.closed_loop(args.workers, args.duration))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Benchmark map and save paths against seeded in-memory storage.
+
+Each dataset size runs in its own subprocess, so peak memory is measured per
+size. Results are written as JSON, and optionally compared against a stored
+baseline. Exit code is 1 if any metric regressed more than the threshold.
+
+Usage::
+
+    # Run and compare against baseline
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+    # Update the baseline
+    python -m benchmarks.run --sizes 1000,10000 --output benchmarks/baseline.json
+
+Measured for every dataset size:
+
+- ``home_ms``: Latency of ``GET /``, the map page.
+- ``markers_cold_ms``: ``GET /hives.ndjson`` with empty snapshot, reading from storage.
+- ``markers_ms``: ``GET /hives.ndjson`` with loaded snapshot.
+- ``markers_bytes`` and ``markers_gzip_bytes``: Marker payload size.
+- ``markers_bin_bytes``: Size of the compact binary marker payload.
+- ``save_per_s``: ``POST /save`` throughput.
+- ``peak_rss_mb``: Peak resident memory of the process.
+
+And once: ``startup_ms``, time to import the app in a fresh interpreter.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+# Whether bigger or smaller is better, by metric name suffix.
+HIGHER_IS_BETTER = ("_per_s",)
+
+
+def seed(repository, size: int, seed: int = 5901):
+    """Fill storage with `size` hives spread around Finland."""
+    from beemap.hives import Hive
+
+    rnd = random.Random(seed)
+    batch = []
+    for i in range(size):
+        batch.append(Hive(None, rnd.uniform(59.8, 70.0), rnd.uniform(20.5, 31.5), f"Maija{i % 1000}", "Mehiläinen", f"maija{i}@example.com"))
+        if len(batch) == 10000:
+            repository.save_many(batch)
+            batch = []
+    if batch:
+        repository.save_many(batch)
+
+
+def _timed(fn, repeat: int) -> List[float]:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def run_size(size: int, repeat: int) -> Dict[str, float]:
+    """Benchmark one dataset size in this process."""
+    sys.path.insert(0, ROOT)
+    import main
+
+    main.app.config["TESTING"] = True
+    main.app.config["HIVE_STORAGE"] = "memory"
+    seed(main.hive_repository(), size)
+
+    client = main.app.test_client()
+    results = {}
+
+    results["home_ms"] = statistics.median(_timed(lambda: client.get("/"), repeat))
+
+    def cold_markers():
+        main.hive_snapshot.reset()
+        client.get("/hives.ndjson").get_data()
+
+    results["markers_cold_ms"] = statistics.median(_timed(cold_markers, max(1, repeat // 5)))
+    # Let background load finish.
+    main.hive_snapshot.get()
+
+    markers = client.get("/hives.ndjson").get_data()
+    results["markers_ms"] = statistics.median(_timed(lambda: client.get("/hives.ndjson").get_data(), repeat))
+    results["markers_bytes"] = len(markers)
+    results["markers_gzip_bytes"] = len(client.get("/hives.ndjson", headers={"Accept-Encoding": "gzip"}).get_data())
+    results["markers_bin_bytes"] = len(client.get("/hives.bin").get_data())
+
+    hive = {"latitude": 62.24, "longitude": 25.72, "firstname": "Maija", "familyname": "Mehiläinen", "email": "maija@example.com"}
+    saves = repeat * 10
+    started = time.perf_counter()
+    for _ in range(saves):
+        client.post("/save", json=hive)
+    results["save_per_s"] = saves / (time.perf_counter() - started)
+
+    # ru_maxrss is kilobytes on Linux, bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["peak_rss_mb"] = maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+    return results
+
+
+def measure_startup(repeat: int = 3) -> float:
+    """Milliseconds to import the app in a fresh interpreter."""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import main"], cwd=ROOT, check=True, capture_output=True)
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Return descriptions of metrics worse than baseline by more than `threshold` (0.2 = 20%)."""
+    regressions = []
+    for name, base_metrics in baseline.get("results", {}).items():
+        current = results.get("results", {}).get(name)
+        if current is None:
+            continue
+        for metric, base in base_metrics.items():
+            value = current.get(metric)
+            if value is None or not base:
+                continue
+            change = (value - base) / base
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = -change
+            if change > threshold:
+                regressions.append(f"{name}.{metric}: {base:.2f} -> {value:.2f} ({change:+.0%} worse)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="Comma separated dataset sizes.")
+    parser.add_argument("--repeat", type=int, default=20, help="Repetitions of each measurement.")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write results.")
+    parser.add_argument("--compare", metavar="BASELINE", help="Baseline results to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed regression, 0.25 = 25%%.")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker is not None:
+        print(json.dumps(run_size(args.worker, args.repeat)))
+        return 0
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": {},
+    }
+    results["results"]["startup"] = {"startup_ms": measure_startup()}
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        print(f"Benchmarking {size} hives...", file=sys.stderr)
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.run", "--worker", str(size), "--repeat", str(args.repeat)],
+            cwd=ROOT, check=True, capture_output=True, text=True,
+        ).stdout
+        results["results"][str(size)] = json.loads(output.strip().splitlines()[-1])
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
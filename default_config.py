@@ -1,3 +1,152 @@
+import os
+
 DEBUG = True
 SECRET_KEY = "Back to the future movies are all time greats but thats no secret"
 BABEL_DEFAULT_LOCALE = "fi"
+
+# Maximum number of hives returned by single viewport query.
+HIVES_QUERY_LIMIT = 2000
+
+# Seconds the in-memory hive snapshot is served without refreshing from datastore.
+HIVE_SNAPSHOT_TTL = 60
+# File through which worker processes share one hive snapshot, or None to
+# keep a snapshot per process. Set by gunicorn.conf.py.
+HIVE_SNAPSHOT_FILE = os.getenv("HIVE_SNAPSHOT_FILE")
+# Hives saved or deleted after the snapshot was loaded, kept aside until there
+# are this many of them, and merged into the snapshot columns.
+HIVE_SNAPSHOT_MAX_CHANGES = 1000
+
+# Deadline for datastore queries, in seconds.
+DATASTORE_TIMEOUT = 10
+# Deadlines by storage operation, in seconds, overriding DATASTORE_TIMEOUT.
+# Retries of reads stop when the next attempt wouldn't start in time.
+STORAGE_DEADLINES = {"iterate": 30.0, "page": 5.0, "query_bbox": 5.0, "query_bbox_ids": 5.0, "get_many": 5.0, "changes": 5.0, "save_many": 10.0, "delete": 10.0}
+# Attempts of idempotent storage calls on transient errors, and bounds of the
+# jittered exponential backoff between them, in seconds.
+STORAGE_RETRY_ATTEMPTS = 3
+STORAGE_RETRY_BASE_DELAY = 0.1
+STORAGE_RETRY_MAX_DELAY = 2.0
+# Consecutive storage failures after which calls fail fast with 503...
+STORAGE_BREAKER_THRESHOLD = 5
+# ...until this many seconds have passed and a trial call is let through.
+STORAGE_BREAKER_RESET = 30.0
+
+# Deepest zoom level for server-side marker clustering.
+CLUSTER_MAX_ZOOM = 14
+# Hives saved or deleted after clusters were built, patched into them until
+# there are this many of them, and clusters are rebuilt.
+CLUSTER_MAX_CHANGES = 1000
+
+# Deepest zoom level of the hive density heatmap pyramid. Deeper zooms use this level.
+HEATMAP_MAX_ZOOM = 10
+# Maximum number of bins in one `/heatmap` response. Larger viewports get coarser bins.
+HEATMAP_MAX_BINS = 128 * 128
+
+# Most hives returned by `/hives/nearest` and `/hives/within`.
+NEAREST_LIMIT = 1000
+# Largest radius of `/hives/within`, in meters.
+NEAREST_MAX_RADIUS = 100000
+# Hives saved or deleted after the search tree was built, searched separately
+# until there are this many of them, and the tree is rebuilt.
+NEAREST_MAX_CHANGES = 1000
+
+# Defaults of `flask import-hives`: hives per storage write, and writes at once.
+IMPORT_CHUNK_SIZE = 500
+IMPORT_WORKERS = 4
+
+# Tiles from this zoom level onwards have individual hives, shallower ones have clusters.
+TILE_POINT_ZOOM = 12
+# Eviction budget of tile cache, in bytes.
+TILE_CACHE_BYTES = 32 * 1024 * 1024
+# How long browsers and CDNs may use a tile without revalidating, in seconds.
+TILE_MAX_AGE = 60
+
+# How long browsers and CDNs may cache the map page, in seconds.
+PAGE_MAX_AGE = 300
+
+# How `/save` stores hives:
+# - "sync": Put each hive with its own datastore call.
+# - "flush": Buffer writes and acknowledge after the batch is stored.
+# - "enqueue": Buffer writes and acknowledge right away. Buffered writes are
+#   lost if the instance dies before flushing.
+HIVE_WRITE_MODE = "sync"
+# Write-behind buffer flushes when it has this many hives...
+WRITE_BEHIND_MAX_SIZE = 100
+# ...or when the oldest has waited this many seconds.
+WRITE_BEHIND_MAX_DELAY = 0.2
+# Refuse writes with 503 when this many are waiting.
+WRITE_BEHIND_MAX_PENDING = 5000
+
+# Maximum number of hives in one `/save/batch` request.
+SAVE_BATCH_LIMIT = 5000
+# Maximum number of hives deleted by one `/delete` request.
+DELETE_LIMIT = 5000
+# Bearer token for deleting any hives, e.g. spam by bbox. Without it, hives
+# can only be deleted one at a time by their owner, giving the email they
+# were saved with.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Where hives are stored: "datastore", "memory" or "sqlite".
+# "memory" and "sqlite" are for running and load testing without cloud services.
+HIVE_STORAGE = "datastore"
+# Database file for "sqlite" storage.
+HIVE_STORAGE_PATH = "hives.sqlite"
+
+# Maximum number of saved, and of deleted, hives in one `/hives/changes` response.
+CHANGES_LIMIT = 1000
+# Seconds of clock difference allowed between instances stamping changes.
+CHANGES_CLOCK_SKEW = 5.0
+# Seconds after which a changes token is too old, and client should reload all markers.
+CHANGES_MAX_AGE = 24 * 60 * 60
+
+# Port for live hive updates as Server-Sent Events, or None to not serve them.
+# Every worker listens on it, see beemap/live.py.
+LIVE_PORT = os.getenv("LIVE_PORT")
+# URL of the event stream for browsers, if not `/hives/live` in LIVE_PORT of the page host,
+# e.g. when proxied to the same origin.
+LIVE_URL = os.getenv("LIVE_URL")
+# Events waiting to be written per client, before a slow client is disconnected.
+LIVE_QUEUE_SIZE = 100
+# Connections accepted per worker.
+LIVE_MAX_CLIENTS = 10000
+# Seconds between comments keeping idle connections open.
+LIVE_HEARTBEAT = 15.0
+# Seconds between polls of changes made by other workers and instances, or None for a single process.
+LIVE_CHANGES_INTERVAL = 2.0
+
+# Default and maximum page size of hive listing, `/update`.
+HIVES_PAGE_SIZE = 100
+HIVES_PAGE_LIMIT = 1000
+# Number of rendered pages kept in memory, per locale and data version or load.
+PAGE_CACHE_ENTRIES = 16
+
+# Telemetry is exported to Application Insights from background threads.
+# Maximum number of log records or spans waiting for upload, per queue.
+TELEMETRY_QUEUE_SIZE = 10000
+# Items per upload, and seconds to wait for a batch to fill up.
+TELEMETRY_BATCH_SIZE = 100
+TELEMETRY_EXPORT_INTERVAL = 5.0
+# When queue is full: "drop-oldest" or "drop-newest".
+TELEMETRY_DROP_POLICY = "drop-oldest"
+
+# Directory shared by worker processes for merging their metrics, or None
+# when running a single process. Should be emptied when the app is restarted.
+# Set by gunicorn.conf.py.
+METRICS_DIR = os.getenv("METRICS_DIR")
+# Seconds between workers writing their metrics into METRICS_DIR.
+METRICS_DUMP_INTERVAL = 5.0
+
+# Trace sampling budget, traces per second per route.
+TRACE_RATE = 1.0
+# Own budgets for routes, by route pattern, e.g. {"/save": 5.0}.
+TRACE_ROUTE_RATES = {}
+# Health checks, static files and metrics share this budget.
+TRACE_EXCLUDED_PATHS = ["/static/", "/_ah/", "/metrics", "/_stats", "/favicon.ico"]
+TRACE_EXCLUDED_RATE = 0.01
+# Trace every request, but export only errors, slow requests and the budgeted ones.
+TRACE_TAIL_SAMPLING = True
+# Requests slower than this many seconds are always exported in tail sampling.
+TRACE_SLOW_THRESHOLD = 1.0
+
+# Directory for compiled template cache. None uses system temp directory.
+TEMPLATE_CACHE_DIR = None
@@ -0,0 +1,44 @@
+"""Gunicorn settings for serving the app in production.
+
+Run with ``gunicorn -c gunicorn.conf.py main:app``. Worker and thread counts
+can be tuned with environment variables:
+
+- ``PORT``: Port to listen, defaults to 8080 as on App Engine.
+- ``GUNICORN_WORKERS``: Worker processes, defaults to CPU count.
+- ``GUNICORN_THREADS``: Threads per worker, defaults to 8. Requests spend
+  most of their time waiting for datastore, so threads are cheap concurrency.
+- ``GUNICORN_TIMEOUT``: Seconds before a silent worker is restarted.
+
+Workers share one hive snapshot through a memory-mapped file, and merge their
+metrics through a directory, both created here unless given in
+``HIVE_SNAPSHOT_FILE`` and ``METRICS_DIR``. Each worker starts its live
+update server once it has loaded the app, when ``LIVE_PORT`` is set.
+
+:see: https://docs.gunicorn.org/en/stable/settings.html
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_class = "gthread"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+# Let load balancer keep connections open between requests.
+keepalive = 5
+
+# Fresh directory per server start, so files of a previous run don't mix in.
+# Set here, before workers import the app and read its config.
+_runtime_dir = tempfile.mkdtemp(prefix="beemap-")
+os.environ.setdefault("HIVE_SNAPSHOT_FILE", os.path.join(_runtime_dir, "hives.snapshot"))
+if not os.getenv("METRICS_DIR"):
+    os.environ["METRICS_DIR"] = os.path.join(_runtime_dir, "metrics")
+    os.makedirs(os.environ["METRICS_DIR"])
+
+
+def post_worker_init(worker):
+    """Start live updates in the worker, see `main.start_live_server()`."""
+    import main
+    main.start_live_server()
@@ -1,21 +1,61 @@
+import atexit
+import hmac
+import json
 import logging
 import os
+import threading
+import time
+from typing import Optional
 
+import click
 from flask import Flask
+from flask import g
+from flask import has_request_context
+from flask import jsonify
 from flask import Markup
 from flask import render_template
 from flask import request
 from flask import Response
-from flask import jsonify
-from flask_babel import Babel, gettext
-from google.cloud import datastore
-from opencensus.ext.azure.log_exporter import AzureLogHandler
-from opencensus.ext.azure.trace_exporter import AzureExporter
-from opencensus.ext.flask.flask_middleware import FlaskMiddleware
-from opencensus.trace import execution_context
-from opencensus.trace.samplers import ProbabilitySampler
-from opencensus.trace.status import Status
+from flask import stream_with_context
+from flask_babel import Babel
+from flask_babel import force_locale
+from flask_babel import get_locale
+from flask_babel import get_translations
+from flask_babel import gettext
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.exceptions import BadRequest
+from werkzeug.exceptions import Forbidden
 from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import NotFound
+
+from beemap import bulkimport
+from beemap import export
+from beemap import geo
+from beemap import heatmap
+from beemap import hives
+from beemap import metrics
+from beemap import nearest
+from beemap import storage
+from beemap import tiles
+from beemap import tracing
+from beemap import wire
+from beemap.clustering import ClusterIndex
+from beemap.live import Hub
+from beemap.live import LiveServer
+from beemap.pagecache import PageCache
+from beemap.resilience import CircuitBreaker
+from beemap.resilience import ResilientRepository
+from beemap.resilience import RetryPolicy
+from beemap.resilience import StorageUnavailable
+from beemap.sampling import RouteBudgetSampler
+from beemap.sampling import TailSamplingExporter
+from beemap.sampling import TokenBuckets
+from beemap.snapshot import HiveSnapshot
+from beemap.snapshot import Patched
+from beemap.telemetry import QueueLogHandler
+from beemap.telemetry import QueueSpanExporter
+from beemap.writebehind import BufferFull
+from beemap.writebehind import WriteBehindBuffer
 
 # Set up the most basic logging.
 logger = logging.getLogger(__name__)
@@ -27,35 +67,261 @@ app.config.from_pyfile("default_config.py")
 # silent param allows missing config files.
 app.config.from_pyfile("instance_config.py", silent=True)
 
-datastore_client = datastore.Client()
+# Shared by all storage calls, state is reported in `/_stats` and `/metrics`.
+storage_breaker = CircuitBreaker(app.config["STORAGE_BREAKER_THRESHOLD"], app.config["STORAGE_BREAKER_RESET"])
+
+# Saves and deletes are published to open maps through this, see `start_live_server()`.
+live_hub = Hub(app.config["LIVE_QUEUE_SIZE"], app.config["LIVE_MAX_CLIENTS"])
+
+_repository_lock = threading.Lock()
+_repository_instance = None
+
+
+def hive_repository() -> storage.HiveRepository:
+    """Return hive storage selected by `HIVE_STORAGE` config, creating it on first use."""
+    global _repository_instance
+    with _repository_lock:
+        if _repository_instance is None:
+            _repository_instance = storage.InstrumentedRepository(
+                ResilientRepository(
+                    storage.create_repository(app.config),
+                    storage_breaker,
+                    RetryPolicy(
+                        attempts=app.config["STORAGE_RETRY_ATTEMPTS"],
+                        base_delay=app.config["STORAGE_RETRY_BASE_DELAY"],
+                        max_delay=app.config["STORAGE_RETRY_MAX_DELAY"],
+                    ),
+                    deadlines=app.config["STORAGE_DEADLINES"],
+                    on_retry=lambda operation, error: storage_retries.inc(operation=operation),
+                ),
+                _observe_storage,
+            )
+        return _repository_instance
+
+
+# Metrics, served in Prometheus format from `/metrics`.
+metrics_registry = metrics.Registry(app.config["METRICS_DIR"], dump_interval=app.config["METRICS_DUMP_INTERVAL"])
+request_latency = metrics_registry.histogram("beemap_request_duration_seconds", "Time to produce response, not including streaming of the body.", ["route", "method", "status"])
+response_bytes = metrics_registry.histogram("beemap_response_bytes", "Response body size, for responses with known length.", ["route"], buckets=metrics.SIZE_BUCKETS)
+request_entities = metrics_registry.histogram("beemap_request_entities", "Hives read from storage per request.", ["route"], buckets=metrics.SIZE_BUCKETS)
+storage_latency = metrics_registry.histogram("beemap_storage_duration_seconds", "Storage call duration.", ["backend", "operation"])
+storage_entities = metrics_registry.counter("beemap_storage_entities_total", "Hives read or written by storage calls.", ["backend", "operation"])
+storage_retries = metrics_registry.counter("beemap_storage_retries_total", "Storage calls retried after transient errors.", ["operation"])
+template_latency = metrics_registry.histogram("beemap_template_render_seconds", "Template render time.", ["template"])
+
+
+def _observe_storage(operation: str, duration: float, count: int):
+    backend = app.config["HIVE_STORAGE"]
+    storage_latency.observe(duration, backend=backend, operation=operation)
+    storage_entities.inc(count, backend=backend, operation=operation)
+    if has_request_context() and operation in ("iterate", "page", "query_bbox"):
+        g.entities_fetched = g.get("entities_fetched", 0) + count
+
+
+def _render_template(template: str, **context) -> str:
+    """Render template, measuring how long it takes."""
+    with template_latency.time(template=template):
+        return render_template(template, **context)
+
+
+# Shared in-memory copy of hives, so map views don't need to query datastore.
+if app.config["HIVE_SNAPSHOT_FILE"]:
+    # Worker processes share one copy through a memory-mapped file. Imported
+    # only here, as it needs `fcntl`, which isn't available on Windows.
+    from beemap.sharedsnapshot import SharedHiveSnapshot
+    hive_snapshot = SharedHiveSnapshot(lambda: hive_repository().iterate(), app.config["HIVE_SNAPSHOT_FILE"], ttl=app.config["HIVE_SNAPSHOT_TTL"], max_changes=app.config["HIVE_SNAPSHOT_MAX_CHANGES"])
+else:
+    hive_snapshot = HiveSnapshot(lambda: hive_repository().iterate(), ttl=app.config["HIVE_SNAPSHOT_TTL"], max_changes=app.config["HIVE_SNAPSHOT_MAX_CHANGES"])
+
+# Hive density pyramid, patched by saves and deletes instead of rebuilt per snapshot version.
+hive_heatmap = Patched(lambda snapshot: heatmap.HeatmapPyramid(snapshot.hives, max_zoom=app.config["HEATMAP_MAX_ZOOM"]))
+
+# KD-tree for nearest hive searches, with saves and deletes kept aside until rebuilt.
+hive_index = Patched(lambda snapshot: nearest.HiveIndex(snapshot.hives, max_changes=app.config["NEAREST_MAX_CHANGES"]))
+
+# Hives bucketed by map tiles with their cluster hierarchy, patched by saves
+# and deletes like the heatmap, and cache of built tiles.
+hive_tiles = Patched(lambda snapshot: tiles.TileIndex(
+    snapshot,
+    ClusterIndex(snapshot, max_zoom=app.config["CLUSTER_MAX_ZOOM"], max_changes=app.config["CLUSTER_MAX_CHANGES"]),
+    point_zoom=app.config["TILE_POINT_ZOOM"],
+))
+tile_cache = tiles.TileCache(max_bytes=app.config["TILE_CACHE_BYTES"])
+
+# Rendered pages by locale and data version.
+page_cache = PageCache(max_entries=app.config["PAGE_CACHE_ENTRIES"])
 
 # Enable localization
-Babel(app)
+babel = Babel(app)
+
+# Compiled templates are cached on disk, so workers and restarts skip compiling.
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config["TEMPLATE_CACHE_DIR"])
 
 
 @app.route('/')
 def home():
+    """Render map page.
+
+    Page is only a shell, markers are loaded by the browser from
+    :func:`hive_markers`. So page doesn't depend on hives, and can be cached
+    by browsers and CDNs per locale.
+    """
+    locale = str(get_locale())
+    page = page_cache.get(("home", locale), lambda: _render_template("mymap.html", live_url=app.config["LIVE_URL"], live_port=app.config["LIVE_PORT"]).encode("utf-8"), "text/html")
+
+    response = page.response(request)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["PAGE_MAX_AGE"]
+    response.vary.add("Accept-Language")
+    return response
+
+
+# Header of marker payloads, with token for fetching later changes from `/hives/changes`.
+CHANGES_TOKEN_HEADER = "X-Hives-Token"
+
+
+def _changes_token(stamp: int) -> int:
+    """Token for changes after `stamp` microseconds, moved back by allowed clock skew.
+
+    Instances stamp changes with their own clocks, so a change stamped just
+    before `stamp` might be stored only after it. Polling from a bit earlier
+    catches those, at the cost of getting the latest changes twice.
+    """
+    return stamp - int(app.config["CHANGES_CLOCK_SKEW"] * 1000000)
+
+
+def _snapshot_token(snapshot) -> int:
+    """Changes token matching the time snapshot was loaded from storage."""
+    loaded = time.time() - (time.monotonic() - snapshot.built_at)
+    return _changes_token(int(loaded * 1000000))
+
+
+@app.route("/hives.ndjson", methods=["GET"])
+def hive_markers():
+    """Stream all hive markers as newline delimited JSON.
+
+    When snapshot is loaded, markers are rendered once per locale and snapshot
+    load, and served precompressed from :class:`PageCache`. Hives saved or
+    deleted after the load come from :func:`hive_changes`, with the token in
+    `X-Hives-Token` header, so saves don't render and compress all markers again.
+
+    Otherwise markers are written as they come from the storage iterator, so
+    the browser can start drawing before all hives are read, while snapshot
+    loads in background. Last line says whether all hives were read, see
+    :func:`_marker_lines`.
+    """
+    if hive_snapshot.peek() is not None:
+        snapshot = hive_snapshot.get()
+        key = ("hives.ndjson", str(get_locale()), snapshot.built_at)
+        page = page_cache.get(key, lambda: "".join(_marker_lines(snapshot, "snapshot")).encode("utf-8"), "application/x-ndjson")
+
+        response = page.response(request)
+        response.cache_control.no_cache = True
+        response.vary.add("Accept-Language")
+        response.headers[CHANGES_TOKEN_HEADER] = str(_snapshot_token(snapshot))
+        return response
+
+    hive_snapshot.refresh_async()
+    response = Response(stream_with_context(_marker_lines(hive_repository().iterate(), "storage")), mimetype="application/x-ndjson")
+    response.headers[CHANGES_TOKEN_HEADER] = str(_changes_token(time.time_ns() // 1000))
+    return response
+
+
+@app.route("/hives.bin", methods=["GET"])
+def hive_markers_binary():
+    """All hive markers in compact binary format, see :mod:`beemap.wire`.
+
+    Payload is rendered once per snapshot load, like :func:`hive_markers`.
+    It has names instead of descriptions, so it is the same for all locales.
+    """
+    return _wire_response("hives.bin", wire.encode_binary, "application/octet-stream")
+
+
+@app.route("/hives.polyline.json", methods=["GET"])
+def hive_markers_polyline():
+    """All hive markers with polyline encoded coordinates, see :mod:`beemap.wire`."""
+    return _wire_response("hives.polyline.json", lambda hives: json.dumps(wire.encode_polyline_json(hives), separators=(",", ":")).encode("utf-8"), "application/json")
+
+
+def _wire_response(name: str, encode, mimetype: str) -> Response:
+    snapshot = hive_snapshot.get()
+    # Keyed by load, not version. Token is of the load, so changes after it,
+    # included in the payload or not, come from the changes feed.
+    page = page_cache.get((name, snapshot.built_at), lambda: encode(snapshot.hives), mimetype)
+
+    response = page.response(request)
+    response.cache_control.no_cache = True
+    response.headers[CHANGES_TOKEN_HEADER] = str(_snapshot_token(snapshot))
+    return response
+
+
+@app.route("/hives/changes", methods=["GET"])
+def hive_changes():
+    """Return hives saved and deleted since a token, so map can be patched in place.
+
+    Query parameters:
+    - `since`: Token from the previous response, or from the `X-Hives-Token`
+      header of marker payloads. Without it, only a token for now is returned.
+
+    Response has `hives` as markers, `deleted` as ids, and `token` for the
+    next call. `more` tells there are more changes to fetch right away, and
+    `reset` that the token is too old, and all markers should be reloaded.
+    The same change can come in more than one response.
+    """
+    now = time.time_ns() // 1000
+    since = request.args.get("since", None)
+    if since is None:
+        return jsonify({"token": str(_changes_token(now)), "hives": [], "deleted": [], "more": False, "reset": False})
+
+    try:
+        since = int(since)
+    except ValueError:
+        raise BadRequest("Invalid changes token")
+
+    if (now - since) / 1000000 > app.config["CHANGES_MAX_AGE"]:
+        return jsonify({"token": str(_changes_token(now)), "hives": [], "deleted": [], "more": False, "reset": True})
+
+    changes = hive_repository().changes(since, app.config["CHANGES_LIMIT"])
+    if changes.truncated:
+        # Continue right after this page, so that large backlogs make progress.
+        token = str(changes.stamp)
+    else:
+        token = str(min(_changes_token(now), max(since, changes.stamp or since)))
+
+    return jsonify({
+        "token": token,
+        "hives": [_hive_marker(hive) for hive in changes.saved],
+        "deleted": changes.deleted,
+        "more": changes.truncated,
+        "reset": False,
+    })
 
-    locations = []
 
+def _marker_lines(locations, source: str):
+    """Generate NDJSON lines of markers.
+
+    Last line is ``{"complete": true, "count": n}``. If reading hives fails
+    after the response has started, it is ``{"error": ..., "count": n}``
+    instead, so clients can tell a partial list from a complete one.
+    """
     # Setup custom tracer
     # Get the Tracer object
-    tracer = execution_context.get_opencensus_tracer()
+    tracer = tracing.tracer()
     # Name should be descriptive
-    with tracer.span(name="datastore.query()") as span:
-
+    with tracer.span(name="hive_markers()") as span:
         kind = "Hive"
-        locations = []
-        for latlng in datastore_client.query(kind=kind).fetch():
-            locations.append({
-                'loc': {
-                    "lat": latlng["LatLng"]['latitude'],
-                    "lon": latlng["LatLng"]['longitude'],
-                },
-                "description": gettext("Authored by %(Firstname)s %(Familyname)s", Firstname=latlng['Firstname'], Familyname=latlng['Familyname'])
-            })
-
-        location_count = len(locations)
+        location_count = 0
+        try:
+            for hive in locations:
+                location_count += 1
+                yield json.dumps(_hive_marker(hive), separators=(",", ":")) + "\n"
+        except Exception:
+            # Status is already sent, so the error goes into the stream.
+            logger.exception("Reading hive markers failed after %d hives.", location_count)
+            span.status = tracing.status(2, "Reading hive locations failed.")
+            yield json.dumps({"error": "Reading beehives failed", "count": location_count}, separators=(",", ":")) + "\n"
+            return
+
         logger.debug("Found %d HiveLocation entries for map." % location_count)
 
         # Add info into our trace
@@ -63,15 +329,243 @@ def home():
         # Status: https://opencensus.io/tracing/span/status/
 
         # For annotation first param is description, additional are freeform attributes
-        span.add_annotation("Query all hive locations from datastore", kind=kind, count=location_count)
+        span.add_annotation("Render all hive locations", kind=kind, source=source, count=location_count)
 
         if location_count > 0:
-            span.status = Status(0, "Found %d hive locations." % location_count)
+            span.status = tracing.status(0, "Found %d hive locations." % location_count)
         else:
             # Not found
-            span.status = Status(5, "Zero locations found.")
+            span.status = tracing.status(5, "Zero locations found.")
+
+        yield json.dumps({"complete": True, "count": location_count}, separators=(",", ":")) + "\n"
+
+
+def _hive_marker(hive: hives.Hive) -> dict:
+    """Convert :class:`Hive` into marker data used by the map."""
+    return {
+        "id": hive.id,
+        'loc': {
+            "lat": hive.latitude,
+            "lon": hive.longitude,
+        },
+        "description": _hive_description(hive)
+    }
+
+
+def _hive_description(hive: hives.Hive) -> str:
+    return gettext("Authored by %(Firstname)s %(Familyname)s", Firstname=hive.firstname, Familyname=hive.familyname)
+
+
+@app.route("/hives", methods=["GET"])
+def hives_in_bbox():
+    """Return hives inside of the map viewport.
+
+    Query parameters:
+    - `bbox`: Viewport as ``minlon,minlat,maxlon,maxlat``.
+    - `zoom`: Optional map zoom level.
+
+    When hive snapshot is loaded, hives are filtered from its coordinate
+    columns. Otherwise storage is queried; backends use a spatial index, so
+    cost depends on the amount of hives in view, not on the amount of all hives.
+    """
+    try:
+        bbox = geo.parse_bbox(request.args.get("bbox", ""))
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+    zoom = request.args.get("zoom", None, type=int)
+    limit = app.config["HIVES_QUERY_LIMIT"]
+
+    tracer = tracing.tracer()
+    snapshot = hive_snapshot.peek()
+    if snapshot is not None:
+        with tracer.span(name="hive_snapshot.within()") as span:
+            snapshot = hive_snapshot.get()
+            # Ask for one extra, to know if there would have been more.
+            found = snapshot.within(bbox, limit + 1)
+            truncated = len(found) > limit
+            locations = [_hive_marker(hive) for hive in found[:limit]]
+            span.add_annotation("Filter hive locations in bbox", bbox=str(bbox), count=len(locations), version=snapshot.version)
+    else:
+        with tracer.span(name="hive_repository.query_bbox()") as span:
+            # Ask for one extra, to know if there would have been more.
+            found = hive_repository().query_bbox(bbox, limit=limit + 1)
+            truncated = len(found) > limit
+            locations = [_hive_marker(hive) for hive in found[:limit]]
+            span.add_annotation("Query hive locations in bbox", bbox=str(bbox), count=len(locations))
+
+    return jsonify({
+        "bbox": list(bbox),
+        "zoom": zoom,
+        "count": len(locations),
+        "truncated": truncated,
+        "hives": locations,
+    })
+
+
+@app.route("/hives/nearest", methods=["GET"])
+def hives_nearest():
+    """Return hives nearest to a point, nearest first.
+
+    Query parameters:
+    - `lat`, `lon`: The point.
+    - `k`: Number of hives, at most `NEAREST_LIMIT`. Defaults to 10.
+
+    Hives have `distance` in meters, along the surface of the earth.
+    """
+    lat, lon = _point_from_request()
+    k = max(1, min(request.args.get("k", 10, type=int), app.config["NEAREST_LIMIT"]))
+
+    with tracing.tracer().span(name="hive_index.nearest()") as span:
+        found = hive_index.get(hive_snapshot.get()).nearest(lat, lon, k)
+        span.add_annotation("Find nearest hives", k=k, count=len(found))
+
+    return _nearby_response(found)
+
+
+@app.route("/hives/within", methods=["GET"])
+def hives_within():
+    """Return hives within a distance of a point, nearest first.
+
+    Query parameters:
+    - `lat`, `lon`: The point.
+    - `radius_m`: Distance in meters, at most `NEAREST_MAX_RADIUS`.
+    - `limit`: Maximum number of hives, at most `NEAREST_LIMIT`.
+
+    Hives have `distance` in meters, along the surface of the earth.
+    """
+    lat, lon = _point_from_request()
+    radius = request.args.get("radius_m", None, type=float)
+    if radius is None or not 0 <= radius <= app.config["NEAREST_MAX_RADIUS"]:
+        raise BadRequest(f"radius_m must be between 0 and {app.config['NEAREST_MAX_RADIUS']}")
+    limit = max(1, min(request.args.get("limit", app.config["NEAREST_LIMIT"], type=int), app.config["NEAREST_LIMIT"]))
+
+    with tracing.tracer().span(name="hive_index.within()") as span:
+        found = hive_index.get(hive_snapshot.get()).within(lat, lon, radius, limit + 1)
+        span.add_annotation("Find hives within radius", radius=radius, count=len(found))
+
+    return _nearby_response(found[:limit], truncated=len(found) > limit)
+
+
+def _point_from_request():
+    """Parse `lat` and `lon` query parameters."""
+    lat = request.args.get("lat", None, type=float)
+    lon = request.args.get("lon", None, type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise BadRequest("lat and lon are required, within -90..90 and -180..180")
+    return lat, lon
+
+
+def _nearby_response(found, **extra) -> Response:
+    """Markers of `(distance, hive)` pairs, with distance rounded to decimeters."""
+    hives = []
+    for distance, hive in found:
+        marker = _hive_marker(hive)
+        marker["distance"] = round(distance, 1)
+        hives.append(marker)
+    return jsonify({"count": len(hives), "hives": hives, **extra})
+
+
+@app.route("/clusters", methods=["GET"])
+def clusters_in_bbox():
+    """Return hive clusters inside of the map viewport.
+
+    Query parameters:
+    - `bbox`: Viewport as ``minlon,minlat,maxlon,maxlat``.
+    - `zoom`: Map zoom level.
+
+    Clusters have count and centroid. Single hive clusters also have the hive `id`.
+    """
+    try:
+        bbox = geo.parse_bbox(request.args.get("bbox", ""))
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+    zoom = request.args.get("zoom", None, type=int)
+    if zoom is None:
+        raise BadRequest("zoom is required")
+
+    tracer = tracing.tracer()
+    with tracer.span(name="clusters.query()") as span:
+        snapshot = hive_snapshot.get()
+        clusters = hive_tiles.get(snapshot).clusters.query(bbox, zoom)
+        span.add_annotation("Query hive clusters", zoom=zoom, count=len(clusters), version=snapshot.version)
+
+    return jsonify({
+        "bbox": list(bbox),
+        "zoom": zoom,
+        "version": snapshot.version,
+        "clusters": [cluster.to_dict() for cluster in clusters],
+    })
+
+
+@app.route("/heatmap", methods=["GET"])
+def heatmap_in_bbox():
+    """Return hive density of the map viewport as grids of counts.
+
+    Query parameters:
+    - `bbox`: Viewport as ``minlon,minlat,maxlon,maxlat``.
+    - `zoom`: Map zoom level.
+
+    Counts come from a pyramid built ahead, see :mod:`beemap.heatmap`, so
+    response time depends on viewport size only, not on number of hives.
+    """
+    try:
+        bbox = geo.parse_bbox(request.args.get("bbox", ""))
+    except ValueError as e:
+        raise BadRequest(str(e))
+
+    zoom = request.args.get("zoom", None, type=int)
+    if zoom is None:
+        raise BadRequest("zoom is required")
+
+    tracer = tracing.tracer()
+    with tracer.span(name="heatmap.query()") as span:
+        snapshot = hive_snapshot.get()
+        grids = hive_heatmap.get(snapshot).query(bbox, zoom, max_bins=app.config["HEATMAP_MAX_BINS"])
+        span.add_annotation("Query hive heatmap", zoom=zoom, grids=len(grids), version=snapshot.version)
+
+    return jsonify({
+        "bbox": list(bbox),
+        "zoom": zoom,
+        "version": snapshot.version,
+        "max": max((max(grid["counts"], default=0) for grid in grids), default=0),
+        "grids": grids,
+    })
+
+
+@app.route("/tiles/<int:z>/<int:x>/<int:y>.<fmt>", methods=["GET"])
+def hive_tile(z: int, x: int, y: int, fmt: str):
+    """Serve hives in slippy map tile as GeoJSON or Mapbox Vector Tile.
+
+    Tiles are built on first request and cached. Responses have strong ETag, so
+    browsers and CDNs can revalidate with `If-None-Match`.
+    """
+    if fmt not in tiles.FORMATS or not tiles.valid_tile(z, x, y):
+        raise NotFound(f"No such tile {z}/{x}/{y}.{fmt}")
+
+    index = hive_tiles.get(hive_snapshot.get())
+    # Tiles are patched by saves and deletes, and dropped when index is rebuilt.
+    tile_cache.sync(index)
+
+    key = (z, x, y, fmt, str(get_locale()))
+    tile = tile_cache.get(key)
+    if tile is None:
+        generation = tile_cache.generation
+        features = index.features(z, x, y)
+        if fmt == "mvt":
+            body = tiles.encode_mvt(features, z, x, y, _hive_description)
+        else:
+            body = tiles.encode_geojson(features, _hive_description)
+        tile = tiles.Tile(body)
+        tile_cache.put(key, tile, generation)
 
-    return render_template("mymap.html", hive_locations=locations)
+    response = Response(tile.body, mimetype=tiles.FORMATS[fmt])
+    response.set_etag(tile.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config["TILE_MAX_AGE"]
+    response.vary.add("Accept-Language")
+    return response.make_conditional(request)
 
 
 @app.route("/save", methods=["POST"])
@@ -79,32 +573,419 @@ def save_to_db():
 
     data = request.get_json()
     print("saved", data, "!")
-    kind = "Hive"
-    #name = data['firstname']
-    task_key = datastore_client.key(kind)
-    task = datastore.Entity(key=task_key)
-    task["LatLng"] = {
-                        "latitude": data["latitude"],
-                         "longitude": data["longitude"]}
-    task["Firstname"] = data['firstname']
-    task["Familyname"] = data['familyname']
-    task["email"] = data['email']
-
-    datastore_client.put(task)
+    hive = _hive_from_request(data)
+
+    mode = app.config["HIVE_WRITE_MODE"]
+    if mode == "sync":
+        _hives_saved([hive_repository().save(hive)])
+        return jsonify({"status": "OK"})
+
+    try:
+        future = _write_buffer().submit(hive)
+    except BufferFull:
+        return jsonify({"status": "BUSY"}), 503
+
+    if mode == "enqueue":
+        # Not yet stored, lost if the instance dies before flush.
+        return jsonify({"status": "ACCEPTED"}), 202
+
+    # Acknowledge after flush. Raises if the batch failed.
+    deadline = app.config["STORAGE_DEADLINES"].get("save_many", app.config["DATASTORE_TIMEOUT"])
+    future.result(timeout=deadline + app.config["WRITE_BEHIND_MAX_DELAY"])
     return jsonify({"status": "OK"})
 
 
+@app.route("/save/batch", methods=["POST"])
+def save_batch_to_db():
+    """Save many hives in one request.
+
+    Body is a JSON list of hives, each in the same format as for `/save`.
+    Hives are stored with single storage call, ``put_multi()`` for datastore.
+    """
+    data = request.get_json()
+    if isinstance(data, dict):
+        data = data.get("hives")
+    if not isinstance(data, list):
+        raise BadRequest("Expected a list of hives")
+    if len(data) > app.config["SAVE_BATCH_LIMIT"]:
+        raise BadRequest(f"Too many hives, at most {app.config['SAVE_BATCH_LIMIT']} allowed")
+
+    batch = [_hive_from_request(item) for item in data]
+    _put_hives(batch)
+
+    return jsonify({"status": "OK", "count": len(batch)})
+
+
+@app.errorhandler(StorageUnavailable)
+def storage_unavailable(e: StorageUnavailable):
+    """Tell clients to come back later, instead of a generic error page."""
+    logger.warning("Storage unavailable: %s", e)
+    response = jsonify({"status": "UNAVAILABLE"})
+    response.status_code = 503
+    if e.retry_after is not None:
+        response.retry_after = max(1, int(e.retry_after + 0.5))
+    return response
+
+
+def _hive_from_request(data) -> hives.Hive:
+    """Build new :class:`Hive` from submitted form data."""
+    if not isinstance(data, dict):
+        raise BadRequest("Expected hive as JSON object")
+
+    try:
+        return hives.Hive(
+            id=None,
+            latitude=float(data["latitude"]),
+            longitude=float(data["longitude"]),
+            firstname=data['firstname'],
+            familyname=data['familyname'],
+            email=data['email'],
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise BadRequest(f"Invalid hive: {e!s}")
+
+
+def _put_hives(batch: list):
+    """Store hives with single storage call and patch caches."""
+    _hives_saved(hive_repository().save_many(batch))
+
+
+_write_buffer_lock = threading.Lock()
+_write_buffer_instance = None
+
+
+def _write_buffer() -> WriteBehindBuffer:
+    """Return write-behind buffer for `/save`, creating it on first use."""
+    global _write_buffer_instance
+    with _write_buffer_lock:
+        if _write_buffer_instance is None:
+            _write_buffer_instance = WriteBehindBuffer(
+                _put_hives,
+                max_size=app.config["WRITE_BEHIND_MAX_SIZE"],
+                max_delay=app.config["WRITE_BEHIND_MAX_DELAY"],
+                max_pending=app.config["WRITE_BEHIND_MAX_PENDING"],
+            )
+            # Flush what's left on normal shutdown.
+            atexit.register(_write_buffer_instance.close)
+        return _write_buffer_instance
+
+
+def _hives_saved(saved: list):
+    """Patch caches with newly saved hives, and tell open maps."""
+    hive_snapshot.add(saved)
+    hive_heatmap.add(saved)
+    hive_index.add(saved)
+    hive_tiles.add(saved)
+    for hive in saved:
+        tile_cache.invalidate_point(hive.latitude, hive.longitude)
+    live_hub.saved(saved)
+
+
+def _hives_deleted(ids: list):
+    """Patch deleted hives out of caches, and tell open maps.
+
+    Storage returns ids only, so coordinates for finding the affected tiles,
+    heatmap bins and index entries are taken from the snapshot.
+    """
+    snapshot = hive_snapshot.peek()
+    deleted = snapshot.find(ids) if snapshot else []
+    hive_snapshot.remove(ids)
+    hive_heatmap.remove(deleted)
+    hive_index.remove(deleted)
+    hive_tiles.remove(deleted)
+    for hive in deleted:
+        tile_cache.invalidate_point(hive.latitude, hive.longitude)
+    live_hub.deleted(ids)
+
+
+def _delete_ids(data) -> list:
+    """Validate list of hive ids to delete."""
+    ids = data.get("ids")
+    if not isinstance(ids, list) or not all(isinstance(id, (int, str)) and not isinstance(id, bool) for id in ids):
+        raise BadRequest("Expected ids as a list of hive ids")
+    if len(ids) > app.config["DELETE_LIMIT"]:
+        raise BadRequest(f"Too many ids, at most {app.config['DELETE_LIMIT']} allowed")
+    return list(dict.fromkeys(ids))
+
+
+def _is_admin() -> bool:
+    """Check `Authorization: Bearer` header against `ADMIN_TOKEN`. Without one configured, nobody is admin."""
+    token = app.config["ADMIN_TOKEN"]
+    given = request.headers.get("Authorization", "")
+    return bool(token) and hmac.compare_digest(given.encode("utf-8"), f"Bearer {token}".encode("utf-8"))
+
+
+def _is_owner(hive_id, email) -> bool:
+    """Whether `email` is the one saved with the hive. Hives saved without one have no owner."""
+    if not isinstance(email, str) or not email.strip():
+        return False
+    found = hive_repository().get_many([hive_id])
+    if not found or not found[0].email:
+        return False
+    return hmac.compare_digest(found[0].email.strip().casefold().encode("utf-8"), email.strip().casefold().encode("utf-8"))
+
+
 @app.route("/delete", methods=["DELETE"])
 def delete_from_db():
-    pass
+    """Delete hives by id, or all hives inside of a bounding box.
+
+    Body is a JSON object with either `ids`, a list of hive ids, or `bbox` as
+    ``west,south,east,north``. Hives of a bbox are found with a keys-only
+    query, and deleted in batches, ``delete_multi()`` for datastore, without
+    reading them. At most `DELETE_LIMIT` hives are deleted per request, and
+    `more` in the response tells to repeat it for the rest of a bbox.
+
+    A single hive can be deleted by its owner, with the `email` it was saved
+    with in the body. Other deletes need ``Authorization: Bearer`` header
+    with `ADMIN_TOKEN`.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or ("ids" in data) == ("bbox" in data):
+        raise BadRequest("Expected JSON object with either ids or bbox")
+
+    limit = app.config["DELETE_LIMIT"]
+    more = False
+    if "bbox" in data:
+        if not _is_admin():
+            raise Forbidden("Deleting hives by bbox needs an admin token")
+        try:
+            bbox = geo.parse_bbox(str(data["bbox"]))
+        except ValueError as e:
+            raise BadRequest(str(e))
+        ids = hive_repository().query_bbox_ids(bbox, limit=limit + 1)
+        more = len(ids) > limit
+        ids = ids[:limit]
+    else:
+        ids = _delete_ids(data)
+        if not _is_admin():
+            if len(ids) > 1:
+                raise Forbidden("Deleting many hives needs an admin token")
+            if ids and not _is_owner(ids[0], data.get("email")):
+                raise Forbidden("Only the owner of a hive can delete it")
+
+    if ids:
+        hive_repository().delete(ids)
+        _hives_deleted(ids)
+    logger.info("Deleted %d hives.", len(ids))
+    return jsonify({"status": "OK", "count": len(ids), "deleted": ids, "more": more})
 
 
 @app.route("/update", methods=["GET"])
 def load_db():
-    query = datastore_client.query(kind="HiveLocation")
-    query.order = ["location"]
-    data = list(query.fetch())
-    print(data)
+    """List hives one page at a time.
+
+    Query parameters:
+    - `cursor`: Cursor of the page, from `next` of the previous page.
+    - `limit`: Page size, capped at `HIVES_PAGE_LIMIT`.
+    """
+    limit = request.args.get("limit", app.config["HIVES_PAGE_SIZE"], type=int)
+    limit = max(1, min(limit, app.config["HIVES_PAGE_LIMIT"]))
+
+    try:
+        page, cursor = hive_repository().page(request.args.get("cursor") or None, limit)
+    except ValueError:
+        raise BadRequest("Invalid cursor")
+
+    return jsonify({
+        "hives": [_hive_marker(hive) for hive in page],
+        "next": cursor,
+    })
+
+
+@app.route("/export.<fmt>", methods=["GET"])
+def export_hives(fmt: str):
+    """Export all hives as NDJSON or GeoJSON.
+
+    Pages are walked with cursors in background and written as they come, so
+    memory use doesn't grow with the amount of hives.
+    """
+    encoders = {
+        "ndjson": (export.ndjson, "application/x-ndjson"),
+        "geojson": (export.geojson, "application/geo+json"),
+    }
+    if fmt not in encoders:
+        raise NotFound(f"Unknown export format {fmt!r}")
+
+    encode, mimetype = encoders[fmt]
+    pages = export.prefetch(export.walk_pages(hive_repository(), app.config["HIVES_PAGE_LIMIT"]))
+    response = Response(encode(pages), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=hives.{fmt}"
+    return response
+
+
+@app.route("/_ah/warmup", methods=["GET"])
+def warmup():
+    """Prepare new instance before it gets traffic.
+
+    App Engine calls this when `warmup` is enabled in `inbound_services` of
+    app.yaml. Failures are logged, not raised, so instance starts anyway.
+
+    :see: https://cloud.google.com/appengine/docs/standard/python3/configuring-warmup-requests
+    """
+    started = time.perf_counter()
+    warm_up()
+    logger.info("Warmed up in %.3f seconds.", time.perf_counter() - started)
+    return "", 200
+
+
+def warm_up():
+    """Create storage client, compile templates, load translations and hive snapshot.
+
+    Called within a request, as translations are loaded for the current request context.
+    """
+    try:
+        hive_repository().warmup()
+    except Exception:
+        logger.exception("Failed to create storage client during warmup")
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    locales = {str(locale) for locale in babel.list_translations()}
+    locales.add(app.config["BABEL_DEFAULT_LOCALE"])
+    for locale in locales:
+        with force_locale(locale):
+            get_translations()
+
+    try:
+        hive_snapshot.get()
+    except Exception:
+        logger.exception("Failed to load hive snapshot during warmup")
+
+
+@app.route("/_stats", methods=["GET"])
+def stats():
+    """Report cache counters, to see whether caching works."""
+    return jsonify(_stats())
+
+
+def _stats() -> dict:
+    return {
+        "hive_snapshot": hive_snapshot.stats(),
+        "storage_breaker": storage_breaker.stats(),
+        "live": live_hub.stats(),
+        "tile_cache": tile_cache.stats(),
+        "heatmap": hive_heatmap.stats(),
+        "hive_index": hive_index.stats(),
+        "hive_tiles": hive_tiles.stats(),
+        "page_cache": page_cache.stats(),
+        "write_buffer": _write_buffer_instance.stats() if _write_buffer_instance else None,
+        "telemetry": {name: queue.stats() for name, queue in telemetry_queues.items()},
+        "trace_sampling": {name: sampler.stats() for name, sampler in trace_samplers.items()},
+    }
+
+
+def _stats_samples():
+    """Numeric values of :func:`_stats` as gauges, for `/metrics`."""
+    for section, values in _stats().items():
+        if not values:
+            continue
+        if section in ("telemetry", "trace_sampling"):
+            for name, name_stats in values.items():
+                for key, value in name_stats.items():
+                    if isinstance(value, (int, float)):
+                        yield f"beemap_{section}_{key}", f"{section} {key}.", {"name": name}, value
+            continue
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                yield f"beemap_{section}_{key}", f"{section} {key}.", {}, value
+
+
+metrics_registry.add_collector(_stats_samples)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Serve metrics in Prometheus text format."""
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.before_request
+def _start_request_metrics():
+    # Threads don't survive forking, so start metrics dumper on first request of each worker.
+    metrics_registry.start()
+    g.request_started = time.perf_counter()
+    g.entities_fetched = 0
+
+
+@app.after_request
+def _record_request_metrics(response: Response) -> Response:
+    started = g.get("request_started")
+    if started is None:
+        return response
+
+    # Use route pattern instead of path, so metrics don't explode with unique urls.
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    request_latency.observe(time.perf_counter() - started, route=route, method=request.method, status=response.status_code)
+    if response.content_length is not None:
+        response_bytes.observe(response.content_length, route=route)
+    request_entities.observe(g.get("entities_fetched", 0), route=route)
+    return response
+
+
+@app.cli.command("backfill-geohash")
+def backfill_geohash():
+    """Add spatial index data, like `Geohash` property, into existing hives.
+
+    Run with ``flask backfill-geohash``. Safe to run multiple times.
+    """
+    updated = hive_repository().reindex()
+    logger.info("Backfilled geohash for %d hives.", updated)
+    print(f"Backfilled geohash for {updated} hives.")
+
+
+@app.cli.command("import-hives")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(bulkimport.FORMATS), help="File format, guessed from extension by default.")
+@click.option("--chunk-size", type=click.IntRange(1, 500), default=lambda: app.config["IMPORT_CHUNK_SIZE"], help="Hives per storage write.")
+@click.option("--workers", type=click.IntRange(1), default=lambda: app.config["IMPORT_WORKERS"], help="Storage writes at once.")
+@click.option("--checkpoint", help="Progress file, PATH.checkpoint by default.")
+@click.option("--restart", is_flag=True, help="Ignore progress of an earlier run.")
+@click.option("--skip-existing/--no-skip-existing", default=True, help="Skip hives already in storage.")
+def import_hives(path: str, fmt: Optional[str], chunk_size: int, workers: int, checkpoint: Optional[str], restart: bool, skip_existing: bool):
+    """Import hives from a CSV, GeoJSON or NDJSON file.
+
+    Run with ``flask import-hives hives.csv``. Rows need `latitude`,
+    `longitude` and `firstname`, and may have `familyname` and `email`.
+    Interrupted import continues where it was left when run again.
+    """
+    try:
+        fmt = fmt or bulkimport.guess_format(path)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+
+    progress = bulkimport.Checkpoint(checkpoint or path + ".checkpoint", bulkimport.source_of(path))
+    if restart:
+        progress.remove()
+    else:
+        try:
+            progress = bulkimport.Checkpoint.load(progress.path, progress.source)
+        except ValueError as e:
+            raise click.ClickException(f"{e}. Use --restart to start over.")
+
+    repository = hive_repository()
+    existing = (bulkimport.dedupe_key(hive) for hive in repository.iterate()) if skip_existing else ()
+    importer = bulkimport.BulkImporter(
+        repository,
+        chunk_size=chunk_size,
+        workers=workers,
+        checkpoint=progress,
+        existing=existing,
+        on_invalid=lambda row, error: click.echo(f"Row {row}: {error}", err=True),
+        on_progress=lambda stats: click.echo(f"\r{stats.read} rows, {stats.rate:.0f} rows/s", err=True, nl=False),
+    )
+
+    with bulkimport.open_source(path, fmt) as stream:
+        try:
+            stats = importer.run(bulkimport.read_rows(stream, fmt))
+        except Exception as e:
+            click.echo(err=True)
+            raise click.ClickException(f"Import stopped: {e}. Run again to continue.")
+    progress.remove()
+
+    click.echo(err=True)
+    logger.info("Imported hives from %s: %s", path, stats.summary())
+    click.echo(stats.summary())
 
 
 @app.route("/_divide_by_zero/<int:number>")
@@ -120,6 +1001,11 @@ def division_by_zero(number: int):
     return f"{number} divided by zeor is {result}"
 
 
+# Telemetry export queues and samplers by name, for stats.
+telemetry_queues = {}
+trace_samplers = {}
+
+
 def _setup_azure_logging(logger: logging.Logger, app: Flask, connection_string: str):
     """Setup logging into Azure Application Insights.
 
@@ -129,20 +1015,54 @@ def _setup_azure_logging(logger: logging.Logger, app: Flask, connection_string:
     :param app: Flask app instance to assing azure opencensus handler.
     :param connection_string: Azure Application Insight connection string.
     """
+    # Imported here, as opencensus and azure take a good part of startup time.
+    from opencensus.ext.azure.log_exporter import AzureLogHandler
+    from opencensus.ext.azure.trace_exporter import AzureExporter
+    from opencensus.ext.flask.flask_middleware import FlaskMiddleware
+
+    # Uploads go through bounded queues and background threads, so slow
+    # Application Insights doesn't slow down requests.
+    queue_options = {
+        "max_queue": app.config["TELEMETRY_QUEUE_SIZE"],
+        "batch_size": app.config["TELEMETRY_BATCH_SIZE"],
+        "interval": app.config["TELEMETRY_EXPORT_INTERVAL"],
+        "policy": app.config["TELEMETRY_DROP_POLICY"],
+    }
 
     # Setup trace handler. Handles normal logging output:
     # >>> logger.info("Info message")
-    azure_handler = AzureLogHandler(
+    azure_handler = QueueLogHandler(AzureLogHandler(
         connection_string=connection_string
-    )
+    ), **queue_options)
     logger.addHandler(azure_handler)
+    telemetry_queues["logs"] = azure_handler.queue
 
     # Setup flask middleware, so pageview metrics are stored in azure.
+    exporter = QueueSpanExporter(AzureExporter(connection_string=connection_string), **queue_options)
+    telemetry_queues["traces"] = exporter.queue
+
+    # Trace only as many requests per route as budgeted. In tail mode,
+    # errors and slow requests are kept regardless of the budget.
+    budgets = TokenBuckets(app.config["TRACE_RATE"], app.config["TRACE_ROUTE_RATES"])
+    sampler = RouteBudgetSampler(
+        budgets,
+        excluded=app.config["TRACE_EXCLUDED_PATHS"],
+        excluded_rate=app.config["TRACE_EXCLUDED_RATE"],
+        tail=app.config["TRACE_TAIL_SAMPLING"],
+    )
+    if app.config["TRACE_TAIL_SAMPLING"]:
+        exporter = TailSamplingExporter(exporter, budgets, slow_threshold=app.config["TRACE_SLOW_THRESHOLD"])
+        trace_samplers["tail"] = exporter
+
     FlaskMiddleware(
         app,
-        exporter=AzureExporter(connection_string=connection_string),
-        sampler=ProbabilitySampler(rate=1.0),
+        exporter=exporter,
+        sampler=sampler,
     )
+    tracing.enable()
+
+    atexit.register(azure_handler.queue.close)
+    atexit.register(telemetry_queues["traces"].close)
 
 
 def capture_exceptions(app: Flask):
@@ -197,6 +1117,35 @@ else:
 # Register own error handler
 capture_exceptions(app)
 
+# Live updates for open maps, served from a background event loop.
+live_server = None
+
+
+def start_live_server() -> Optional[LiveServer]:
+    """Start live update server in this process, if `LIVE_PORT` is set.
+
+    Called by gunicorn workers, see `gunicorn.conf.py`, and when run as a
+    script. Not on import, so CLI commands and benchmarks importing the app
+    don't bind the port or poll storage for changes.
+    """
+    global live_server
+    if not app.config["LIVE_PORT"] or live_server is not None:
+        return live_server
+
+    server = LiveServer(live_hub, port=int(app.config["LIVE_PORT"]), heartbeat=app.config["LIVE_HEARTBEAT"])
+    if app.config["LIVE_CHANGES_INTERVAL"]:
+        server.follow_changes(
+            lambda since: hive_repository().changes(since, app.config["CHANGES_LIMIT"]),
+            since=time.time_ns() // 1000,
+            interval=app.config["LIVE_CHANGES_INTERVAL"],
+            overlap=int(app.config["CHANGES_CLOCK_SKEW"] * 1000000),
+        )
+    server.start()
+    atexit.register(server.stop)
+    live_server = server
+    return server
+
+
 if __name__ == '__main__':
 
     host = os.getenv("HOST", "127.0.0.1")
@@ -206,6 +1155,7 @@ if __name__ == '__main__':
         logger.setLevel(logging.DEBUG)
 
     logger.info(f"Starting {__name__} loop at {host}:{port}")
+    start_live_server()
 
     app.run(host=host, port=port) or \
         logger.info(f"Abrupt Flask app stoppage")
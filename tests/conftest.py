@@ -8,6 +8,8 @@ sys.path.append(os.path.dirname(__file__) + "/..")
 # Prepare flask for testing
 from main import app as _app # noqa
 _app.config['TESTING'] = True
+# Don't need cloud credentials for tests.
+_app.config['HIVE_STORAGE'] = "memory"
 
 @pytest.fixture
 def app():
@@ -1,6 +1,9 @@
-import pytest
-from flask_babel import force_locale
+import json
+import threading
+
 from flask_babel import _
+from flask_babel import force_locale
+import pytest
 
 
 def test_finnish_translations(app):
@@ -21,3 +24,303 @@ def test_fetch_mainpage(app):
         page = client.get('/')
         assert page, "Did not get anything"
         assert b"<title>" in page.data, "Page didn't have TITLE"
+
+
+def _hive_data(lat, lon):
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "firstname": "Maija",
+        "familyname": "Mehiläinen",
+        "email": "maija@example.com",
+    }
+
+
+def _reload_snapshot():
+    """Load hive snapshot from storage again, as happens once its ttl has passed."""
+    import main
+
+    main.hive_snapshot.refresh_async()
+    _wait_snapshot_refresh()
+
+
+def _wait_snapshot_refresh():
+    for thread in threading.enumerate():
+        if thread.name == "hive-snapshot-refresh":
+            thread.join(5)
+
+
+def test_save_and_query_bbox(app):
+    """ Saved hive should be found from its viewport, and only from there """
+
+    with app.test_client() as client:
+        assert client.post('/save', json=_hive_data(-33.86, 151.21)).status_code == 200
+
+        found = client.get('/hives?bbox=151,-34,152,-33&zoom=10').get_json()
+        assert [h["loc"] for h in found["hives"]] == [{"lat": -33.86, "lon": 151.21}]
+
+        elsewhere = client.get('/hives?bbox=150,-34,151,-33').get_json()
+        assert elsewhere["hives"] == []
+
+        assert client.get('/hives?bbox=nonsense').status_code == 400
+
+
+def test_save_batch(app):
+    with app.test_client() as client:
+        batch = [_hive_data(-41.0 - i / 100, 174.0) for i in range(10)]
+        response = client.post('/save/batch', json=batch)
+        assert response.get_json() == {"status": "OK", "count": 10}
+
+        found = client.get('/hives?bbox=173,-42,175,-40').get_json()
+        assert found["count"] == 10
+
+        assert client.post('/save/batch', json=[{"latitude": 1}]).status_code == 400
+
+
+def test_markers_are_streamed(app):
+    """ Page shouldn't have markers, they are loaded as NDJSON """
+
+    with app.test_client() as client:
+        client.post('/save', json=_hive_data(64.0, 27.0))
+
+        page = client.get('/')
+        assert b"Mehil" not in page.data
+        assert "public" in page.headers["Cache-Control"]
+
+        markers = client.get('/hives.ndjson')
+        assert markers.mimetype == "application/x-ndjson"
+        lines = [json.loads(line) for line in markers.data.splitlines()]
+        assert {"lat": 64.0, "lon": 27.0} in [line["loc"] for line in lines[:-1]]
+        assert lines[-1] == {"complete": True, "count": len(lines) - 1}
+
+
+def test_streamed_markers_end_with_error_when_storage_fails(app, monkeypatch):
+    """ Failure after the response started is told in the last line """
+    import main
+
+    class BrokenRepository:
+        def iterate(self):
+            yield main.hives.Hive(1, 64.0, 27.0, "Maija", "Mehiläinen")
+            raise TimeoutError("Datastore timed out")
+
+    monkeypatch.setattr(main, "hive_repository", lambda: BrokenRepository())
+    main.hive_snapshot.reset()
+    try:
+        with app.test_client() as client:
+            lines = [json.loads(line) for line in client.get('/hives.ndjson').data.splitlines()]
+    finally:
+        _wait_snapshot_refresh()
+        main.hive_snapshot.reset()
+
+    assert len(lines) == 2
+    assert lines[-1] == {"error": "Reading beehives failed", "count": 1}
+
+
+def test_hive_tile_conditional_get(app):
+    with app.test_client() as client:
+        client.post('/save', json=_hive_data(65.0, 25.5))
+        tile = client.get('/tiles/0/0/0.geojson')
+        assert tile.status_code == 200
+        assert tile.headers["ETag"]
+
+        again = client.get('/tiles/0/0/0.geojson', headers={"If-None-Match": tile.headers["ETag"]})
+        assert again.status_code == 304
+
+        assert client.get('/tiles/1/2/0.geojson').status_code == 404
+
+
+def test_paginated_listing_and_export(app):
+    with app.test_client() as client:
+        client.post('/save/batch', json=[_hive_data(-45.0, 170.0 + i / 100) for i in range(5)])
+
+        ids = []
+        cursor = ""
+        while True:
+            page = client.get(f'/update?limit=2&cursor={cursor}').get_json()
+            assert len(page["hives"]) <= 2
+            ids.extend(hive["id"] for hive in page["hives"])
+            cursor = page["next"]
+            if not cursor:
+                break
+        assert len(ids) == len(set(ids)) >= 5
+        assert client.get('/update?cursor=garbage').status_code == 400
+
+        exported = client.get('/export.ndjson')
+        assert len(exported.data.splitlines()) == len(ids)
+        assert client.get('/export.geojson').get_json()["type"] == "FeatureCollection"
+        assert client.get('/export.xml').status_code == 404
+
+
+def test_markers_are_cached_until_reload(app):
+    """ Saves come from the changes feed, markers are rendered again on reload """
+    with app.test_client() as client:
+        client.post('/save', json=_hive_data(66.5, 25.7))
+        client.get('/hives.ndjson')
+        _reload_snapshot()
+
+        first = client.get('/hives.ndjson')
+        assert client.get('/hives.ndjson', headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+        client.post('/save', json=_hive_data(66.6, 25.8))
+        assert client.get('/hives.ndjson', headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+        changes = client.get(f'/hives/changes?since={first.headers["X-Hives-Token"]}').get_json()
+        assert {"lat": 66.6, "lon": 25.8} in [hive["loc"] for hive in changes["hives"]]
+
+        _reload_snapshot()
+        changed = client.get('/hives.ndjson', headers={"If-None-Match": first.headers["ETag"]})
+        assert changed.status_code == 200
+        assert b"66.6" in changed.data
+
+
+def test_metrics_endpoint(app):
+    with app.test_client() as client:
+        client.get('/')
+        text = client.get('/metrics').data.decode("utf-8")
+        assert 'beemap_request_duration_seconds_count{route="/",method="GET",status="200"}' in text
+        assert "# TYPE beemap_template_render_seconds histogram" in text
+
+
+def test_warmup(app):
+    """ Warmup loads hive snapshot, so first request doesn't have to """
+    import main
+
+    with app.test_client() as client:
+        assert client.get('/_ah/warmup').status_code == 200
+        assert main.hive_snapshot.peek() is not None
+
+
+def test_live_server_is_not_started_on_import(app, monkeypatch):
+    """ CLI commands and benchmarks import the app, only workers serve live updates """
+    import main
+
+    assert main.live_server is None
+    monkeypatch.setitem(app.config, "LIVE_PORT", None)
+    assert main.start_live_server() is None
+
+
+def test_compact_markers(app):
+    """ Binary markers carry the same hives in a fraction of the bytes """
+    from beemap import wire
+
+    with app.test_client() as client:
+        for i in range(50):
+            client.post('/save', json=_hive_data(60 + i / 100, 25 + i / 100))
+        _reload_snapshot()
+
+        markers = client.get('/hives.ndjson').get_data()
+        response = client.get('/hives.bin')
+        assert response.status_code == 200
+        assert len(response.data) * 5 < len(markers)
+
+        hives = wire.decode_binary(response.data)
+        # Markers end with a line telling they are complete.
+        assert len(hives) == markers.count(b"\n") - 1
+
+        assert client.get('/hives.bin', headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+        assert client.get('/hives.polyline.json').get_json()["count"] == len(hives)
+
+
+def test_storage_breaker(app):
+    """ Open breaker fails storage calls fast with 503, and shows in metrics """
+    import main
+
+    for _ in range(app.config["STORAGE_BREAKER_THRESHOLD"]):
+        main.storage_breaker.failure()
+    try:
+        with app.test_client() as client:
+            response = client.get('/update')
+            assert response.status_code == 503
+            assert response.get_json() == {"status": "UNAVAILABLE"}
+            assert int(response.headers["Retry-After"]) > 0
+
+            assert b'beemap_storage_breaker_state_value 2' in client.get('/metrics').data
+    finally:
+        main.storage_breaker.success()
+
+
+def test_hive_changes(app):
+    """ Map is patched with changes since the token of its markers """
+    with app.test_client() as client:
+        client.post('/save', json=_hive_data(61.0, 24.0))
+        token = client.get('/hives.bin').headers["X-Hives-Token"]
+
+        client.post('/save', json=_hive_data(61.5, 24.5))
+        changes = client.get(f'/hives/changes?since={token}').get_json()
+        assert {"lat": 61.5, "lon": 24.5} in [hive["loc"] for hive in changes["hives"]]
+        assert not changes["more"] and not changes["reset"]
+        assert int(changes["token"]) >= int(token)
+
+        assert client.get('/hives/changes').get_json()["token"]
+        assert client.get('/hives/changes?since=0').get_json()["reset"]
+        assert client.get('/hives/changes?since=yesterday').status_code == 400
+
+
+def test_heatmap(app):
+    def density():
+        grids = client.get('/heatmap?bbox=-10,-10,10,10&zoom=6').get_json()["grids"]
+        return sum(sum(grid["counts"]) for grid in grids)
+
+    with app.test_client() as client:
+        before = density()
+        client.post('/save/batch', json=[_hive_data(1.0 + i / 100, 1.0) for i in range(20)])
+        assert density() == before + 20
+
+        client.post('/save', json=_hive_data(-1.0, -1.0))
+        assert density() == before + 21
+
+        assert client.get('/heatmap?bbox=-10,-10,10,10').status_code == 400
+
+
+def test_nearest_hives(app):
+    with app.test_client() as client:
+        client.post('/save/batch', json=[_hive_data(-60.0, -60.0 + i / 100) for i in range(5)])
+
+        found = client.get('/hives/nearest?lat=-60&lon=-60&k=2').get_json()
+        assert [hive["loc"] for hive in found["hives"]] == [{"lat": -60.0, "lon": -60.0}, {"lat": -60.0, "lon": -59.99}]
+        assert found["hives"][0]["distance"] == 0
+        assert 500 < found["hives"][1]["distance"] < 600
+
+        client.post('/save', json=_hive_data(-60.0, -60.005))
+        within = client.get('/hives/within?lat=-60&lon=-60&radius_m=1000').get_json()
+        assert within["count"] == 3 and not within["truncated"]
+
+        assert client.get('/hives/within?lat=-60&lon=-60').status_code == 400
+        assert client.get('/hives/nearest?lat=100&lon=0').status_code == 400
+
+
+def test_delete_hives(app, monkeypatch):
+    def within():
+        return client.get('/hives/within?lat=-30&lon=-30&radius_m=5000').get_json()["hives"]
+
+    def density():
+        grids = client.get('/heatmap?bbox=-31,-31,-29,-29&zoom=8').get_json()["grids"]
+        return sum(sum(grid["counts"]) for grid in grids)
+
+    with app.test_client() as client:
+        client.post('/save/batch', json=[_hive_data(-30.0, -30.0 + i / 1000) for i in range(5)])
+        first = within()[0]["id"]
+        token = client.get('/hives.bin').headers["X-Hives-Token"]
+
+        # Single hive is deleted by its owner.
+        assert client.delete('/delete', json={"ids": [first]}).status_code == 403
+        assert client.delete('/delete', json={"ids": [first], "email": "someone@example.com"}).status_code == 403
+        response = client.delete('/delete', json={"ids": [first], "email": "Maija@example.com "})
+        assert response.get_json() == {"status": "OK", "count": 1, "deleted": [first], "more": False}
+        assert first not in [hive["id"] for hive in within()]
+        assert density() == 4
+        assert first in client.get(f'/hives/changes?since={token}').get_json()["deleted"]
+
+        # Bulk deletes are for admins only.
+        assert client.delete('/delete', json={"bbox": "-31,-31,-29,-29"}).status_code == 403
+        monkeypatch.setitem(app.config, "ADMIN_TOKEN", "secret")
+        assert client.delete('/delete', json={"bbox": "-31,-31,-29,-29"}, headers={"Authorization": "Bearer wrong"}).status_code == 403
+
+        monkeypatch.setitem(app.config, "DELETE_LIMIT", 3)
+        deleted = client.delete('/delete', json={"bbox": "-31,-31,-29,-29"}, headers={"Authorization": "Bearer secret"}).get_json()
+        assert (deleted["count"], deleted["more"]) == (3, True)
+        deleted = client.delete('/delete', json={"bbox": "-31,-31,-29,-29"}, headers={"Authorization": "Bearer secret"}).get_json()
+        assert (deleted["count"], deleted["more"]) == (1, False)
+        assert within() == [] and density() == 0
+
+        assert client.delete('/delete', json={"ids": "all"}).status_code == 400
+        assert client.delete('/delete', json={"ids": [1], "bbox": "0,0,1,1"}).status_code == 400
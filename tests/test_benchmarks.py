@@ -0,0 +1,25 @@
+from benchmarks.run import compare
+
+
+def _results(**metrics):
+    return {"results": {"1000": metrics}}
+
+
+def test_compare_flags_slower_and_bigger():
+    baseline = _results(home_ms=10.0, markers_bytes=1000)
+    assert compare(_results(home_ms=11.0, markers_bytes=1000), baseline, 0.25) == []
+
+    regressions = compare(_results(home_ms=20.0, markers_bytes=1000), baseline, 0.25)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("1000.home_ms")
+
+
+def test_compare_throughput_higher_is_better():
+    baseline = _results(save_per_s=100.0)
+    assert compare(_results(save_per_s=200.0), baseline, 0.25) == []
+    assert len(compare(_results(save_per_s=50.0), baseline, 0.25)) == 1
+
+
+def test_compare_ignores_missing_sizes_and_metrics():
+    baseline = {"results": {"1000": {"home_ms": 1.0}, "1000000": {"home_ms": 1.0}}}
+    assert compare(_results(), baseline, 0.25) == []
@@ -0,0 +1,121 @@
+import io
+import json
+
+import pytest
+
+from beemap import bulkimport
+from beemap import storage
+from beemap.hives import Hive
+
+
+def _rows(text, fmt):
+    return list(bulkimport.read_rows(io.StringIO(text), fmt))
+
+
+def test_read_csv():
+    rows = _rows("lat,lon,firstname,familyname\n62.1,25.7,Maija,Mehiläinen\n61.5,23.8,Pekka,\n", "csv")
+    assert [number for number, _ in rows] == [1, 2]
+    assert bulkimport.hive_from_row(rows[0][1]) == Hive(None, 62.1, 25.7, "Maija", "Mehiläinen")
+    assert bulkimport.hive_from_row(rows[1][1]).familyname == ""
+
+
+def test_read_ndjson_with_bad_line():
+    rows = _rows('{"latitude": 62, "longitude": 25, "firstname": "Maija"}\n\n{broken\n', "ndjson")
+    assert [number for number, _ in rows] == [1, 2]
+    with pytest.raises(ValueError, match="Invalid JSON"):
+        bulkimport.hive_from_row(rows[1][1])
+
+
+def test_read_geojson_in_small_chunks():
+    features = [
+        {"type": "Feature", "geometry": {"type": "Point", "coordinates": [25.0 + i, 62.0]}, "properties": {"firstname": f"Hive {i}, [x]"}}
+        for i in range(20)
+    ]
+    text = json.dumps({"type": "FeatureCollection", "features": features}, indent=2)
+    found = list(bulkimport._features(io.StringIO(text), chunk_size=7))
+    assert found == features
+    assert bulkimport.hive_from_row(found[3]) == Hive(None, 62.0, 28.0, "Hive 3, [x]", "")
+
+    assert list(bulkimport._features(io.StringIO('{"features": []}'))) == []
+    with pytest.raises(ValueError):
+        list(bulkimport._features(io.StringIO('{"features": [{"type": "Feature"')))
+
+
+@pytest.mark.parametrize("row, error", [
+    ({"latitude": "x", "longitude": 25, "firstname": "Maija"}, "numbers"),
+    ({"latitude": 91, "longitude": 25, "firstname": "Maija"}, "range"),
+    ({"latitude": 62, "longitude": 25, "firstname": " "}, "firstname"),
+    ({"latitude": 62, "longitude": 25, "firstname": "Maija", "email": "nope"}, "email"),
+    ({"type": "Feature", "geometry": {"type": "Polygon"}}, "point"),
+    ([1, 2], "object"),
+])
+def test_invalid_rows(row, error):
+    with pytest.raises(ValueError, match=error):
+        bulkimport.hive_from_row(row)
+
+
+def _csv_rows(count):
+    lines = ["latitude,longitude,firstname"] + [f"{60 + i / 1000},25.0,Hive {i}" for i in range(count)]
+    return list(bulkimport.read_rows(io.StringIO("\n".join(lines)), "csv"))
+
+
+def test_import_dedupes_and_chunks():
+    repository = storage.MemoryHiveRepository([Hive(None, 60.0, 25.0, "Hive 0", "")])
+    rows = _csv_rows(10)
+    rows.append((11, {"latitude": "60.001", "longitude": "25", "firstname": "HIVE 1"}))
+    rows.append((12, {"latitude": "bad"}))
+    invalid = []
+
+    importer = bulkimport.BulkImporter(
+        repository, chunk_size=3, workers=2,
+        existing=[bulkimport.dedupe_key(hive) for hive in repository.iterate()],
+        on_invalid=lambda number, error: invalid.append(number),
+    )
+    stats = importer.run(rows)
+
+    assert (stats.read, stats.imported, stats.duplicates, stats.invalid, stats.chunks) == (12, 9, 2, 1, 3)
+    assert invalid == [12]
+    assert len(list(repository.iterate())) == 10
+
+
+class FailingRepository(storage.MemoryHiveRepository):
+    """Fails saving the chunk with a hive named `fail_on`."""
+
+    def __init__(self, fail_on):
+        super().__init__()
+        self.fail_on = fail_on
+
+    def save_many(self, hives):
+        if any(hive.firstname == self.fail_on for hive in hives):
+            raise TimeoutError("Deadline exceeded")
+        return super().save_many(hives)
+
+
+def test_import_resumes_from_checkpoint(tmp_path):
+    path = str(tmp_path / "import.checkpoint")
+    source = {"path": "hives.csv"}
+    repository = FailingRepository("Hive 7")
+
+    checkpoint = bulkimport.Checkpoint.load(path, source)
+    with pytest.raises(TimeoutError):
+        bulkimport.BulkImporter(repository, chunk_size=2, workers=1, checkpoint=checkpoint).run(_csv_rows(12))
+    assert len(list(repository.iterate())) == 6
+
+    # Rows of written chunks are skipped on the next run.
+    repository.fail_on = None
+    checkpoint = bulkimport.Checkpoint.load(path, source)
+    assert checkpoint.done_until == 6
+    stats = bulkimport.BulkImporter(repository, chunk_size=2, workers=3, checkpoint=checkpoint).run(_csv_rows(12))
+    assert (stats.skipped, stats.imported) == (6, 6)
+    assert sorted(hive.firstname for hive in repository.iterate()) == sorted(f"Hive {i}" for i in range(12))
+
+    with pytest.raises(ValueError, match="another import"):
+        bulkimport.Checkpoint.load(path, {"path": "other.csv"})
+
+
+def test_checkpoint_joins_ranges_completed_out_of_order(tmp_path):
+    checkpoint = bulkimport.Checkpoint(str(tmp_path / "checkpoint"), {})
+    checkpoint.mark((5, 8))
+    assert checkpoint.done_until == 0 and checkpoint.is_done(6) and not checkpoint.is_done(3)
+    checkpoint.mark((1, 4))
+    assert (checkpoint.done_until, checkpoint.done) == (8, [])
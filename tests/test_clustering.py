@@ -0,0 +1,73 @@
+import random
+
+from beemap.clustering import ClusterIndex
+from beemap.geo import BBox
+from beemap.hives import Hive
+
+
+def _hives(count, seed=5901):
+    rnd = random.Random(seed)
+    return [
+        Hive(i, rnd.uniform(60, 70), rnd.uniform(20, 30), "Maija", "Mehiläinen")
+        for i in range(count)
+    ]
+
+
+def test_cluster_counts_add_up_on_every_zoom():
+    hives = _hives(1000)
+    index = ClusterIndex(hives, max_zoom=10)
+    world = BBox(-180, -90, 180, 90)
+
+    for zoom in range(0, 12):
+        clusters = index.query(world, zoom)
+        assert sum(c.count for c in clusters) == len(hives), f"Zoom {zoom} lost hives"
+
+
+def test_clusters_get_finer_when_zooming_in():
+    index = ClusterIndex(_hives(1000), max_zoom=10)
+    world = BBox(-180, -90, 180, 90)
+    counts = [len(index.query(world, zoom)) for zoom in range(0, 11)]
+    assert counts == sorted(counts)
+    # Zoom 0 is a single 4x4 cell tile
+    assert counts[0] <= 16
+
+
+def test_cluster_query_bbox():
+    hives = [
+        Hive(1, 62.24, 25.72, "Maija", "Mehiläinen"),
+        Hive(2, 60.17, 24.94, "Matti", "Mehiläinen"),
+    ]
+    index = ClusterIndex(hives, max_zoom=12)
+
+    clusters = index.query(BBox(25.0, 62.0, 26.0, 63.0), 12)
+    assert [c.to_dict() for c in clusters] == [{"lat": 62.24, "lon": 25.72, "count": 1, "id": 1}]
+
+
+def test_cluster_centroid():
+    hives = [
+        Hive(1, 62.0, 25.0, "Maija", "Mehiläinen"),
+        Hive(2, 62.2, 25.2, "Matti", "Mehiläinen"),
+    ]
+    index = ClusterIndex(hives, max_zoom=4)
+    cluster, = index.query(BBox(-180, -90, 180, 90), 0)
+    data = cluster.to_dict()
+    assert data["count"] == 2
+    assert abs(data["lat"] - 62.1) < 1e-9
+    assert "id" not in data
+
+
+def test_cluster_patching_matches_rebuild():
+    hives = _hives(200)
+    index = ClusterIndex(hives[:150], max_zoom=10, max_changes=100)
+    index.add(hives[150:])
+    index.remove(hives[:50])
+    rebuilt = ClusterIndex(hives[50:], max_zoom=10)
+    world = BBox(-180, -90, 180, 90)
+
+    for zoom in range(0, 11):
+        patched = {(c.count, round(c.sum_lat, 6), round(c.sum_lon, 6)) for c in index.query(world, zoom)}
+        assert patched == {(c.count, round(c.sum_lat, 6), round(c.sum_lon, 6)) for c in rebuilt.query(world, zoom)}
+    assert index.changes == 100 and not index.needs_rebuild
+
+    index.remove(hives[150:151])
+    assert index.needs_rebuild
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from beemap import export
+from beemap.hives import Hive
+from beemap.storage import MemoryHiveRepository
+
+
+def _repository(count):
+    return MemoryHiveRepository(
+        Hive(None, 60.0 + i / 100, 25.0, "Maija", "Mehiläinen", "maija@example.com") for i in range(count)
+    )
+
+
+def test_prefetch_keeps_order():
+    pages = list(export.prefetch(export.walk_pages(_repository(55), 10)))
+    assert [len(p) for p in pages] == [10, 10, 10, 10, 10, 5]
+    assert [h.id for p in pages for h in p] == list(range(1, 56))
+
+
+def test_prefetch_raises_errors():
+    def broken():
+        yield [Hive(1, 0, 0, "", "")]
+        raise ConnectionError("Datastore went away")
+
+    pages = export.prefetch(broken())
+    assert next(pages)
+    with pytest.raises(ConnectionError):
+        next(pages)
+
+
+def test_ndjson_export():
+    lines = "".join(export.ndjson(export.walk_pages(_repository(3), 2))).splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[0]) == {
+        "id": 1, "latitude": 60.0, "longitude": 25.0, "firstname": "Maija", "familyname": "Mehiläinen",
+    }
+    assert "maija@example.com" not in "".join(lines)
+
+
+def test_geojson_export():
+    collection = json.loads("".join(export.geojson(export.walk_pages(_repository(5), 2))))
+    assert collection["type"] == "FeatureCollection"
+    assert len(collection["features"]) == 5
+    assert collection["features"][0]["geometry"]["coordinates"] == [25.0, 60.0]
+
+    empty = json.loads("".join(export.geojson(iter([]))))
+    assert empty["features"] == []
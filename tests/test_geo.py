@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from beemap import geo
+
+
+def test_encode_geohash():
+    """ Test geohash against known value """
+    assert geo.encode_geohash(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geo.encode_geohash(42.6, -5.6, 5) == "ezs42"
+
+
+def test_geohash_bbox_contains_point():
+    box = geo.geohash_bbox(geo.encode_geohash(62.24147, 25.72088))
+    assert box.contains(62.24147, 25.72088)
+
+
+def test_parse_bbox():
+    assert geo.parse_bbox("25.6,62.2,25.8,62.3") == geo.BBox(25.6, 62.2, 25.8, 62.3)
+    # Leaflet reports wrapped longitudes
+    assert geo.parse_bbox("190,0,200,10").min_lon == pytest.approx(-170)
+
+    for invalid in ["", "1,2,3", "a,b,c,d", "0,10,1,5"]:
+        with pytest.raises(ValueError):
+            geo.parse_bbox(invalid)
+
+
+def test_geohash_ranges_cover_bbox():
+    """ Every point inside of bbox must fall in some of the ranges """
+    rnd = random.Random(5901)
+    boxes = [
+        geo.BBox(25.6, 62.2, 25.8, 62.3),
+        geo.BBox(-180, -90, 180, 90),
+        # Crosses antimeridian
+        geo.BBox(170, -10, -170, 10),
+    ]
+
+    for bbox in boxes:
+        ranges = geo.geohash_ranges(bbox)
+        assert len(ranges) <= 32
+        for _ in range(500):
+            lat = rnd.uniform(bbox.min_lat, bbox.max_lat)
+            if bbox.min_lon <= bbox.max_lon:
+                lon = rnd.uniform(bbox.min_lon, bbox.max_lon)
+            else:
+                lon = rnd.choice([rnd.uniform(bbox.min_lon, 180), rnd.uniform(-180, bbox.max_lon)])
+            geohash = geo.encode_geohash(lat, lon)
+            assert any(start <= geohash < end for start, end in ranges), f"{lat},{lon} not covered"
@@ -0,0 +1,114 @@
+import random
+import time
+
+import pytest
+
+from beemap import heatmap
+from beemap.geo import BBox
+from beemap.hives import Hive
+from beemap.hiveset import HiveSet
+from beemap.snapshot import Patched
+from beemap.snapshot import Snapshot
+
+
+def _hives(count, seed=1):
+    rand = random.Random(seed)
+    return [Hive(i, rand.uniform(59.5, 70.0), rand.uniform(20.0, 31.5), "Maija", "Mehiläinen") for i in range(count)]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(heatmap, "numpy", None)
+    return request.param
+
+
+def test_morton_parent_is_shifted_code():
+    assert heatmap.morton(0b101, 0b011) == 0b011011
+    assert heatmap.morton(5 >> 1, 3 >> 1) == heatmap.morton(5, 3) >> 2
+
+
+def test_every_level_counts_every_hive(backend):
+    pyramid = heatmap.HeatmapPyramid(HiveSet.from_hives(_hives(500)), max_zoom=8)
+    assert [sum(level.counts) for level in pyramid.levels] == [500] * 9
+    sizes = [len(level) for level in pyramid.levels]
+    assert sizes == sorted(sizes)
+
+
+def test_query_counts_hives_in_bins(backend):
+    hives = _hives(500)
+    pyramid = heatmap.HeatmapPyramid(HiveSet.from_hives(hives), max_zoom=8)
+
+    [grid] = pyramid.query(BBox(19, 59, 32, 71), 5)
+    assert grid["zoom"] == 5
+    assert len(grid["counts"]) == grid["width"] * grid["height"]
+    assert sum(grid["counts"]) == 500
+
+    (south, west), (north, east) = grid["bounds"]
+    assert south < 59.5 and north > 70.0 and west < 20.0 and east > 31.5
+
+    # Bins north-west of center of Finland have the hives of that quarter.
+    half_x, half_y = grid["width"] // 2, grid["height"] // 2
+    corner = sum(grid["counts"][row * grid["width"] + col] for row in range(half_y) for col in range(half_x))
+    scale = 1 << (5 + heatmap.BIN_SHIFT)
+    north_of = heatmap.inverse_mercator(0, (grid["y"] + half_y) / scale)[0]
+    west_of = heatmap.inverse_mercator((grid["x"] + half_x) / scale, 0)[1]
+    assert corner == sum(1 for h in hives if h.latitude > north_of and h.longitude < west_of)
+
+
+def test_large_viewport_gets_coarser_bins(backend):
+    pyramid = heatmap.HeatmapPyramid(HiveSet.from_hives(_hives(100)), max_zoom=10)
+    [grid] = pyramid.query(BBox(-180, -85, 180, 85), 10, max_bins=1024)
+    assert grid["width"] * grid["height"] <= 1024
+    assert sum(grid["counts"]) == 100
+
+
+def test_antimeridian_gets_two_grids(backend):
+    hives = [Hive(1, 0, 179.5, "", ""), Hive(2, 0, -179.5, "", "")]
+    pyramid = heatmap.HeatmapPyramid(HiveSet.from_hives(hives), max_zoom=6)
+    grids = pyramid.query(BBox(179, -1, -179, 1), 6)
+    assert [sum(grid["counts"]) for grid in grids] == [1, 1]
+
+
+def test_incremental_updates_match_rebuild(backend):
+    hives = _hives(300)
+    pyramid = heatmap.HeatmapPyramid(HiveSet.from_hives(hives[:200]), max_zoom=8)
+    pyramid.add(hives[200:])
+    pyramid.remove(hives[:50])
+
+    rebuilt = heatmap.HeatmapPyramid(HiveSet.from_hives(hives[50:]), max_zoom=8)
+    for level, expected in zip(pyramid.levels, rebuilt.levels):
+        assert list(level.codes) == list(expected.codes)
+        assert list(level.counts) == list(expected.counts)
+
+
+def test_numpy_and_python_build_the_same_pyramid(monkeypatch):
+    pytest.importorskip("numpy")
+    hives = HiveSet.from_hives(_hives(1000))
+    vectorized = heatmap.HeatmapPyramid(hives, max_zoom=10)
+    monkeypatch.setattr(heatmap, "numpy", None)
+    looped = heatmap.HeatmapPyramid(hives, max_zoom=10)
+    assert [list(level.codes) for level in vectorized.levels] == [list(level.codes) for level in looped.levels]
+
+
+def test_cache_patches_and_rebuilds_on_new_load():
+    hives = _hives(10)
+    cache = Patched(lambda snapshot: heatmap.HeatmapPyramid(snapshot.hives, max_zoom=6))
+    snapshot = Snapshot(HiveSet.from_hives(hives), 1, built_at=1.0)
+    pyramid = cache.get(snapshot)
+    assert pyramid.total == 10
+
+    cache.add(_hives(5, seed=2))
+    assert cache.get(Snapshot(snapshot.hives, 2, built_at=1.0)) is pyramid
+    assert pyramid.total == 15
+
+    # Reload from storage is built in background, old pyramid is served meanwhile.
+    reloaded = Snapshot(HiveSet.from_hives(hives[:3]), 3, built_at=2.0)
+    assert cache.get(reloaded) is pyramid
+    for _ in range(100):
+        if cache.stats()["builds"] == 2:
+            break
+        time.sleep(0.01)
+    assert cache.get(reloaded).total == 3
@@ -0,0 +1,91 @@
+import pytest
+
+from beemap import hiveset
+from beemap.geo import BBox
+from beemap.hives import Hive
+from beemap.hiveset import HiveSet
+
+HIVES = [
+    Hive(1, 60.17, 24.94, "Maija", "Mehiläinen", "maija@example.com"),
+    Hive(2, 65.01, 25.47, "Pekka", "Mehiläinen"),
+    Hive(3, -33.86, 151.21, "Maija", "Kimalainen"),
+    Hive(4, 64.0, -179.5, "Liisa", "Pörriäinen"),
+]
+
+
+def test_columns_and_string_table():
+    hives = HiveSet.from_hives(HIVES)
+
+    assert len(hives) == 4
+    assert list(hives) == [hive._replace(email=None) for hive in HIVES]
+    assert hives[2] == HIVES[2]
+    # Shared names are stored once.
+    assert sorted(hives.strings) == ["Kimalainen", "Liisa", "Maija", "Mehiläinen", "Pekka", "Pörriäinen"]
+
+
+def test_add_and_remove_return_new_set():
+    hives = HiveSet.from_hives(HIVES)
+
+    moved = hives.add([Hive(1, 61.0, 25.0, "Maija", "Uusi")])
+    assert len(moved) == 4
+    assert moved[-1] == Hive(1, 61.0, 25.0, "Maija", "Uusi")
+    assert hives[0] == HIVES[0]._replace(email=None)
+
+    assert [hive.id for hive in hives.remove([2, 3])] == [1, 4]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_find(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(hiveset, "numpy", None)
+    elif hiveset.numpy is None:
+        pytest.skip("NumPy not installed")
+
+    hives = HiveSet.from_hives(hive._replace(id=hive.id + 10 * i) for i in range(3) for hive in HIVES)
+    assert hives.find([4, 12, 99, "key", 2 ** 70]) == [3, 5]
+    assert hives.find(range(30)) == list(range(12))
+    assert HiveSet.from_hives([Hive("a", 0, 0, "", ""), Hive("b", 0, 0, "", "")]).find(["b", 1]) == [1]
+
+
+@pytest.mark.parametrize("use_numpy", [True, False])
+def test_within(monkeypatch, use_numpy):
+    if not use_numpy:
+        monkeypatch.setattr(hiveset, "numpy", None)
+    elif hiveset.numpy is None:
+        pytest.skip("NumPy not installed")
+
+    hives = HiveSet.from_hives(HIVES)
+
+    assert hives.within(BBox(20, 59, 30, 66)) == [0, 1]
+    # Antimeridian crossing box.
+    assert hives.within(BBox(150, -40, -170, 70)) == [2, 3]
+    assert hives.within(BBox(0, 0, 1, 1)) == []
+
+
+@pytest.mark.parametrize("ids", [[1, 2, 3, 4], ["a", "b", 3, "d"]])
+def test_serialization(ids):
+    hives = HiveSet.from_hives(hive._replace(id=id) for hive, id in zip(HIVES, ids))
+
+    restored = HiveSet.from_buffer(hives.to_bytes())
+    assert list(restored) == list(hives)
+    assert restored.within(BBox(20, 59, 30, 66)) == [0, 1]
+
+    with pytest.raises(ValueError):
+        HiveSet.from_buffer(b"nonsense")
+
+
+def test_smaller_than_tuples():
+    import sys
+
+    many = [Hive(i, 60.0 + i * 1e-5, 25.0, "Maija", "Mehiläinen", f"maija{i}@example.com") for i in range(10000)]
+    tuples = sum(sys.getsizeof(hive) + sys.getsizeof(hive.email) + 2 * sys.getsizeof(1.0) for hive in many)
+
+    assert HiveSet.from_hives(many).nbytes * 5 < tuples
+
+
+def test_changes_to_serialized_set():
+    hives = HiveSet.from_buffer(HiveSet.from_hives(HIVES).to_bytes())
+
+    changed = hives.remove([1]).add([Hive(5, 61.0, 25.0, "Uusi", "Mehiläinen")])
+    assert [hive.id for hive in changed] == [2, 3, 4, 5]
+    assert changed[-1].firstname == "Uusi"
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from beemap import live
+from beemap import storage
+from beemap.hives import Hive
+
+
+def _hive(hive_id, lat=62.24, lon=25.72):
+    return Hive(hive_id, lat, lon, "Maija", "Mehiläinen")
+
+
+def test_hub_fans_out_and_drops_slow_clients():
+    async def scenario():
+        hub = live.Hub(queue_size=2)
+        hub.bind(asyncio.get_event_loop())
+        fast, slow = hub.subscribe(), hub.subscribe()
+
+        hub.saved([_hive(1)])
+        await asyncio.sleep(0)
+        assert fast.get_nowait() == slow.get_nowait() == live.format_event("saved", live.hive_event(_hive(1)))
+
+        for i in range(3):
+            hub.deleted([i])
+            await asyncio.sleep(0)
+            fast.get_nowait()
+
+        assert [slow.get_nowait(), slow.get_nowait()] == [live.RESET, None]
+        assert hub.stats() == {"clients": 1, "published": 4, "dropped": 1, "rejected": 0}
+
+    asyncio.run(scenario())
+
+
+def test_hub_rejects_clients_over_limit():
+    async def scenario():
+        hub = live.Hub(max_clients=1)
+        hub.subscribe()
+        with pytest.raises(live.HubFull):
+            hub.subscribe()
+
+    asyncio.run(scenario())
+
+
+def _connect(port, path="/hives/live"):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    sock.sendall(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode("ascii"))
+    return sock.makefile("rb")
+
+
+def _read_block(stream) -> bytes:
+    """Read up to an empty line, ending response head or one event."""
+    lines = []
+    while True:
+        line = stream.readline()
+        if line.strip() == b"":
+            return b"".join(lines)
+        lines.append(line)
+
+
+def _read_event(stream) -> dict:
+    lines = dict(line.split(": ", 1) for line in _read_block(stream).decode("utf-8").splitlines())
+    return {"event": lines["event"], "data": json.loads(lines["data"])}
+
+
+def _open_stream(port):
+    stream = _connect(port)
+    head = _read_block(stream)
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert b"text/event-stream" in head
+    assert _read_block(stream).startswith(b"retry: ")
+    return stream
+
+
+@pytest.fixture
+def server():
+    server = live.LiveServer(live.Hub(), host="127.0.0.1", port=0)
+    yield server
+    server.stop()
+
+
+def test_idle_clients_dont_take_threads(server):
+    port = server.start()
+    threads = threading.active_count()
+
+    clients = [_open_stream(port) for _ in range(200)]
+    try:
+        assert threading.active_count() == threads
+        assert server.hub.stats()["clients"] == 200
+
+        server.hub.saved([_hive(7)])
+        for stream in clients:
+            assert _read_event(stream) == {"event": "saved", "data": live.hive_event(_hive(7))}
+    finally:
+        for stream in clients:
+            stream.close()
+
+
+def test_unknown_path(server):
+    port = server.start()
+    with _connect(port, "/elsewhere") as stream:
+        assert stream.readline().startswith(b"HTTP/1.1 404")
+
+
+def test_follow_changes(server):
+    repository = storage.MemoryHiveRepository()
+    server.follow_changes(lambda since: repository.changes(since, 100), since=storage.next_stamp(), interval=0.01)
+    port = server.start()
+
+    with _open_stream(port) as stream:
+        hive = repository.save(_hive(None))
+        assert _read_event(stream) == {"event": "saved", "data": live.hive_event(hive)}
+
+        repository.delete([hive.id])
+        assert _read_event(stream) == {"event": "deleted", "data": [hive.id]}
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from benchmarks.loadtest import LoadTest
+from benchmarks.loadtest import percentile
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile(values, 99) == 99.0
+    assert percentile([3.0], 99) == 3.0
+    assert percentile([], 50) == 0.0
+
+
+@pytest.fixture
+def server(app):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_closed_loop(server):
+    report = asyncio.run(LoadTest(server, write_ratio=0.5).closed_loop(workers=4, duration=0.5))
+
+    assert report["requests"] > 0
+    assert report["errors"] == 0
+    assert set(report["paths"]) == {"/", "/hives.ndjson", "/save"}
+    assert report["paths"]["/"]["p99_ms"] >= report["paths"]["/"]["p50_ms"]
+
+
+def test_fixed_rate(server):
+    report = asyncio.run(LoadTest(server, write_ratio=0).fixed_rate(rate=20, duration=0.5))
+
+    assert report["paths"]["/"]["requests"] == 10
+    assert report["errors"] == 0
@@ -0,0 +1,60 @@
+import json
+import os
+
+from beemap import metrics
+
+
+def test_counter_and_histogram_rendering():
+    registry = metrics.Registry()
+    requests = registry.counter("test_requests_total", "Requests.", ["route"])
+    latency = registry.histogram("test_latency_seconds", "Latency.", ["route"], buckets=(0.1, 1.0))
+
+    requests.inc(route="/")
+    requests.inc(2, route="/")
+    latency.observe(0.05, route="/")
+    latency.observe(0.5, route="/")
+    latency.observe(5, route="/")
+
+    text = registry.render()
+    assert "# TYPE test_requests_total counter" in text
+    assert 'test_requests_total{route="/"} 3' in text
+    assert 'test_latency_seconds_bucket{route="/",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{route="/",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{route="/",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{route="/"} 3' in text
+    assert 'test_latency_seconds_sum{route="/"} 5.55' in text
+
+
+def test_label_values_are_escaped():
+    registry = metrics.Registry()
+    registry.counter("test_total", "Test.", ["path"]).inc(path='a"b\\c')
+    assert 'test_total{path="a\\"b\\\\c"} 1' in registry.render()
+
+
+def test_collectors():
+    registry = metrics.Registry()
+    registry.add_collector(lambda: [("test_cache_hits", "Hits.", {}, 7), ("test_cache_age", "Age.", {}, None)])
+    text = registry.render()
+    assert "test_cache_hits 7" in text
+    assert "test_cache_age" not in text
+
+
+def test_multiprocess_merge(tmp_path):
+    registry = metrics.Registry(str(tmp_path))
+    registry.counter("test_requests_total", "Requests.", ["route"]).inc(route="/")
+    registry.histogram("test_latency_seconds", "Latency.", buckets=(1.0,)).observe(0.5)
+    registry.gauge("test_size", "Size.").set(10)
+
+    # Pretend another worker, the parent process, has dumped its metrics.
+    other = metrics.Registry(str(tmp_path))
+    other.counter("test_requests_total", "Requests.", ["route"]).inc(4, route="/")
+    other.histogram("test_latency_seconds", "Latency.", buckets=(1.0,)).observe(2)
+    other.gauge("test_size", "Size.").set(20)
+    with open(tmp_path / f"metrics-{os.getppid()}.json", "w") as f:
+        json.dump({"pid": os.getppid(), "metrics": other.state()}, f)
+
+    text = registry.render()
+    assert 'test_requests_total{route="/"} 5' in text
+    assert 'test_latency_seconds_count 2' in text
+    assert f'test_size{{pid="{os.getpid()}"}} 10' in text
+    assert f'test_size{{pid="{os.getppid()}"}} 20' in text
@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from beemap import nearest
+from beemap.geo import haversine
+from beemap.hives import Hive
+from beemap.hiveset import HiveSet
+
+
+def _hives(count, seed=1):
+    rand = random.Random(seed)
+    return [Hive(i, rand.uniform(59.5, 70.0), rand.uniform(20.0, 31.5), "Maija", "Mehiläinen") for i in range(count)]
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(nearest, "numpy", None)
+    return request.param
+
+
+def _brute_force(hives, lat, lon):
+    return sorted((haversine(lat, lon, hive.latitude, hive.longitude), hive.id) for hive in hives)
+
+
+def test_haversine():
+    # Helsinki to Jyväskylä, about 230 km.
+    assert haversine(60.1699, 24.9384, 62.2426, 25.7473) == pytest.approx(235500, rel=0.01)
+    assert haversine(0, 179.9, 0, -179.9) == pytest.approx(22239, rel=0.01)
+
+
+def test_nearest_matches_brute_force(backend):
+    hives = _hives(2000)
+    index = nearest.HiveIndex(HiveSet.from_hives(hives), leaf_size=8)
+
+    rand = random.Random(2)
+    points = [(62.24, 25.72), (69.9, 31.4), (0.0, 0.0)] + [(rand.uniform(59, 71), rand.uniform(19, 32)) for _ in range(30)]
+    for lat, lon in points:
+        found = index.nearest(lat, lon, 10)
+        expected = _brute_force(hives, lat, lon)[:10]
+        assert [hive.id for _, hive in found] == [hive_id for _, hive_id in expected]
+        assert [distance for distance, _ in found] == pytest.approx([distance for distance, _ in expected])
+
+
+def test_within_matches_brute_force(backend):
+    hives = _hives(2000)
+    index = nearest.HiveIndex(HiveSet.from_hives(hives), leaf_size=8)
+
+    found = index.within(62.24, 25.72, 30000, limit=1000)
+    expected = [hive_id for distance, hive_id in _brute_force(hives, 62.24, 25.72) if distance <= 30000]
+    assert expected
+    assert [hive.id for _, hive in found] == expected
+    assert len(index.within(62.24, 25.72, 30000, limit=2)) == 2
+
+
+def test_across_antimeridian(backend):
+    hives = [Hive(1, 0, 179.99, "", ""), Hive(2, 0, -179.99, "", ""), Hive(3, 0, 170, "", "")]
+    index = nearest.HiveIndex(HiveSet.from_hives(hives), leaf_size=1)
+    assert [hive.id for _, hive in index.nearest(0, -179.999, 2)] == [2, 1]
+    assert [hive.id for _, hive in index.within(0, 180, 5000, 10)] == [1, 2]
+
+
+def test_saved_and_deleted_hives_are_searched_until_rebuild():
+    hives = _hives(100)
+    index = nearest.HiveIndex(HiveSet.from_hives(hives), max_changes=3)
+    target = hives[0]
+
+    index.remove([target])
+    assert target.id not in [hive.id for _, hive in index.nearest(target.latitude, target.longitude, 5)]
+
+    moved = Hive(hives[1].id, target.latitude, target.longitude, "Moved", "")
+    index.add([moved])
+    distance, found = index.nearest(target.latitude, target.longitude, 1)[0]
+    assert found == moved and distance == 0
+    assert [hive.id for _, hive in index.within(target.latitude, target.longitude, 1, 10)] == [moved.id]
+    assert not index.needs_rebuild
+
+    index.add(_hives(2, seed=2))
+    assert index.needs_rebuild
@@ -0,0 +1,112 @@
+import gzip
+import threading
+
+from flask import Flask
+import pytest
+
+from beemap.pagecache import CachedPage
+from beemap.pagecache import PageCache
+
+app = Flask(__name__)
+
+
+def test_page_cache_renders_once():
+    cache = PageCache()
+    calls = []
+
+    def render():
+        calls.append(1)
+        return b"<html></html>"
+
+    first = cache.get(("home", "fi", 1), render, "text/html")
+    second = cache.get(("home", "fi", 1), render, "text/html")
+    assert first is second
+    assert len(calls) == 1
+
+    # New data version renders again
+    cache.get(("home", "fi", 2), render, "text/html")
+    assert len(calls) == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_page_cache_is_bounded():
+    cache = PageCache(max_entries=2)
+    for version in range(5):
+        cache.get(("home", "fi", version), lambda: b"x", "text/html")
+    assert cache.stats()["pages"] == 2
+
+
+def test_page_cache_renders_key_once_for_concurrent_misses():
+    cache = PageCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def render():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b"<html></html>"
+
+    pages = []
+    threads = [threading.Thread(target=lambda: pages.append(cache.get(("home", "fi", 1), render, "text/html"))) for _ in range(4)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(pages) == 4 and all(page is pages[0] for page in pages)
+
+
+def test_page_cache_render_failure_lets_next_caller_render():
+    cache = PageCache()
+
+    def fail():
+        raise RuntimeError("Template broke")
+
+    with pytest.raises(RuntimeError):
+        cache.get(("home", "fi", 1), fail, "text/html")
+    assert cache.get(("home", "fi", 1), lambda: b"ok", "text/html").bodies["identity"] == b"ok"
+
+
+def test_cached_page_content_negotiation():
+    page = CachedPage(b"hello " * 100, "text/plain")
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+        from flask import request
+        response = page.response(request)
+        assert response.content_encoding == "gzip"
+        assert gzip.decompress(response.get_data()) == b"hello " * 100
+        assert "Accept-Encoding" in response.vary
+
+    with app.test_request_context():
+        from flask import request
+        response = page.response(request)
+        assert response.content_encoding is None
+        assert response.get_data() == b"hello " * 100
+
+
+def test_cached_page_prefers_brotli():
+    brotli = pytest.importorskip("brotli")
+    page = CachedPage(b"hello " * 100, "text/plain")
+
+    with app.test_request_context(headers={"Accept-Encoding": "gzip, deflate, br"}):
+        from flask import request
+        response = page.response(request)
+        assert response.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(response.get_data()) == b"hello " * 100
+        assert response.get_etag()[0] == page.etags["br"]
+
+
+def test_cached_page_not_modified():
+    page = CachedPage(b"hello", "text/plain")
+    etag = page.etags["identity"]
+
+    with app.test_request_context(headers={"If-None-Match": f'"{etag}"', "Accept-Encoding": "gzip"}):
+        from flask import request
+        response = page.response(request)
+        assert response.status_code == 304
+        assert response.get_data() == b""
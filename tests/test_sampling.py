@@ -0,0 +1,132 @@
+from types import SimpleNamespace
+
+from flask import Flask
+
+from beemap import sampling
+
+
+def _span(trace_id, route="/", status_code=200, seconds=0.1, error=False):
+    return SimpleNamespace(
+        name=f"[GET]{route}",
+        context=SimpleNamespace(trace_id=trace_id),
+        parent_span_id=None,
+        attributes={"http.route": route, "http.status_code": status_code},
+        status=SimpleNamespace(code=2) if error else None,
+        start_time="2021-02-10T14:42:00.000000Z",
+        end_time="2021-02-10T14:42:%02d.%06dZ" % (int(seconds), (seconds % 1) * 1e6),
+    )
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span_datas):
+        self.spans.extend(span_datas)
+
+
+def test_token_bucket_rate():
+    buckets = sampling.TokenBuckets(default_rate=2.0, rates={"/health": 0})
+    # Two tokens at start, then two per second.
+    assert [buckets.allow("/", now=0.0) for _ in range(3)] == [True, True, False]
+    assert buckets.allow("/", now=0.5)
+    assert not buckets.allow("/", now=0.5)
+    # Routes have separate buckets
+    assert buckets.allow("/save", now=0.5)
+    assert not buckets.allow("/health", now=100.0)
+
+
+def test_tail_sampling_keeps_errors_and_slow_requests():
+    target = ListExporter()
+    exporter = sampling.TailSamplingExporter(target, sampling.TokenBuckets(default_rate=0), slow_threshold=1.0)
+
+    exporter.export([_span("fast")])
+    exporter.export([_span("failed", status_code=500)])
+    exporter.export([_span("exception", error=True)])
+    exporter.export([_span("slow", seconds=2.5)])
+
+    assert [s.context.trace_id for s in target.spans] == ["failed", "exception", "slow"]
+    assert exporter.stats() == {"dropped": 1, "kept_error": 2, "kept_slow": 1, "kept_budget": 0}
+
+
+def test_tail_sampling_budget_per_route():
+    target = ListExporter()
+    exporter = sampling.TailSamplingExporter(target, sampling.TokenBuckets(default_rate=1))
+
+    exporter.export([_span(str(i), route="/") for i in range(5)])
+    exporter.export([_span("save", route="/save")])
+    assert [s.context.trace_id for s in target.spans] == ["0", "save"]
+
+
+def test_route_budget_sampler():
+    app = Flask(__name__)
+
+    @app.route("/")
+    def index():
+        return ""
+
+    sampler = sampling.RouteBudgetSampler(
+        sampling.TokenBuckets(default_rate=1), excluded=["/static/"], excluded_rate=0)
+
+    with app.test_request_context("/static/app.js"):
+        assert not sampler.should_sample()
+
+    with app.test_request_context("/"):
+        assert sampler.should_sample()
+        assert not sampler.should_sample()
+
+    sampler.tail = True
+    with app.test_request_context("/"):
+        assert sampler.should_sample()
+
+
+def _child(trace_id, span_id, parent_span_id, name="storage"):
+    return SimpleNamespace(
+        name=name,
+        context=SimpleNamespace(trace_id=trace_id),
+        span_id=span_id,
+        parent_span_id=parent_span_id,
+        span_kind=0,
+        attributes={},
+        status=None,
+        start_time="2021-02-10T14:42:00.000000Z",
+        end_time="2021-02-10T14:42:00.001000Z",
+    )
+
+
+def _request(trace_id, span_id, route="/", status_code=200, parent_span_id="upstream"):
+    span = _span(trace_id, route=route, status_code=status_code)
+    span.span_id, span.parent_span_id, span.span_kind = span_id, parent_span_id, sampling.SPAN_KIND_SERVER
+    return span
+
+
+def test_tail_sampling_decides_once_per_trace():
+    target = ListExporter()
+    exporter = sampling.TailSamplingExporter(target, sampling.TokenBuckets(default_rate=0))
+
+    # Child subtree is exported first, and waits for the request span.
+    child = _child("failed", "b", parent_span_id="a")
+    exporter.export([child])
+    assert target.spans == []
+
+    # Request span has a propagated parent, and comes after its children, which are exported again.
+    request = _request("failed", "a", status_code=500)
+    exporter.export([child, request])
+    assert target.spans == [child, request]
+
+    # Late batches follow the decision.
+    late = _child("failed", "c", parent_span_id="a")
+    exporter.export([late])
+    exporter.export([_child("fast", "e", parent_span_id="d"), _child("fast", "f", parent_span_id="e")])
+    exporter.export([_request("fast", "d")])
+    assert target.spans == [child, request, late]
+    assert exporter.stats() == {"dropped": 1, "kept_error": 1, "kept_slow": 0, "kept_budget": 0}
+
+
+def test_tail_sampling_decides_abandoned_traces():
+    target = ListExporter()
+    exporter = sampling.TailSamplingExporter(target, sampling.TokenBuckets(default_rate=0), max_traces=2)
+
+    for i in range(3):
+        exporter.export([_child(str(i), "b", parent_span_id="a")])
+    assert exporter.stats()["dropped"] == 1
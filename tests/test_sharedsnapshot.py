@@ -0,0 +1,56 @@
+from beemap.hives import Hive
+from beemap.hiveset import HiveSet
+from beemap.sharedsnapshot import SharedHiveSnapshot
+from beemap.sharedsnapshot import SnapshotFile
+
+HIVES = [
+    Hive(1, 60.17, 24.94, "Maija", "Mehiläinen", "maija@example.com"),
+    Hive("vanha-avain", 65.01, 25.47, "Pekka", "Pörriäinen"),
+]
+
+
+def test_file_roundtrip(tmp_path):
+    snapshot_file = SnapshotFile(str(tmp_path / "hives.snapshot"))
+    assert snapshot_file.read() is None
+
+    snapshot_file.write(HiveSet.from_hives(HIVES), 1234.5)
+    hives, built_at = snapshot_file.read()
+
+    assert built_at == 1234.5
+    # Emails are left out.
+    assert list(hives) == [hive._replace(email=None) for hive in HIVES]
+    assert hives[-1].id == "vanha-avain"
+
+
+def test_workers_share_loads(tmp_path):
+    path = str(tmp_path / "hives.snapshot")
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return HIVES
+
+    first = SharedHiveSnapshot(loader, path, ttl=60)
+    second = SharedHiveSnapshot(loader, path, ttl=60)
+
+    assert len(first.get()) == 2
+    assert len(second.get()) == 2
+    assert len(loads) == 1
+    assert second.stats()["shared_loads"] == 1
+
+
+def test_change_makes_file_stale(tmp_path):
+    path = str(tmp_path / "hives.snapshot")
+    stored = list(HIVES)
+    first = SharedHiveSnapshot(lambda: stored, path, ttl=60)
+    second = SharedHiveSnapshot(lambda: stored, path, ttl=60)
+    first.get()
+
+    new = Hive(3, 61.5, 23.8, "Liisa", "Kimalainen")
+    stored.append(new)
+    first.add([new])
+
+    # Worker that saved sees the hive right away, others load it from storage.
+    assert new in first.get()
+    assert new in second.get()
+    assert second.stats()["shared_loads"] == 0
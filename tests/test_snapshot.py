@@ -0,0 +1,153 @@
+import threading
+
+import pytest
+
+from beemap.geo import BBox
+from beemap.hives import Hive
+from beemap.snapshot import HiveSnapshot
+
+
+def _hive(id):
+    return Hive(id, 62.0, 25.0, "Maija", "Mehiläinen")
+
+
+class FlakyLoader:
+    """ Loader that can be made to fail or block """
+
+    def __init__(self, hives):
+        self.hives = hives
+        self.calls = 0
+        self.fail = False
+        self.gate = None
+
+    def __call__(self):
+        self.calls += 1
+        if self.gate:
+            self.gate.wait(5)
+        if self.fail:
+            raise TimeoutError("Datastore timed out")
+        return list(self.hives)
+
+
+def test_snapshot_hits_and_misses():
+    loader = FlakyLoader([_hive(1), _hive(2)])
+    cache = HiveSnapshot(loader, ttl=60)
+
+    assert len(cache.get()) == 2
+    assert len(cache.get()) == 2
+    assert loader.calls == 1
+
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["age"] is not None
+
+
+def test_snapshot_serves_stale_while_refreshing():
+    loader = FlakyLoader([_hive(1)])
+    cache = HiveSnapshot(loader, ttl=60)
+    first = cache.get()
+
+    loader.hives.append(_hive(2))
+    loader.gate = threading.Event()
+    cache.invalidate()
+
+    # Refresh is blocked, reader gets stale copy without waiting.
+    assert cache.get() is first
+    assert cache.stats()["stale_hits"] == 1
+
+    loader.gate.set()
+    _wait_refresh(cache)
+    assert len(cache.get()) == 2
+    assert cache.get().version > first.version
+
+
+def test_snapshot_reset_loads_again():
+    loader = FlakyLoader([_hive(1)])
+    cache = HiveSnapshot(loader, ttl=60)
+    cache.get()
+
+    cache.reset()
+    assert cache.peek() is None
+    loader.hives.append(_hive(2))
+    assert len(cache.get()) == 2
+    assert loader.calls == 2
+
+
+def test_snapshot_serves_stale_on_error():
+    loader = FlakyLoader([_hive(1)])
+    cache = HiveSnapshot(loader, ttl=0)
+    first = cache.get()
+
+    loader.fail = True
+    assert cache.get() is first
+    _wait_refresh(cache)
+    assert cache.stats()["errors"] == 1
+    assert cache.get().hives == first.hives
+
+
+def test_snapshot_cold_start_error_raises():
+    loader = FlakyLoader([])
+    loader.fail = True
+    cache = HiveSnapshot(loader, ttl=60)
+    with pytest.raises(TimeoutError):
+        cache.get()
+
+
+def test_snapshot_patching():
+    loader = FlakyLoader([_hive(1), _hive(2)])
+    cache = HiveSnapshot(loader, ttl=60)
+    version = cache.get().version
+
+    cache.add([_hive(3)])
+    cache.remove([1])
+    snapshot = cache.get()
+    assert sorted(h.id for h in snapshot) == [2, 3]
+    assert snapshot.version > version
+    # Patching doesn't hit storage.
+    assert loader.calls == 1
+
+
+def test_snapshot_keeps_changes_aside_until_max_changes():
+    loader = FlakyLoader([_hive(1), _hive(2), Hive(3, 60.0, 24.0, "Pekka", "")])
+    cache = HiveSnapshot(loader, ttl=60, max_changes=4)
+    base = cache.get().base
+
+    cache.add([Hive(2, 61.0, 24.0, "Moved", ""), Hive(4, 62.0, 25.0, "New", "")])
+    cache.remove([3, 99])
+    snapshot = cache.get()
+    # Columns are shared, not copied per change.
+    assert snapshot.base is base
+    assert len(snapshot) == 3
+    assert [h.id for h in snapshot.within(BBox(24.5, 61.5, 25.5, 62.5))] == [1, 4]
+    assert snapshot.within(BBox(24.5, 61.5, 25.5, 62.5), limit=1) == [_hive(1)]
+    assert sorted(h.firstname for h in snapshot.find([2, 3, 4])) == ["Moved", "New"]
+    assert sorted(h.id for h in snapshot.hives) == [1, 2, 4]
+
+    cache.add([_hive(5)])
+    merged = cache.get()
+    assert merged.base is not base and merged.changes == 0
+    assert sorted(h.id for h in merged) == [1, 2, 4, 5]
+    assert cache.stats()["merges"] == 1
+
+
+def test_snapshot_patch_during_refresh_is_kept():
+    loader = FlakyLoader([_hive(1)])
+    cache = HiveSnapshot(loader, ttl=60)
+    cache.get()
+
+    loader.gate = threading.Event()
+    cache.invalidate()
+    cache.get()
+    # Saved while refresh is loading old data
+    cache.add([_hive(2)])
+    loader.gate.set()
+    _wait_refresh(cache)
+
+    assert sorted(h.id for h in cache.get()) == [1, 2]
+
+
+def _wait_refresh(cache):
+    for thread in threading.enumerate():
+        if thread.name == "hive-snapshot-refresh":
+            thread.join(5)
@@ -1,9 +1,12 @@
+import asyncio
 import os
 import unittest
 
 import pytest
 import requests
 
+from benchmarks.loadtest import LoadTest
+
 # Module requires website_staging environment variable to be defined, and it should be url pointing to staging website.
 
 if not os.getenv("WEBSITE_STAGING"):
@@ -34,3 +37,18 @@ class AvailabilityTest(unittest.TestCase):
         )
 
         # TODO: Check that pages that shouldn't exists, won't.
+
+
+@pytest.mark.staging
+class LightLoadTest(unittest.TestCase):
+    def test_light_load(self):
+        """Read map at a gentle fixed rate, and check latency and errors.
+
+        Only reads, so staging isn't filled with test hives. For heavier load,
+        run ``python -m benchmarks.loadtest`` by hand.
+        """
+        url = os.getenv("WEBSITE_STAGING")
+        report = asyncio.run(LoadTest(url, write_ratio=0).fixed_rate(rate=2, duration=10))
+
+        self.assertEqual(report["errors"], 0, f"Errors under load: {report!r}")
+        self.assertLess(report["paths"]["/"]["p95_ms"], 2000, f"Map page too slow: {report!r}")
@@ -0,0 +1,33 @@
+"""Cold start budget: app import must stay fast and free of telemetry and storage clients."""
+
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds. Import takes about 0.2s on a developer machine, leave room for slow CI.
+IMPORT_BUDGET = 1.5
+
+# Modules that should only be imported when used.
+LAZY_MODULES = ["opencensus", "google.cloud.datastore", "grpc"]
+
+
+def _import_main() -> dict:
+    script = (
+        "import json, sys, time\n"
+        "started = time.perf_counter()\n"
+        "import main\n"
+        "print(json.dumps({'seconds': time.perf_counter() - started, 'modules': sorted(sys.modules)}))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_budget():
+    result = min((_import_main() for _ in range(3)), key=lambda r: r["seconds"])
+
+    assert result["seconds"] < IMPORT_BUDGET
+    for module in LAZY_MODULES:
+        assert module not in result["modules"]
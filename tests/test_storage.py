@@ -0,0 +1,264 @@
+import itertools
+import operator
+
+import pytest
+
+from beemap import storage
+from beemap.geo import BBox
+from beemap.hives import Hive
+
+
+@pytest.fixture(params=["memory", "sqlite", "datastore"])
+def repository(request):
+    if request.param == "datastore":
+        pytest.importorskip("google.cloud.datastore")
+        return storage.DatastoreHiveRepository(client=FakeDatastoreClient())
+    return storage.create_repository({"HIVE_STORAGE": request.param, "HIVE_STORAGE_PATH": ":memory:"})
+
+
+def _hive(lat, lon, name="Maija"):
+    return Hive(None, lat, lon, name, "Mehiläinen", "maija@example.com")
+
+
+def test_save_assigns_ids(repository):
+    first = repository.save(_hive(62.24, 25.72))
+    second, third = repository.save_many([_hive(60.17, 24.94), _hive(61.5, 23.76)])
+
+    assert first.id is not None
+    assert len({first.id, second.id, third.id}) == 3
+    assert sorted(h.id for h in repository.iterate()) == sorted([first.id, second.id, third.id])
+
+
+def test_query_bbox(repository):
+    jkl = repository.save(_hive(62.24, 25.72))
+    repository.save(_hive(60.17, 24.94))
+
+    found = repository.query_bbox(BBox(25.0, 62.0, 26.0, 63.0))
+    assert [h.id for h in found] == [jkl.id]
+    assert found[0] == jkl
+
+
+def test_query_bbox_across_antimeridian(repository):
+    east = repository.save(_hive(0, 179.5))
+    west = repository.save(_hive(0, -179.5))
+    repository.save(_hive(0, 0))
+
+    found = repository.query_bbox(BBox(179, -1, -179, 1))
+    assert sorted(h.id for h in found) == sorted([east.id, west.id])
+
+
+def test_query_bbox_edges_are_inclusive(repository):
+    # Not exact in float32, which SQLite R*Tree uses for bounds.
+    edge = repository.save(_hive(62.1, 25.3))
+    bbox = BBox(25.3, 62.1, 25.7, 62.3)
+
+    assert [h.id for h in repository.query_bbox(bbox)] == [edge.id]
+    assert repository.query_bbox_ids(bbox) == [edge.id]
+    assert repository.query_bbox(BBox(25.3000001, 62.1, 25.7, 62.3)) == []
+
+
+def test_query_bbox_limit(repository):
+    repository.save_many([_hive(62.0 + i / 1000, 25.0) for i in range(10)])
+    assert len(repository.query_bbox(BBox(24, 61, 26, 63), limit=3)) == 3
+
+
+def test_query_bbox_ids(repository):
+    inside = repository.save_many([_hive(62.0 + i / 1000, 25.0) for i in range(5)])
+    repository.save(_hive(60.17, 24.94))
+
+    assert sorted(repository.query_bbox_ids(BBox(24, 61, 26, 63))) == sorted(h.id for h in inside)
+    assert len(repository.query_bbox_ids(BBox(24, 61, 26, 63), limit=2)) == 2
+
+
+def test_delete(repository):
+    keep, gone = repository.save_many([_hive(62.24, 25.72), _hive(60.17, 24.94)])
+    repository.delete([gone.id])
+
+    assert [h.id for h in repository.iterate()] == [keep.id]
+    assert repository.query_bbox(BBox(24, 60, 25, 61)) == []
+
+
+def test_get_many(repository):
+    first, second = repository.save_many([_hive(62.24, 25.72), _hive(60.17, 24.94)])
+    assert sorted(h.id for h in repository.get_many([second.id, first.id, 12345])) == sorted([first.id, second.id])
+    assert repository.get_many([first.id])[0].email == "maija@example.com"
+    assert repository.get_many([]) == []
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        storage.create_repository({"HIVE_STORAGE": "floppy"})
+
+
+def test_page_walks_all_hives(repository):
+    saved = repository.save_many([_hive(62.0 + i / 100, 25.0) for i in range(25)])
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page, cursor = repository.page(cursor, 10)
+        seen.extend(h.id for h in page)
+        pages += 1
+        if cursor is None:
+            break
+
+    assert pages == 3
+    assert sorted(seen) == sorted(h.id for h in saved)
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "ääkköset", "-1x"])
+def test_page_rejects_invalid_cursor(repository, cursor):
+    repository.save(_hive(62.24, 25.72))
+    with pytest.raises(ValueError):
+        repository.page(cursor, 10)
+
+
+def test_changes(repository):
+    since = storage.next_stamp()
+    first, second = repository.save_many([_hive(62.24, 25.72), _hive(60.17, 24.94)])
+
+    changes = repository.changes(since, 10)
+    assert sorted(h.id for h in changes.saved) == sorted([first.id, second.id])
+    assert changes.deleted == []
+    assert not changes.truncated
+
+    repository.delete([first.id])
+    later = repository.changes(changes.stamp, 10)
+    assert later.saved == []
+    assert later.deleted == [first.id]
+    assert later.stamp > changes.stamp
+
+    assert repository.changes(later.stamp, 10) == storage.Changes([], [], None, False)
+
+
+def test_changes_after_saving_deleted_hive_again(repository):
+    since = storage.next_stamp()
+    hive = repository.save(_hive(62.24, 25.72))
+    repository.delete([hive.id])
+    repository.save(hive)
+
+    changes = repository.changes(since, 10)
+    assert [h.id for h in changes.saved] == [hive.id]
+    assert changes.deleted == []
+    assert [h.id for h in repository.iterate()] == [hive.id]
+
+
+def test_changes_are_paged(repository):
+    since = storage.next_stamp()
+    saved = repository.save_many([_hive(62.0 + i / 1000, 25.0) for i in range(5)])
+
+    ids = []
+    while True:
+        changes = repository.changes(since, 2)
+        ids.extend(h.id for h in changes.saved)
+        since = changes.stamp
+        if not changes.truncated:
+            break
+    assert sorted(ids) == sorted(h.id for h in saved)
+
+
+class FakeDatastoreClient:
+    """Just enough of datastore client for the repository, with queries paged by cursors."""
+
+    def __init__(self):
+        self.entities = {}
+        self.fetches = 0
+        self._ids = itertools.count(1)
+
+    def key(self, kind, id=None):
+        from google.cloud import datastore
+        return datastore.Key(kind, id, project="test") if id is not None else datastore.Key(kind, project="test")
+
+    def put_multi(self, entities, timeout=None):
+        for entity in entities:
+            if entity.key.is_partial:
+                entity.key = entity.key.completed_key(next(self._ids))
+            self.entities[entity.key] = entity
+
+    def get_multi(self, keys, timeout=None):
+        return [self.entities[key] for key in keys if key in self.entities]
+
+    def delete_multi(self, keys, timeout=None):
+        for key in keys:
+            self.entities.pop(key, None)
+
+    def query(self, kind):
+        return FakeQuery(self, kind)
+
+
+class FakeQuery:
+    ops = {">=": operator.ge, ">": operator.gt, "<": operator.lt, "=": operator.eq}
+
+    def __init__(self, client, kind):
+        self.client = client
+        self.kind = kind
+        self.filters = []
+        self.projection = ()
+        self.order = ()
+        self._keys_only = False
+
+    def add_filter(self, name, op, value):
+        self.filters.append((name, op, value))
+
+    def keys_only(self):
+        self._keys_only = True
+
+    def fetch(self, start_cursor=None, limit=None, timeout=None):
+        from google.api_core.exceptions import InvalidArgument
+
+        self.client.fetches += 1
+        matches = [
+            entity for key, entity in self.client.entities.items()
+            if key.kind == self.kind and all(name in entity and self.ops[op](entity[name], value) for name, op, value in self.filters)
+        ]
+        # Like datastore, sort by the inequality filter property first.
+        order = list(self.order) or [name for name, op, _ in self.filters if op != "="][:1]
+        matches.sort(key=lambda entity: [entity[name] for name in order] + [entity.key.id_or_name])
+        try:
+            offset = int(start_cursor or 0)
+        except ValueError:
+            raise InvalidArgument("Invalid query cursor")
+        end = len(matches) if limit is None else offset + limit
+        page = matches[offset:end]
+        if self._keys_only:
+            page = [_projected(entity, ()) for entity in page]
+        elif self.projection:
+            page = [_projected(entity, self.projection) for entity in page]
+        more = end < len(matches)
+        return FakeIterator(page, str(end).encode("ascii") if more else None)
+
+
+class FakeIterator:
+    def __init__(self, page, next_page_token):
+        self.pages = iter([page])
+        self.next_page_token = next_page_token
+        self._page = page
+
+    def __iter__(self):
+        return iter(self._page)
+
+
+def _projected(entity, names):
+    from google.cloud import datastore
+
+    projected = datastore.Entity(key=entity.key)
+    projected.update({name: entity[name] for name in names})
+    return projected
+
+
+def test_datastore_bbox_reads_past_hives_outside_of_it():
+    client = FakeDatastoreClient()
+    repository = storage.DatastoreHiveRepository(client=client)
+    repository.query_page_size = 100
+    bbox = BBox(25.0, 62.0, 25.01, 62.01)
+    # Dense hives just outside of bbox, in the same geohash cells.
+    repository.save_many([_hive(62.0 - 0.0001 - i * 1e-7, 25.005) for i in range(2000)])
+    inside = repository.save_many([_hive(62.005, 25.001 + i * 1e-4) for i in range(50)])
+
+    found = repository.query_bbox(bbox, limit=101)
+    assert sorted(hive.id for hive in found) == sorted(hive.id for hive in inside)
+    assert len(repository.query_bbox(bbox, limit=10)) == 10
+
+    ids = repository.query_bbox_ids(bbox, limit=101)
+    assert sorted(ids) == sorted(hive.id for hive in inside)
@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from beemap import telemetry
+
+
+class SlowExport:
+    """ Export that blocks until released, like Application Insights being down """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.batches = []
+
+    def __call__(self, batch):
+        self.release.wait(5)
+        self.batches.append(list(batch))
+
+
+def test_put_does_not_wait_for_export():
+    export = SlowExport()
+    queue = telemetry.BackgroundExporter(export, batch_size=1, interval=0.01)
+
+    started = time.monotonic()
+    for i in range(100):
+        queue.put(i)
+    assert time.monotonic() - started < 1
+
+    export.release.set()
+    queue.close()
+    assert sum(len(b) for b in export.batches) == 100
+    assert queue.stats()["exported"] == 100
+
+
+@pytest.mark.parametrize("policy, kept", [
+    (telemetry.DROP_OLDEST, [3, 4, 5]),
+    (telemetry.DROP_NEWEST, [0, 1, 2]),
+])
+def test_drop_policy(policy, kept):
+    export = SlowExport()
+    export.release.set()
+    # Huge batch size and interval, so nothing is exported before close.
+    queue = telemetry.BackgroundExporter(export, max_queue=3, batch_size=100, interval=60, policy=policy)
+    for i in range(6):
+        queue.put(i)
+
+    assert queue.stats()["dropped"] == 3
+    queue.close()
+    assert export.batches == [kept]
+
+
+def test_export_failure_is_counted():
+    def failing(batch):
+        raise ConnectionError("Application Insights is down")
+
+    queue = telemetry.BackgroundExporter(failing, batch_size=2, interval=0.01)
+    queue.put(1)
+    queue.put(2)
+    queue.close()
+    assert queue.stats()["failed"] == 2
+
+
+def test_queue_log_handler():
+    records = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    handler = telemetry.QueueLogHandler(ListHandler(), batch_size=10, interval=0.01)
+    test_logger = logging.getLogger("test_queue_log_handler")
+    test_logger.addHandler(handler)
+    test_logger.propagate = False
+    test_logger.warning("Found %d hives", 3)
+    handler.close()
+
+    assert [r.getMessage() for r in records] == ["Found 3 hives"]
+
+
+def test_queue_span_exporter_uses_emit():
+    class FakeAzureExporter:
+        def __init__(self):
+            self.emitted = []
+
+        def emit(self, batch, event=None):
+            self.emitted.extend(batch)
+
+    azure = FakeAzureExporter()
+    exporter = telemetry.QueueSpanExporter(azure, batch_size=10, interval=0.01)
+    exporter.export(["span-1", "span-2"])
+    exporter.queue.close()
+    assert azure.emitted == ["span-1", "span-2"]
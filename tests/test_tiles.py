@@ -0,0 +1,93 @@
+import json
+
+from beemap import tiles
+from beemap.clustering import ClusterIndex
+from beemap.hives import Hive
+
+JYVASKYLA = (62.24147, 25.72088)
+
+
+def test_tile_for_is_inside_tile_bbox():
+    for z in range(0, tiles.MAX_ZOOM + 1):
+        x, y = tiles.tile_for(*JYVASKYLA, z)
+        assert tiles.tile_bbox(z, x, y).contains(*JYVASKYLA)
+
+
+def test_tile_features():
+    hives = [Hive(1, *JYVASKYLA, "Maija", "Mehiläinen"), Hive(2, 60.17, 24.94, "Matti", "Mehiläinen")]
+    index = tiles.TileIndex(hives, ClusterIndex(hives, max_zoom=14))
+
+    # Deep zoom has the hive itself
+    x, y = tiles.tile_for(*JYVASKYLA, 15)
+    features = index.features(15, x, y)
+    assert [f["id"] for f in features] == [1]
+
+    body = json.loads(tiles.encode_geojson(features, lambda hive: hive.firstname))
+    assert body["features"][0]["properties"] == {"count": 1, "id": 1, "description": "Maija"}
+
+    # World tile has both in clusters
+    assert sum(f["count"] for f in index.features(0, 0, 0)) == 2
+
+
+def test_tile_index_patching():
+    maija = Hive(1, *JYVASKYLA, "Maija", "Mehiläinen")
+    index = tiles.TileIndex([], ClusterIndex([], max_zoom=14))
+    x, y = tiles.tile_for(*JYVASKYLA, 15)
+
+    index.add([maija, Hive(2, 60.17, 24.94, "Matti", "Mehiläinen")])
+    assert [f["id"] for f in index.features(15, x, y)] == [1]
+    assert sum(f["count"] for f in index.features(0, 0, 0)) == 2
+
+    index.remove([maija, maija])
+    assert index.features(15, x, y) == []
+    assert sum(f["count"] for f in index.features(0, 0, 0)) == 1
+    assert index.stats() == {"buckets": 1, "changes": 3}
+
+
+def test_encode_mvt():
+    features = [{"lat": JYVASKYLA[0], "lon": JYVASKYLA[1], "count": 3}]
+    x, y = tiles.tile_for(*JYVASKYLA, 5)
+    body = tiles.encode_mvt(features, 5, x, y, str)
+    # Tile.layers field with layer named "hives"
+    assert body[0] == 0x1a
+    assert b"\x0a\x05hives" in body
+
+
+def test_tile_cache_evicts_least_recently_used():
+    cache = tiles.TileCache(max_bytes=25)
+    cache.put((1, 0, 0), tiles.Tile(b"a" * 10), cache.generation)
+    cache.put((1, 0, 1), tiles.Tile(b"b" * 10), cache.generation)
+    # Touch first, so the second one is the least recently used
+    assert cache.get((1, 0, 0))
+    cache.put((1, 1, 0), tiles.Tile(b"c" * 10), cache.generation)
+
+    assert cache.get((1, 0, 1)) is None
+    assert cache.get((1, 0, 0)) is not None
+    assert cache.size == 20
+    assert cache.stats()["evictions"] == 1
+
+
+def test_tile_cache_invalidates_only_tiles_with_point():
+    cache = tiles.TileCache()
+    x, y = tiles.tile_for(*JYVASKYLA, 10)
+    cache.put((10, x, y, "geojson"), tiles.Tile(b"{}"), cache.generation)
+    cache.put((10, x, y, "mvt"), tiles.Tile(b""), cache.generation)
+    cache.put((10, x + 1, y, "geojson"), tiles.Tile(b"{}"), cache.generation)
+
+    cache.invalidate_point(*JYVASKYLA)
+    assert cache.get((10, x, y, "geojson")) is None
+    assert cache.get((10, x, y, "mvt")) is None
+    assert cache.get((10, x + 1, y, "geojson")) is not None
+
+
+def test_tile_cache_ignores_tiles_built_before_invalidation():
+    cache = tiles.TileCache()
+    generation = cache.generation
+    cache.invalidate_point(*JYVASKYLA)
+    cache.put((0, 0, 0), tiles.Tile(b"old"), generation)
+    assert cache.get((0, 0, 0)) is None
+
+
+def test_tile_etag_is_content_based():
+    assert tiles.Tile(b"abc").etag == tiles.Tile(b"abc").etag
+    assert tiles.Tile(b"abc").etag != tiles.Tile(b"abd").etag
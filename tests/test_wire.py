@@ -0,0 +1,53 @@
+import pytest
+
+from beemap import wire
+from beemap.hives import Hive
+from beemap.hiveset import HiveSet
+
+HIVES = [
+    Hive(5629499534213120, 60.17, 24.94, "Maija", "Mehiläinen"),
+    Hive(12, -33.86, 151.21, "Åke", "Kimalainen"),
+    Hive(13, 64.0, -179.5, "Maija", "Kimalainen"),
+]
+
+
+def test_binary_roundtrip():
+    data = wire.encode_binary(HiveSet.from_hives(HIVES))
+
+    # Sorted by id.
+    assert wire.decode_binary(data) == sorted(HIVES)
+
+    with pytest.raises(ValueError):
+        wire.decode_binary(b"nonsense")
+    with pytest.raises(ValueError):
+        wire.decode_binary(data[:-3])
+
+
+def test_binary_string_ids():
+    hives = [hive._replace(id=f"avain-{i}") for i, hive in enumerate(HIVES)]
+    assert wire.decode_binary(wire.encode_binary(HiveSet.from_hives(hives))) == hives
+
+
+def test_polyline():
+    """ Example from Google's polyline algorithm documentation """
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+    deltas = []
+    previous = (0, 0)
+    for lat, lon in points:
+        lat, lon = round(lat * 1e5), round(lon * 1e5)
+        deltas += [lat - previous[0], lon - previous[1]]
+        previous = (lat, lon)
+
+    assert wire.encode_polyline(deltas) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert wire.decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@") == deltas
+
+
+def test_polyline_json():
+    payload = wire.encode_polyline_json(HiveSet.from_hives(HIVES))
+
+    assert payload["count"] == 3
+    assert payload["ids"] == [12, 1, 5629499534213120 - 13]
+    deltas = wire.decode_polyline(payload["points"])
+    assert (deltas[0], deltas[1]) == (-3386000, 15121000)
+    names = [payload["strings"][i] for i in payload["names"][:2]]
+    assert names == ["Åke", "Kimalainen"]
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from beemap.writebehind import BufferFull
+from beemap.writebehind import WriteBehindBuffer
+
+
+class Recorder:
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, items):
+        self.gate.wait(5)
+        self.batches.append(list(items))
+
+
+def test_flush_on_size():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder, max_size=3, max_delay=60)
+    futures = [buffer.submit(i) for i in range(3)]
+    for future in futures:
+        assert future.result(timeout=5)
+    assert recorder.batches == [[0, 1, 2]]
+    buffer.close()
+
+
+def test_flush_on_delay():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder, max_size=100, max_delay=0.05)
+    buffer.submit("a").result(timeout=5)
+    assert recorder.batches == [["a"]]
+    buffer.close()
+
+
+def test_flush_error_is_raised_to_waiters():
+    def failing(items):
+        raise ConnectionError("Datastore is down")
+
+    buffer = WriteBehindBuffer(failing, max_size=1)
+    with pytest.raises(ConnectionError):
+        buffer.submit("a").result(timeout=5)
+    assert buffer.stats()["failed"] == 1
+    buffer.close()
+
+
+def test_close_flushes_pending():
+    recorder = Recorder()
+    buffer = WriteBehindBuffer(recorder, max_size=100, max_delay=60)
+    buffer.submit("a")
+    buffer.submit("b")
+    buffer.close()
+    assert recorder.batches == [["a", "b"]]
+
+    with pytest.raises(RuntimeError):
+        buffer.submit("c")
+
+
+def test_buffer_is_bounded():
+    recorder = Recorder()
+    recorder.gate.clear()
+    buffer = WriteBehindBuffer(recorder, max_size=1, max_pending=2)
+    # First one is taken by the (blocked) flush thread
+    buffer.submit(1)
+    while buffer.stats()["pending"]:
+        pass
+    buffer.submit(2)
+    buffer.submit(3)
+    with pytest.raises(BufferFull):
+        buffer.submit(4)
+
+    recorder.gate.set()
+    buffer.close()
+    assert [item for batch in recorder.batches for item in batch] == [1, 2, 3]